@@ -1,27 +1,57 @@
 from django.contrib import admin
 
-from .models import User, Listing, Bid, Watchlist, Comment
+from .models import (User, Category, Listing, Bid, Offer, ProxyBid, Watchlist,
+                     Comment, Notification)
 
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ("id", "username", "email", "last_login")
 
 
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "slug", "active_count")
+    # Maintained by the app; see CategoryManager.adjust_active_count
+    readonly_fields = ("active_count",)
+
+
 class ListingAdmin(admin.ModelAdmin):
     list_display = ("id", "title", "starting_bid", "category", "seller_id")
+    list_select_related = ("category",)
+    # Maintained by the app as listings are bid on, closed and commented on;
+    # category and active move the categories' active counts (see
+    # CategoryManager.adjust_active_count), so they change only in the app
+    readonly_fields = ("category", "active", "image_digest", "winner",
+                       "version", "comment_count")
 
 
 class BidAdmin(admin.ModelAdmin):
     list_display = ("id", "is_open", "starting_bid", "offer_count")
 
 
+class OfferAdmin(admin.ModelAdmin):
+    list_display = ("id", "listing_id", "bidder_id", "amount", "date_placed")
+
+
+class ProxyBidAdmin(admin.ModelAdmin):
+    list_display = ("id", "listing_id", "bidder_id", "maximum", "date_placed")
+
+
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ("id", "recipient_id", "kind", "listing_id", "attempts",
+                    "next_attempt")
+
+
 class CommentAdmin(admin.ModelAdmin):
     list_display = ("id", "author_id", "item_id", "content", "date_published")
 
 
 # Register your models here.
 admin.site.register(User, UserAdmin)
+admin.site.register(Category, CategoryAdmin)
 admin.site.register(Listing, ListingAdmin)
 admin.site.register(Bid, BidAdmin)
+admin.site.register(Offer, OfferAdmin)
+admin.site.register(ProxyBid, ProxyBidAdmin)
 admin.site.register(Watchlist)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(Notification, NotificationAdmin)
@@ -0,0 +1,181 @@
+"""
+Read-only JSON API, version 1.
+
+    GET /api/v1/listings            active listings, newest first
+    GET /api/v1/listings/<id>       one listing, open or closed
+    GET /api/v1/categories          every category, by name
+
+Listings take ``fields=title,current_bid,...`` to return only those
+fields; the listing collection also takes ``category=<slug>`` and pages
+with ``cursor``/``limit``, returning ``next_cursor``. Rows are read with
+``values()`` and serialized straight from it: no model instances, no
+templates.
+
+Every response carries an ETag derived from the listings' versions (and
+comment counts, which change without a version bump) and, for a single
+listing, a Last-Modified time, so a client revalidating an unchanged
+resource gets a 304 with no body to build.
+"""
+import hashlib
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .models import Category, Listing
+from .pagination import keyset_page
+
+
+# Public field name -> values() lookup
+LISTING_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "description": "description",
+    "image": "image",
+    "category": "category__slug",
+    "seller": "seller__username",
+    "starting_bid": "starting_bid",
+    "current_bid": "top_offer",
+    "bid_count": "offer_count",
+    "comment_count": "comment_count",
+    "active": "active",
+    "ends_at": "ends_at",
+    "created": "date_created",
+    "modified": "date_modified",
+}
+
+# Fields that need the current-bid subqueries
+BID_FIELDS = {"current_bid", "bid_count"}
+
+# Read for every listing, whatever was asked for: the ETag inputs and the
+# keyset cursor columns
+STATE_COLUMNS = ("id", "version", "comment_count", "date_modified",
+                 "date_created")
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def _json(data):
+    return JsonResponse(data, safe=False,
+                        json_dumps_params={"separators": (",", ":")})
+
+
+def _requested_fields(request):
+    value = request.GET.get("fields")
+    if not value:
+        return list(LISTING_FIELDS)
+
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in LISTING_FIELDS]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}.")
+    return names
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get("limit", PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be a number.")
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _listing_rows(queryset, fields):
+    if BID_FIELDS.intersection(fields):
+        queryset = queryset.with_current_bid()
+    columns = {LISTING_FIELDS[name] for name in fields}
+    return queryset.values(*columns.union(STATE_COLUMNS))
+
+
+def _serialize(row, fields):
+    data = {name: row[LISTING_FIELDS[name]] for name in fields}
+    if "bid_count" in data:
+        data["bid_count"] = data["bid_count"] or 0
+    return data
+
+
+def _etag(*parts):
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def _conditional(request, etag, modified, build):
+    """
+    Answer 304 (or 412) if the client's copy is current; otherwise call
+    ``build()`` for the response body.
+    """
+    last_modified = int(modified.timestamp()) if modified else None
+
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = _json(build())
+
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # Cacheable, but only after revalidating
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_safe
+def listings(request):
+    try:
+        fields = _requested_fields(request)
+        size = _page_size(request)
+    except BadRequest as error:
+        return _error(str(error), 400)
+
+    group = Listing.objects.filter(active=True)
+    if request.GET.get("category"):
+        group = group.filter(category__slug=request.GET["category"])
+
+    rows, next_cursor = keyset_page(_listing_rows(group, fields),
+                                    request.GET.get("cursor"), size)
+
+    # No Last-Modified: a listing closed off the page lets an older one in,
+    # and the newest date_modified among the rows needn't move forward
+    etag = _etag(fields, next_cursor,
+                 [(row["id"], row["version"], row["comment_count"])
+                  for row in rows])
+
+    return _conditional(request, etag, None, lambda: {
+        "results": [_serialize(row, fields) for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+
+@require_safe
+def listing(request, item_id):
+    try:
+        fields = _requested_fields(request)
+    except BadRequest as error:
+        return _error(str(error), 400)
+
+    row = _listing_rows(Listing.objects.filter(pk=item_id), fields).first()
+    if row is None:
+        return _error("Listing not found.", 404)
+
+    etag = _etag(fields, row["id"], row["version"], row["comment_count"])
+    return _conditional(request, etag, row["date_modified"],
+                        lambda: _serialize(row, fields))
+
+
+@require_safe
+def categories(request):
+    rows = list(Category.objects.order_by("name")
+                .values("name", "slug", "active_count"))
+
+    etag = _etag([tuple(row.values()) for row in rows])
+    return _conditional(request, etag, None, lambda: {"results": rows})
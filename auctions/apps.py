@@ -1,5 +1,36 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+from .database import apply_pragmas
 
 
 class AuctionsConfig(AppConfig):
     name = 'auctions'
+
+    def ready(self):
+        connection_created.connect(apply_pragmas,
+                                   dispatch_uid="auctions.apply_pragmas")
+
+        # Keep CachedModelBackend's copies of users current
+        from . import backends
+
+        user = self.get_model("User")
+        post_save.connect(backends.user_changed, sender=user,
+                          dispatch_uid="auctions.user_saved")
+        post_delete.connect(backends.user_changed, sender=user,
+                            dispatch_uid="auctions.user_deleted")
+        user_logged_out.connect(backends.user_logged_out,
+                                dispatch_uid="auctions.user_logged_out")
+
+        # Keep the search index in step with listings saved or deleted
+        # through the ORM (bulk imports and queryset updates index their
+        # own rows)
+        from . import search
+
+        listing = self.get_model("Listing")
+        post_save.connect(search.listing_saved, sender=listing,
+                          dispatch_uid="auctions.listing_saved")
+        post_delete.connect(search.listing_deleted, sender=listing,
+                            dispatch_uid="auctions.listing_deleted")
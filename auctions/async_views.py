@@ -0,0 +1,149 @@
+"""
+Native async versions of the hot read views, for ASGI deployments.
+
+``auctions/urls.py`` routes index, listing, category, categories and
+watchlist here when ``ASYNC_VIEWS`` is on (``COMMERCE_ASYNC_VIEWS=1``).
+Under ASGI they run on the event loop instead of each holding a thread of
+the sync bridge for the whole request; under WSGI every call would need an
+event loop of its own, so the sync views stay the default.
+
+Each view reads through the async ORM and awaits its independent queries
+together. Django 4.2 still runs a request's queries one after another on
+its sync thread, so today that saves thread hops rather than overlapping
+queries. Templates only see fully loaded objects, because lazy loads
+aren't allowed on the event loop. POSTs go to the sync views.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import render
+
+from . import views
+from .forms import BidForm, CommentForm, ProxyBidForm
+from .models import Bid, Category, Listing
+from .pagination import akeyset_page
+from .related import related_listings
+from .views import (COMMENT_ORDER, COMMENTS_PER_PAGE, LISTINGS_PER_PAGE,
+                    comment_thread, listing_feed)
+from .watchlists import watched_ids
+
+
+async def _user(request):
+    # The first read of the lazy request.user runs the session and user
+    # queries, which can't run on the event loop
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def _list(queryset):
+    return [item async for item in queryset]
+
+
+async def _value(value):
+    return value
+
+
+# Default page (displays the active listings, newest first):
+async def index(request):
+    _, (active_listings, next_cursor) = await asyncio.gather(
+        _user(request),
+        akeyset_page(listing_feed(), request.GET.get("cursor"),
+                     LISTINGS_PER_PAGE))
+
+    return render(request,
+                  "auctions/index.html", {"listings": active_listings,
+                                          "next_cursor": next_cursor})
+
+
+# View for each Individual listing:
+async def listing(request, item_id):
+    if request.method != "GET":
+        return await sync_to_async(views.listing)(request, item_id)
+
+    user = await _user(request)
+    signed_in = user.is_authenticated
+
+    # Listing, first page of comments, current bid and watchlist membership
+    listing, (comments, comments_cursor), current_bid, watched = \
+        await asyncio.gather(
+            Listing.objects.select_related("seller", "category")
+            .filter(pk=item_id).afirst(),
+            akeyset_page(comment_thread(item_id), None, COMMENTS_PER_PAGE,
+                         fields=COMMENT_ORDER),
+            Bid.objects.select_related("bidder", "seller")
+            .filter(listing_id=item_id).afirst()
+            if signed_in else _value(None),
+            sync_to_async(watched_ids)(user)
+            if signed_in else _value(frozenset()))
+
+    # 404
+    if listing is None:
+        return render(request, "auctions/error_page.html",
+                      {"error": "Listing not found."})
+
+    # Sidebar listings (cached); needs the listing's category
+    related = await sync_to_async(related_listings)(listing)
+
+    context = {"listing": listing, "comments": comments,
+               "comments_cursor": comments_cursor, "related": related}
+    if not signed_in:
+        return render(request, "auctions/listing.html",
+                      {**context, "user": None})
+
+    return render(request, "auctions/listing.html",
+                  {**context, "user": user, "bid": current_bid,
+                   "is_watched": listing.pk in watched,
+                   "form": BidForm(), "proxy_form": ProxyBidForm(),
+                   "comment": CommentForm()})
+
+
+# View for listing all categories
+async def categories(request):
+    _, all_categories = await asyncio.gather(
+        _user(request), _list(Category.objects.order_by("name")))
+
+    return render(request, "auctions/category_list.html",
+                  {"categories": all_categories})
+
+
+# View for each category
+async def category(request, slug):
+    _, current_category, (group, next_cursor) = await asyncio.gather(
+        _user(request),
+        Category.objects.filter(slug=slug).afirst(),
+        akeyset_page(listing_feed().filter(category__slug=slug),
+                     request.GET.get("cursor"), LISTINGS_PER_PAGE))
+
+    if current_category is None:
+        return render(request, "auctions/error_page.html",
+                      {"error": "Category not found."})
+
+    return render(request, "auctions/category.html",
+                  {"group": group,
+                   "category": current_category,
+                   "title": current_category.name,
+                   "next_cursor": next_cursor})
+
+
+# View for watchlists
+async def watchlist(request):
+    if request.method == "POST":
+        return await sync_to_async(views.watchlist)(request)
+
+    user = await _user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), "login")
+
+    watchlist_items, next_cursor = await akeyset_page(
+        Listing.objects.filter(watchlist_in__user=user.pk)
+        .select_related("seller").with_current_bid(),
+        request.GET.get("cursor"), LISTINGS_PER_PAGE)
+
+    message = ""
+    if not watchlist_items and not request.GET.get("cursor"):
+        message = "Your watchlist is empty."
+
+    return render(request, "auctions/watchlist.html",
+                  {"watchlist": watchlist_items, "message": message,
+                   "next_cursor": next_cursor})
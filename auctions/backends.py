@@ -0,0 +1,60 @@
+"""
+Authentication backend that caches signed-in users.
+
+``AuthenticationMiddleware`` loads ``request.user`` through the backend's
+``get_user()`` on each request that reads it. ``CachedModelBackend``
+answers from the default cache instead of the user table. A user's entry
+is dropped when they log out or are saved or deleted, which covers
+password changes (``set_password()`` is followed by ``save()``), and
+expires after ``USER_CACHE_TIMEOUT`` in any case. That bounds how long a
+worker process with its own local-memory cache can keep a stale copy, and
+so keep accepting sessions a password change elsewhere should have ended.
+Entries are filled from the primary, never from a replica that may lag.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .routers import cached_from_primary
+
+
+USER_CACHE_TIMEOUT = 60
+
+
+def _key(user_id):
+    return f"auth:user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        key = _key(user_id)
+        user = cache.get(key)
+        if user is None:
+            # E.g. not a user as they were before a password change
+            try:
+                user = cached_from_primary(
+                    get_user_model()._default_manager).get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+
+            # Inactive users aren't cached
+            if not self.user_can_authenticate(user):
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+
+def forget_user(user_id):
+    cache.delete(_key(user_id))
+
+
+# Signal receivers; connected in AuctionsConfig.ready()
+
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+def user_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
@@ -0,0 +1,10 @@
+"""
+Benchmark suite for the auctions app.
+
+Run it with ``python manage.py benchmark``; it builds a synthetic catalogue
+in a throwaway test database (``data``), replays scripted workloads
+(``workloads``) through the Django test client, a local threaded WSGI
+server or the ASGI application (``transports``), and reports throughput,
+latency percentiles, queries per request and peak RSS (``stats``),
+optionally against a stored baseline.
+"""
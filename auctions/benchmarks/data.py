@@ -0,0 +1,165 @@
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from auctions.models import (User, Category, Listing, Bid, Offer, Comment,
+                             Watchlist)
+from auctions.search import get_backend
+from auctions.stats import rebuild as rebuild_stats
+
+
+# Preset catalogue sizes; any count can also be overridden on its own
+SCALES = {
+    "tiny": {"users": 20, "listings": 200, "bids": 400, "comments": 400,
+             "watched": 10},
+    "small": {"users": 200, "listings": 5_000, "bids": 20_000,
+              "comments": 10_000, "watched": 50},
+    "medium": {"users": 2_000, "listings": 100_000, "bids": 300_000,
+               "comments": 200_000, "watched": 200},
+    "large": {"users": 20_000, "listings": 1_000_000, "bids": 3_000_000,
+              "comments": 2_000_000, "watched": 500},
+}
+
+CATEGORIES = 40
+
+PASSWORD = "bench-password"
+
+
+@dataclass
+class Dataset:
+    user_ids: list
+    listing_ids: list
+    category_slugs: list
+    # listing id -> (seller id, lowest price the next bid must beat)
+    prices: dict = field(default_factory=dict)
+
+
+# Run the block against a fresh test database, destroyed afterwards:
+@contextlib.contextmanager
+def throwaway_database(verbosity=0, on_disk=False):
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings.get("NAME")
+
+    # SQLite test databases live in memory, where journal and locking
+    # settings have nothing to act on
+    directory = None
+    if on_disk and connection.vendor == "sqlite":
+        directory = tempfile.mkdtemp()
+        test_settings["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True,
+                                       serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        if directory is not None:
+            test_settings["NAME"] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def generate(users, listings, bids, comments, watched, seed=0,
+             batch_size=5000, log=None):
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+        User(username=f"bench{i}", email=f"bench{i}@example.com",
+             password=password)
+        for i in range(users)
+    ], batch_size=batch_size)
+    user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+    log(f"{len(user_ids)} users")
+
+    categories = [Category.objects.for_name(f"Category {i}")
+                  for i in range(CATEGORIES)]
+
+    for start in range(0, listings, batch_size):
+        count = min(batch_size, listings - start)
+        with transaction.atomic():
+            Listing.objects.bulk_create([
+                Listing(seller_id=rng.choice(user_ids),
+                        title=f"Item {start + i}",
+                        description=f"Synthetic listing {start + i}",
+                        starting_bid=rng.randint(1, 500),
+                        category=rng.choice(categories))
+                for i in range(count)
+            ])
+    sellers, starting = {}, {}
+    for pk, seller_id, starting_bid in Listing.objects \
+            .values_list("pk", "seller_id", "starting_bid"):
+        sellers[pk] = seller_id
+        starting[pk] = starting_bid
+    for category in categories:
+        category.active_count = category.listings.count()
+        category.save(update_fields=["active_count"])
+    listing_ids = sorted(sellers)
+    log(f"{len(listing_ids)} listings")
+
+    # Bid history first, then one current-price row per listing
+    current = {}
+    counts = defaultdict(int)
+    history = []
+    for _ in range(bids):
+        listing_id = rng.choice(listing_ids)
+        bidder_id = rng.choice(user_ids)
+        if bidder_id == sellers[listing_id]:
+            continue
+        amount = current.get(listing_id, (0, None))[0] + rng.randint(1, 20)
+        current[listing_id] = (amount, bidder_id)
+        counts[listing_id] += 1
+        history.append(Offer(listing_id=listing_id, bidder_id=bidder_id,
+                             amount=amount))
+    Offer.objects.bulk_create(history, batch_size=batch_size)
+    Bid.objects.bulk_create([
+        Bid(listing_id=listing_id, seller_id=sellers[listing_id],
+            starting_bid=1, offer=amount, bidder_id=bidder_id,
+            offer_count=counts[listing_id])
+        for listing_id, (amount, bidder_id) in current.items()
+    ], batch_size=batch_size)
+    log(f"{len(history)} bids")
+
+    Comment.objects.bulk_create([
+        Comment(item_id=rng.choice(listing_ids), content="Synthetic comment",
+                author_id=rng.choice(user_ids))
+        for _ in range(comments)
+    ], batch_size=batch_size)
+    counts = Comment.objects.filter(item=OuterRef("pk")).order_by() \
+        .values("item").annotate(count=Count("*")).values("count")
+    Listing.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+    log(f"{comments} comments")
+
+    Watchlist.objects.bulk_create([Watchlist(user_id=user_id)
+                                   for user_id in user_ids],
+                                  batch_size=batch_size)
+    through = Watchlist.listings.through
+    entries = []
+    for watchlist_id in Watchlist.objects.values_list("pk", flat=True):
+        for listing_id in rng.sample(listing_ids,
+                                     min(watched, len(listing_ids))):
+            entries.append(through(watchlist_id=watchlist_id,
+                                   listing_id=listing_id))
+    through.objects.bulk_create(entries, batch_size=batch_size)
+    log(f"{len(entries)} watchlist entries")
+
+    get_backend().index(listing_ids)
+    rebuild_stats()
+
+    prices = {listing_id: (sellers[listing_id],
+                           max(current.get(listing_id, (0, None))[0],
+                               starting[listing_id]))
+              for listing_id in listing_ids}
+    return Dataset(user_ids=user_ids, listing_ids=listing_ids,
+                   category_slugs=[category.slug for category in categories],
+                   prices=prices)
@@ -0,0 +1,190 @@
+"""
+Ways of sending benchmark requests to the app. ``session(user)`` returns a
+callable ``request(method, path, data=None) -> status`` bound to one
+(optionally logged-in) user; sessions are not shared between threads.
+"""
+import asyncio
+import http.client
+import threading
+from urllib.parse import urlencode
+
+from django.core.asgi import get_asgi_application
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+
+def _cookies(user):
+    # A real session for the user, plus a CSRF secret sent back as a header
+    cookies = {"csrftoken": get_random_string(32)}
+    if user is not None:
+        client = Client()
+        client.force_login(user)
+        cookies["sessionid"] = client.cookies["sessionid"].value
+    return cookies
+
+
+def _headers(cookies):
+    return {
+        "Cookie": "; ".join(f"{key}={value}"
+                            for key, value in cookies.items()),
+        "X-CSRFToken": cookies["csrftoken"],
+    }
+
+
+class ClientTransport:
+    """In-process Django test client: no sockets, no CSRF enforcement."""
+
+    name = "client"
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def session(self, user=None):
+        client = Client(raise_request_exception=False)
+        if user is not None:
+            client.force_login(user)
+
+        def request(method, path, data=None):
+            if method == "POST":
+                response = client.post(path, data or {})
+            else:
+                response = client.get(path)
+            return response.status_code
+
+        return request
+
+
+class _QuietHandler(WSGIRequestHandler):
+    # Headers and body go out in separate writes; without this each
+    # keep-alive response waits out the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WSGITransport:
+    """Threaded local WSGI server (runserver's) on an ephemeral port."""
+
+    name = "wsgi"
+
+    def start(self):
+        self.server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler,
+                                         allow_reuse_address=False)
+        self.server.set_app(get_wsgi_application())
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def session(self, user=None):
+        host, port = self.server.server_address[:2]
+        headers = _headers(_cookies(user))
+        connection = [http.client.HTTPConnection(host, port, timeout=60)]
+
+        def request(method, path, data=None):
+            body = None
+            request_headers = dict(headers)
+            if data is not None:
+                body = urlencode(data)
+                request_headers["Content-Type"] = \
+                    "application/x-www-form-urlencoded"
+
+            # One retry on a fresh connection if the server closed ours
+            for attempt in range(2):
+                try:
+                    connection[0].request(method, path, body,
+                                          request_headers)
+                    response = connection[0].getresponse()
+                    response.read()
+                    return response.status
+                except (http.client.HTTPException, OSError):
+                    connection[0].close()
+                    connection[0] = http.client.HTTPConnection(
+                        host, port, timeout=60)
+                    if attempt:
+                        raise
+
+        return request
+
+
+class ASGITransport:
+    """
+    The project's ASGI application driven in-process on its own event loop,
+    so concurrent sessions share one loop like they would under an ASGI
+    server, minus the socket handling.
+    """
+
+    name = "asgi"
+
+    def start(self):
+        self.app = get_asgi_application()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def session(self, user=None):
+        headers = [(key.lower().encode(), value.encode())
+                   for key, value in _headers(_cookies(user)).items()]
+
+        def request(method, path, data=None):
+            return asyncio.run_coroutine_threadsafe(
+                self._request(method, path, headers, data), self.loop) \
+                .result()
+
+        return request
+
+    async def _request(self, method, path, headers, data):
+        path, _, query = path.partition("?")
+        body = b""
+        headers = list(headers) + [(b"host", b"localhost")]
+        if data is not None:
+            body = urlencode(data).encode()
+            headers.append((b"content-type",
+                            b"application/x-www-form-urlencoded"))
+            headers.append((b"content-length", str(len(body)).encode()))
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"},
+            "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "headers": headers,
+            "client": ("127.0.0.1", 0), "server": ("localhost", 80),
+        }
+        pending = [{"type": "http.request", "body": body,
+                    "more_body": False}]
+        status = []
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            # Nothing more to read; the client never disconnects
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await self.app(scope, receive, send)
+        return status[0]
+
+
+TRANSPORTS = {
+    transport.name: transport
+    for transport in (ClientTransport, WSGITransport, ASGITransport)
+}
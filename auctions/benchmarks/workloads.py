@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from auctions.models import User
+
+from .stats import summarize
+
+
+@dataclass
+class Workload:
+    name: str
+    # Whether each session logs in as a random generated user first
+    authenticated: bool
+    # (dataset, rng, user id or None) -> (method, path, data)
+    next_request: callable
+
+
+def _index(dataset, rng, user_id):
+    return "GET", "/", None
+
+
+def _listing(dataset, rng, user_id):
+    return "GET", f"/listing/{rng.choice(dataset.listing_ids)}/", None
+
+
+def _comments(dataset, rng, user_id):
+    listing_id = rng.choice(dataset.listing_ids)
+    return "GET", f"/listing/{listing_id}/comments/", None
+
+
+def _category(dataset, rng, user_id):
+    return "GET", f"/categories/{rng.choice(dataset.category_slugs)}/", None
+
+
+def _categories(dataset, rng, user_id):
+    return "GET", "/categories/", None
+
+
+def _watchlist(dataset, rng, user_id):
+    return "GET", "/watchlist/", None
+
+
+def _search(dataset, rng, user_id):
+    return "GET", f"/search/?q=item+{rng.randint(1, 99)}", None
+
+
+def _stats(dataset, rng, user_id):
+    return "GET", "/stats/", None
+
+
+def _api_listings(dataset, rng, user_id):
+    return "GET", "/api/v1/listings", None
+
+
+def _api_listing(dataset, rng, user_id):
+    return "GET", f"/api/v1/listings/{rng.choice(dataset.listing_ids)}", None
+
+
+def _bidding(dataset, rng, user_id):
+    # Sellers can't bid on their own listings; skip to one they can
+    while True:
+        listing_id = rng.choice(dataset.listing_ids)
+        seller_id, price = dataset.prices[listing_id]
+        if seller_id != user_id:
+            break
+    offer = price + rng.randint(1, 5)
+    dataset.prices[listing_id] = (seller_id, offer)
+    return "POST", "/bidding/", {"listing": listing_id, "offer": offer}
+
+
+WORKLOADS = {
+    workload.name: workload
+    for workload in [
+        Workload("index", False, _index),
+        Workload("listing", True, _listing),
+        Workload("comments", False, _comments),
+        Workload("category", False, _category),
+        Workload("categories", False, _categories),
+        Workload("watchlist", True, _watchlist),
+        Workload("search", False, _search),
+        Workload("stats", False, _stats),
+        Workload("api_listings", False, _api_listings),
+        Workload("api_listing", False, _api_listing),
+        Workload("bidding", True, _bidding),
+    ]
+}
+
+DEFAULT_WORKLOADS = ["index", "listing", "bidding", "watchlist",
+                     "categories"]
+
+
+def run_workload(transport, dataset, workload, requests, concurrency,
+                 counter, seed=0):
+    """
+    Replay ``requests`` requests of ``workload`` from ``concurrency``
+    threads, each with its own session, and summarize them. One untimed
+    warm-up request per session runs first.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    marks = {}
+
+    # Barrier actions run once every thread has arrived, before any leaves
+    def start():
+        marks["queries"] = counter.count
+        marks["started"] = time.perf_counter()
+
+    def finish():
+        marks["queries"] = counter.count - marks["queries"]
+        marks["elapsed"] = time.perf_counter() - marks["started"]
+
+    ready = threading.Barrier(concurrency, action=start)
+    done = threading.Barrier(concurrency, action=finish)
+
+    def client(index, count):
+        rng = random.Random(seed * 1000 + index)
+        user = None
+        if workload.authenticated:
+            user = User.objects.get(pk=rng.choice(dataset.user_ids))
+        user_id = user.pk if user else None
+        request = transport.session(user)
+        request(*workload.next_request(dataset, rng, user_id))
+
+        ready.wait()
+        timings = []
+        failures = 0
+        for _ in range(count):
+            method, path, data = workload.next_request(dataset, rng,
+                                                       user_id)
+            started = time.perf_counter()
+            status = request(method, path, data)
+            timings.append((time.perf_counter() - started) * 1000)
+            failures += status >= 500
+        with lock:
+            latencies.extend(timings)
+            errors.append(failures)
+        done.wait()
+
+    threads = [threading.Thread(
+        target=client,
+        args=(i, requests // concurrency + (i < requests % concurrency)))
+        for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    result = summarize(latencies, marks["elapsed"])
+    result["queries_per_request"] = round(marks["queries"] / len(latencies),
+                                          2)
+    result["errors"] = sum(errors)
+    return result
+
+
+# Relative change of each headline metric against a stored run:
+def compare(results, baseline):
+    deltas = {}
+    for name, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if not previous:
+            continue
+        deltas[name] = {
+            metric: _change(previous.get(metric), current[metric])
+            for metric in ("throughput", "p50_ms", "p95_ms", "p99_ms",
+                           "queries_per_request")
+        }
+    return deltas
+
+
+def _change(before, after):
+    if not before:
+        return None
+    return round((after - before) / before * 100, 1)
@@ -0,0 +1,183 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Bid, Listing, Offer, ProxyBid
+from .notifications import notify_outbid
+from .proxies import Proxy, resolve
+from .stats import record_bid
+
+
+# Step by which proxies outbid each other
+PROXY_INCREMENT = 1
+
+
+class BidRejected(Exception):
+    """Raised when an offer can't be accepted; the message is user-facing."""
+
+
+# Accept an offer on a listing, or raise BidRejected:
+def place_bid(listing, bidder, offer):
+    """
+    Record ``offer`` as the listing's current bid and append it to the
+    listing's bid history.
+
+    The current price record is only ever moved forward by a conditional
+    ``UPDATE ... WHERE offer < new_offer``, so two concurrent bidders can't
+    both win against the same price and ``offer_count`` can't lose an
+    increment. The history row is written in the same transaction, as are
+    the answers of any proxies able to outbid the offer and the notices
+    to the bidders they displaced; the last Offer recorded is returned.
+    """
+    offer = int(offer)
+    _check(listing, bidder, offer)
+
+    with transaction.atomic():
+        # Taken first, so proxy resolutions on the listing queue behind us;
+        # the new price shows on the listing's cached card
+        _lock_open(listing)
+
+        # Two passes: the second one runs if another request created the
+        # current price record between our UPDATE and our INSERT
+        for _ in range(2):
+            if _raise_price(listing, bidder, offer):
+                break
+
+            current = Bid.objects.filter(listing=listing) \
+                .values("is_open").first()
+
+            if current is None:
+                if _open_price(listing, bidder, offer):
+                    break
+                continue
+
+            if not current["is_open"]:
+                raise BidRejected("Auction is closed.")
+            raise BidRejected("Bid is too low.")
+
+        else:
+            raise BidRejected("Bid is too low.")
+
+        offer = Offer.objects.create(listing=listing, bidder=bidder,
+                                     amount=offer)
+        record_bid(offer, listing.category_id)
+
+        # Proxies above the new price answer it
+        _, response = _settle(listing, offer.amount, bidder.pk)
+        notify_outbid(listing.pk, offer.pk, (response or offer).bidder_id)
+        return response or offer
+
+
+# Set a bidder's maximum on a listing and let proxies bid up to it:
+def place_proxy(listing, bidder, maximum):
+    """
+    Store ``maximum`` as the bidder's proxy on the listing, then settle it
+    against every other proxy and the current price in the same
+    transaction; see ``auctions.proxies``.
+
+    Returns the Resolution and the Offer recording the new price, or None
+    if the price record didn't change (e.g. a leader raising their own
+    maximum).
+    """
+    maximum = int(maximum)
+    _check(listing, bidder, maximum)
+
+    with transaction.atomic():
+        # The UPDATE locks the listing's row, so resolutions (and manual
+        # bids) on one listing run one after another
+        _lock_open(listing)
+
+        current = Bid.objects.filter(listing=listing) \
+            .values("is_open", "offer", "bidder").first()
+        price = leader = None
+        if current is not None:
+            if not current["is_open"]:
+                raise BidRejected("Auction is closed.")
+            price, leader = current["offer"], current["bidder"]
+
+            # Enough to outbid the current price, unless it's already ours
+            if maximum < price + (bidder.pk != leader) * PROXY_INCREMENT:
+                raise BidRejected("Bid is too low.")
+
+        placed = timezone.now()
+        if not ProxyBid.objects.filter(listing=listing, bidder=bidder) \
+                .update(maximum=maximum, date_placed=placed):
+            ProxyBid.objects.create(listing=listing, bidder=bidder,
+                                    maximum=maximum, date_placed=placed)
+
+        resolution, offer = _settle(listing, price, leader)
+        if offer is not None:
+            notify_outbid(listing.pk, offer.pk, offer.bidder_id)
+        return resolution, offer
+
+
+def _check(listing, bidder, offer):
+    if bidder.pk == listing.seller_id:
+        raise BidRejected("You can't bid on your own listing.")
+
+    if not listing.active:
+        raise BidRejected("Auction is closed.")
+
+    # Past its end time but not yet swept up by the expiry worker
+    if listing.ends_at is not None and listing.ends_at <= timezone.now():
+        raise BidRejected("Auction has ended.")
+
+    if offer < listing.starting_bid:
+        raise BidRejected("Bid is too low.")
+
+
+def _lock_open(listing):
+    # _check() saw the listing as read before the transaction; a close or
+    # expiry since then must still turn the offer away
+    now = timezone.now()
+    if not Listing.objects.filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+                                  pk=listing.pk, active=True).bump_version():
+        raise BidRejected("Auction is closed.")
+
+
+def _settle(listing, price, leader):
+    # Only proxies that can still reach the price take part
+    proxies = [
+        Proxy(bidder, maximum, (placed, pk))
+        for bidder, maximum, placed, pk in ProxyBid.objects
+        .filter(listing=listing, maximum__gte=price or listing.starting_bid)
+        .values_list("bidder", "maximum", "date_placed", "pk")
+    ]
+    resolution = resolve(proxies, price, leader, listing.starting_bid,
+                         PROXY_INCREMENT)
+    if resolution is None or not resolution.changed:
+        return resolution, None
+
+    if price is None:
+        Bid.objects.create(listing=listing, seller_id=listing.seller_id,
+                           starting_bid=listing.starting_bid,
+                           offer=resolution.price,
+                           bidder_id=resolution.leader, offer_count=1)
+    else:
+        Bid.objects.filter(listing=listing) \
+            .update(offer=resolution.price, bidder=resolution.leader,
+                    offer_count=F("offer_count") + 1)
+
+    offer = Offer.objects.create(listing=listing,
+                                 bidder_id=resolution.leader,
+                                 amount=resolution.price)
+    record_bid(offer, listing.category_id)
+    return resolution, offer
+
+
+def _raise_price(listing, bidder, offer):
+    return Bid.objects.filter(listing=listing, is_open=True,
+                              offer__lt=offer) \
+        .update(offer=offer, bidder=bidder,
+                offer_count=F("offer_count") + 1)
+
+
+def _open_price(listing, bidder, offer):
+    try:
+        with transaction.atomic():
+            Bid.objects.create(listing=listing, seller_id=listing.seller_id,
+                               starting_bid=listing.starting_bid,
+                               offer=offer, bidder=bidder, offer_count=1)
+    except IntegrityError:
+        return False
+    return True
@@ -0,0 +1,42 @@
+"""
+Per-connection database setup, and row claiming for background workers.
+
+SQLite keeps most of its tuning per connection, so the ``PRAGMAS`` of a
+``DATABASES`` entry (see the "sqlite" profile in settings) are run on every
+connection as it is opened.
+"""
+from django.db import connections
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    pragmas = connection.settings_dict.get("PRAGMAS")
+    if connection.vendor != "sqlite" or not pragmas:
+        return
+
+    # On the raw connection: nothing to log, time or wrap
+    for name, value in pragmas.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+def claim_rows(queryset, using):
+    """
+    ``queryset``, locked for the current transaction so that concurrent
+    workers never claim the same rows: ``SELECT ... FOR UPDATE SKIP LOCKED``
+    where supported, the database write lock on SQLite.
+    """
+    connection = connections[using]
+
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+
+    if connection.vendor == "sqlite":
+        # A write, even one touching no rows, takes SQLite's write lock now
+        # instead of at our first real UPDATE, so the rows we read below
+        # can't be claimed by another worker before we update them ourselves
+        meta = queryset.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {meta.db_table} SET {meta.pk.column} = "
+                           f"{meta.pk.column} WHERE 0")
+        return queryset
+
+    return queryset.select_for_update()
@@ -0,0 +1,121 @@
+"""
+In-process fan-out of live listing events (bids, close/reopen, comments).
+
+Views publish through ``publish()``, from any thread, once their transaction
+commits. Every connected browser is an asyncio queue subscribed to its
+listing's channel, so an idle connection costs a queue and a suspended
+coroutine rather than a thread. Events only reach clients connected to the
+same worker process.
+"""
+import asyncio
+import itertools
+import json
+import threading
+
+from django.db import transaction
+
+
+# Per-subscriber backlog; a client that falls this far behind loses the oldest
+QUEUE_SIZE = 64
+
+# Comment line sent on idle streams so proxies don't time them out
+KEEPALIVE_SECONDS = 15
+
+# Streams end after this long; EventSource reconnects on its own, which also
+# bounds the life of streams whose client went away without us noticing
+STREAM_SECONDS = 300
+
+# Browser reconnection delay, in milliseconds
+RETRY_MS = 3000
+
+
+class ListingChannel:
+    """Subscribers of one listing, plus the ids of the events sent to them."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.ids = itertools.count(1)
+
+
+class EventBroker:
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, listing_id):
+        subscriber = (asyncio.get_running_loop(),
+                      asyncio.Queue(maxsize=QUEUE_SIZE))
+
+        with self._lock:
+            channel = self._channels.setdefault(listing_id, ListingChannel())
+            channel.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, listing_id, subscriber):
+        with self._lock:
+            channel = self._channels.get(listing_id)
+            if channel is None:
+                return
+            channel.subscribers.discard(subscriber)
+            if not channel.subscribers:
+                del self._channels[listing_id]
+
+    def publish(self, listing_id, event, data):
+        with self._lock:
+            channel = self._channels.get(listing_id)
+            if channel is None:
+                return
+            message = format_event(event, data, next(channel.ids))
+            subscribers = list(channel.subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop has already shut down
+                pass
+
+    def subscriber_count(self, listing_id):
+        with self._lock:
+            channel = self._channels.get(listing_id)
+            return len(channel.subscribers) if channel else 0
+
+    async def stream(self, listing_id, lifetime=STREAM_SECONDS):
+        subscriber = self.subscribe(listing_id)
+        _, queue = subscriber
+        deadline = asyncio.get_running_loop().time() + lifetime
+
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    yield await asyncio.wait_for(
+                        queue.get(), min(KEEPALIVE_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(listing_id, subscriber)
+
+
+def _offer(queue, message):
+    # Runs on the subscriber's loop; drop the oldest message when full
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+def format_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+broker = EventBroker()
+
+
+# Publish once the surrounding transaction (if any) has committed:
+def publish_on_commit(listing_id, event, data):
+    transaction.on_commit(lambda: broker.publish(listing_id, event, data))
@@ -0,0 +1,86 @@
+"""
+Scheduled auction expiry.
+
+``expire_due()`` closes every active listing whose ``ends_at`` has passed,
+a batch at a time: each batch is a handful of set-based UPDATEs (listings,
+their Bid rows, category counts, sales totals) rather than one save per
+listing, and the winner is copied from the listing's current Bid row in the
+same statement.
+
+Batches are claimed under a write lock (``SELECT ... FOR UPDATE SKIP
+LOCKED`` where supported, the database write lock on SQLite), so two
+workers running at once never close, count, announce or notify the same
+listing twice.
+"""
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .database import claim_rows
+from .events import publish_on_commit
+from .models import Bid, Category, Listing
+from .notifications import notify_closed
+from .related import invalidate_related
+from .search import get_backend
+from .stats import record_closings
+
+
+# Listings closed per transaction
+EXPIRY_BATCH = 1000
+
+
+def expire_due(now=None, batch_size=EXPIRY_BATCH, using="default"):
+    """Close every auction due by ``now``; returns how many this call closed."""
+    now = now or timezone.now()
+    total = 0
+
+    while True:
+        closed = expire_batch(now, batch_size, using)
+        total += closed
+        if closed < batch_size:
+            return total
+
+
+def expire_batch(now, batch_size=EXPIRY_BATCH, using="default"):
+    with transaction.atomic(using=using):
+        due = claim_rows(Listing.objects.using(using)
+                         .filter(active=True, ends_at__lte=now)
+                         .order_by("ends_at", "id"), using)
+        rows = list(due.values_list("pk", "category_id")[:batch_size])
+        if not rows:
+            return 0
+
+        ids = [pk for pk, _ in rows]
+        winner = Bid.objects.using(using) \
+            .filter(listing=OuterRef("pk")).values("bidder")[:1]
+
+        Listing.objects.using(using).filter(pk__in=ids) \
+            .update(active=False, winner=Subquery(winner),
+                    version=F("version") + 1, date_modified=now)
+        bids = Bid.objects.using(using).filter(listing_id__in=ids)
+        bids.update(is_open=False)
+
+        # Auctions with a current bid closed as sales
+        categories = dict(rows)
+        sales = bids.values_list("listing_id", "seller_id", "bidder_id",
+                                 "offer")
+        record_closings([(seller_id, bidder_id, categories[listing_id], offer)
+                         for listing_id, seller_id, bidder_id, offer in sales],
+                        using=using)
+
+        for category_id, count in Counter(c for _, c in rows).items():
+            Category.objects.db_manager(using) \
+                .adjust_active_count(category_id, -count)
+            # Once committed, so the cache isn't refilled with these open
+            transaction.on_commit(partial(invalidate_related, category_id),
+                                  using=using)
+
+        get_backend(using).index(ids)
+        notify_closed(ids, using)
+        for pk in ids:
+            publish_on_commit(pk, "status", {"open": False})
+
+    return len(ids)
@@ -1,18 +1,26 @@
 from django.forms import ModelForm
-from .models import Listing, Bid, Comment
+from .models import Listing, Bid, Comment, ProxyBid
 from django import forms
+from django.utils import timezone
 
 
 class ListingForm(ModelForm):
+    # Free text; resolved to a Category (created on first use) by the view
+    category = forms.CharField(max_length=24, required=False, label="",
+                               widget=forms.TextInput(attrs={
+                                   "id": "category1",
+                                   "placeholder": "Category"
+                               }))
+
     class Meta:
         model = Listing
-        fields = ["title", "description", "starting_bid", "image", "category"]
+        fields = ["title", "description", "starting_bid", "image", "ends_at"]
         labels = {
             "title": "",
             "description": "",
             "starting_bid": "",
             "image": "",
-            "category": ""
+            "ends_at": "Ends at (optional)"
         }
         widgets = {
             "title": forms.TextInput(attrs={
@@ -32,12 +40,18 @@ class ListingForm(ModelForm):
                 "id": "image1",
                 "placeholder": "Image link"
             }),
-            "category": forms.TextInput(attrs={
-                "id": "category1",
-                "placeholder": "Category"
+            "ends_at": forms.DateTimeInput(attrs={
+                "id": "ends_at1",
+                "type": "datetime-local"
             }),
         }
 
+    def clean_ends_at(self):
+        ends_at = self.cleaned_data["ends_at"]
+        if ends_at is not None and ends_at <= timezone.now():
+            raise forms.ValidationError("The end time must be in the future.")
+        return ends_at
+
 
 class BidForm(ModelForm):
     class Meta:
@@ -54,6 +68,21 @@ class BidForm(ModelForm):
         }
 
 
+class ProxyBidForm(ModelForm):
+    class Meta:
+        model = ProxyBid
+        fields = ["maximum"]
+        labels = {
+            "maximum": ""
+        }
+        widgets = {
+            "maximum": forms.NumberInput(attrs={
+                "id": "maximum",
+                "placeholder": "Or bid automatically up to"
+            })
+        }
+
+
 class CommentForm(ModelForm):
     class Meta:
         model = Comment
@@ -0,0 +1,373 @@
+"""
+Listing image proxy.
+
+``Listing.image`` is an arbitrary external URL. ``schedule()`` hands new
+listings to a pool of background workers that fetch each image once,
+through the ``IMAGE_FETCHER``, and store it with its ``RENDITIONS`` under
+``IMAGES_DIR``, named by the SHA-256 digest of the original's bytes. The
+digest is then recorded on the listing and pages embed
+``/images/<digest>/<rendition>``, which never changes and so is served with
+a year-long, immutable cache lifetime. Until a listing's image has been
+stored, pages fall back to the external URL. Nothing is fetched or resized
+on a request thread; ``process_images`` catches up on any backlog.
+
+Resizing needs Pillow. Without it every rendition is the original image.
+"""
+import hashlib
+import http.client
+import ipaddress
+import logging
+import os
+import re
+import socket
+import ssl
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from .models import Listing
+from .related import invalidate_related
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+
+logger = logging.getLogger(__name__)
+
+# Name -> (width, height, crop). Cropped renditions are exactly that size;
+# the others are scaled down to fit within it.
+RENDITIONS = {
+    "thumb": (320, 240, True),
+    "detail": (960, 960, False),
+}
+
+JPEG_QUALITY = 82
+
+# Leading bytes -> content type, for originals served as they are
+SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Statuses whose Location HTTPFetcher follows
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# Listings per processing batch, for the workers and process_images
+BATCH_SIZE = 100
+
+
+class ImageError(Exception):
+    pass
+
+
+class HTTPFetcher:
+    """
+    Fetches http(s) URLs of at most ``max_bytes``, from public addresses
+    only. Sellers choose the URLs, so each host is resolved and refused
+    unless every address it has is globally routable (no loopback, private,
+    link-local or metadata addresses), the connection goes to the address
+    that was checked, and redirects are followed only after the same check.
+    """
+
+    def __init__(self, timeout=10, max_bytes=10 * 1024 * 1024,
+                 max_redirects=3):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_redirects = max_redirects
+
+    def fetch(self, url):
+        for _ in range(self.max_redirects + 1):
+            try:
+                connection, response = self._get(url)
+                try:
+                    location = response.getheader("Location")
+                    if response.status in REDIRECTS and location:
+                        url = urljoin(url, location)
+                        continue
+                    if response.status != 200:
+                        raise ImageError(f"{url}: HTTP {response.status}")
+                    data = response.read(self.max_bytes + 1)
+                finally:
+                    connection.close()
+            except (OSError, ValueError, http.client.HTTPException) as error:
+                raise ImageError(f"{url}: {error}") from error
+
+            if len(data) > self.max_bytes:
+                raise ImageError(f"{url}: larger than {self.max_bytes} bytes")
+            return data
+        raise ImageError(f"{url}: more than {self.max_redirects} redirects")
+
+    def _get(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ImageError(f"{url}: not an http(s) URL")
+
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        connection = (_PinnedHTTPSConnection if secure
+                      else _PinnedHTTPConnection)(
+            parts.hostname, port, public_address(parts.hostname, port),
+            timeout=self.timeout)
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+        connection.request("GET", path,
+                           headers={"User-Agent": "commerce-images"})
+        return connection, connection.getresponse()
+
+
+def public_address(host, port):
+    """
+    An address of ``host`` to connect to, provided all of them are public;
+    otherwise ImageError.
+    """
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(
+            host, port, type=socket.SOCK_STREAM)]
+    except (OSError, UnicodeError) as error:
+        raise ImageError(f"{host}: {error}") from error
+
+    for address in addresses:
+        # Scoped IPv6 addresses end in %<interface>
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ImageError(f"{host}: {address} is not a public address")
+    return addresses[0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    # Connects to the address checked by public_address(), not to whatever
+    # the host name resolves to by now; the Host header keeps the name
+
+    def __init__(self, host, port, address, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port),
+                                             self.timeout)
+
+
+class _PinnedHTTPSConnection(_PinnedHTTPConnection):
+    default_port = http.client.HTTPS_PORT
+
+    def connect(self):
+        super().connect()
+        # The certificate is checked against the host name
+        self.sock = ssl.create_default_context().wrap_socket(
+            self.sock, server_hostname=self.host)
+
+
+class LocalFileFetcher:
+    """Reads each URL's path from under ``root``; a stand-in for tests."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+
+    def fetch(self, url):
+        path = os.path.realpath(
+            os.path.join(self.root, urlsplit(url).path.lstrip("/")))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ImageError(f"{url}: outside {self.root}")
+
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except OSError as error:
+            raise ImageError(f"{url}: {error}") from error
+
+
+def get_fetcher():
+    fetcher = import_string(settings.IMAGE_FETCHER)
+    return fetcher(**settings.IMAGE_FETCHER_OPTIONS)
+
+
+# Storage
+
+def image_path(digest, rendition=None):
+    # Spread over 256 directories so none grows too large
+    name = digest if rendition is None else f"{digest}-{rendition}.jpg"
+    return os.path.join(settings.IMAGES_DIR, digest[:2], name)
+
+
+def _stored_paths(digest):
+    paths = [image_path(digest)]
+    if Image is not None:
+        paths += [image_path(digest, name) for name in RENDITIONS]
+    return paths
+
+
+def _content_type(header):
+    for signature, content_type in SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _write(path, data):
+    # Through a temporary file, so readers never see a partial image
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _render(data, width, height, crop):
+    output = BytesIO()
+    with Image.open(BytesIO(data)) as image:
+        # Lets JPEGs decode at a fraction of their size
+        image.draft("RGB", (width, height))
+        image = ImageOps.exif_transpose(image)
+        if crop:
+            image = ImageOps.fit(image, (width, height))
+        else:
+            image.thumbnail((width, height))
+        image.convert("RGB").save(output, "JPEG", quality=JPEG_QUALITY,
+                                  optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def store(data):
+    """Store an image and its renditions, if not already; returns its
+    digest."""
+    if _content_type(data[:12]) is None:
+        raise ImageError("not a JPEG, PNG, GIF or WebP image")
+
+    digest = hashlib.sha256(data).hexdigest()
+    if Image is not None:
+        for name, size in RENDITIONS.items():
+            path = image_path(digest, name)
+            if os.path.exists(path):
+                continue
+            try:
+                _write(path, _render(data, *size))
+            except (OSError, Image.DecompressionBombError) as error:
+                raise ImageError(f"can't resize: {error}") from error
+
+    # Last, as the marker of a complete set
+    if not os.path.exists(image_path(digest)):
+        _write(image_path(digest), data)
+    return digest
+
+
+def locate(digest, rendition):
+    """
+    The file and content type serving ``rendition`` (or "original") of a
+    stored image, or None. Without Pillow renditions are the original.
+    """
+    if not DIGEST.fullmatch(digest) or (
+            rendition != "original" and rendition not in RENDITIONS):
+        return None
+
+    if rendition in RENDITIONS:
+        path = image_path(digest, rendition)
+        if os.path.exists(path):
+            return path, "image/jpeg"
+
+    path = image_path(digest)
+    try:
+        with open(path, "rb") as file:
+            content_type = _content_type(file.read(12))
+    except OSError:
+        return None
+    return path, content_type
+
+
+# Processing
+
+def process(listing_ids, fetcher=None):
+    """
+    Fetch and store the images of these listings, once per distinct URL,
+    and record their digests. Returns the number of listings updated.
+    """
+    fetcher = fetcher or get_fetcher()
+
+    listings = {}
+    for pk, url, category_id in Listing.objects.filter(pk__in=listing_ids) \
+            .exclude(image="").values_list("pk", "image", "category"):
+        listings.setdefault(url, []).append((pk, category_id))
+
+    # URLs some other listing already has a stored image for
+    known = dict(Listing.objects.filter(image__in=listings)
+                 .exclude(image_digest="")
+                 .values_list("image", "image_digest"))
+
+    updated = 0
+    for url, group in listings.items():
+        digest = known.get(url)
+        if digest is None or not all(
+                map(os.path.exists, _stored_paths(digest))):
+            try:
+                digest = store(fetcher.fetch(url))
+            except ImageError as error:
+                logger.warning("Skipped the image of listings %s: %s",
+                               [pk for pk, _ in group], error)
+                continue
+
+        # Unless the listing's image changed meanwhile
+        updated += Listing.objects.filter(
+            pk__in=[pk for pk, _ in group], image=url) \
+            .bump_version(image_digest=digest)
+        for category_id in {category_id for _, category_id in group}:
+            invalidate_related(category_id)
+    return updated
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(settings.IMAGE_WORKERS,
+                                       thread_name_prefix="images")
+        return _pool
+
+
+def _work(listing_ids):
+    try:
+        process(listing_ids)
+    except Exception:
+        logger.exception("Image processing failed for listings %s",
+                         listing_ids)
+    finally:
+        # The worker thread's own connections
+        connections.close_all()
+
+
+def schedule(listings):
+    """
+    Queue the images of these listings for the worker pool, once the
+    current transaction commits. With ``IMAGE_WORKERS = 0`` they are left
+    for ``process_images``.
+    """
+    listing_ids = [listing.pk for listing in listings if listing.image]
+    if not listing_ids or not settings.IMAGE_WORKERS:
+        return
+
+    def submit():
+        for start in range(0, len(listing_ids), BATCH_SIZE):
+            _executor().submit(_work, listing_ids[start:start + BATCH_SIZE])
+
+    transaction.on_commit(submit)
@@ -0,0 +1,94 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from auctions.benchmarks.stats import percentile
+from auctions.bidding import place_proxy
+from auctions.models import Bid, Category, Listing, ProxyBid, User
+from auctions.proxies import Proxy, resolve
+
+
+class Command(BaseCommand):
+    help = ("Measure proxy bid resolution with thousands of competing "
+            "proxies per listing, in memory and against a throwaway test "
+            "database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--proxies", type=int, default=5000,
+                            help="Competing proxies per listing.")
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        self._measure_engine(rng, options["proxies"], options["rounds"])
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           serialize=False)
+        try:
+            self._measure_database(rng, options["proxies"],
+                                   options["rounds"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _report(self, label, samples):
+        self.stdout.write(
+            f"{label}: p50 {percentile(samples, 0.50):.2f}ms, "
+            f"p95 {percentile(samples, 0.95):.2f}ms, "
+            f"max {max(samples):.2f}ms")
+
+    def _measure_engine(self, rng, count, rounds):
+        samples = []
+        for _ in range(rounds):
+            proxies = [Proxy(bidder, rng.randint(10, 1_000_000), bidder)
+                       for bidder in range(count)]
+            started = time.perf_counter()
+            resolve(proxies, starting_bid=10)
+            samples.append((time.perf_counter() - started) * 1000)
+        self._report(f"resolve() over {count} proxies", samples)
+
+    def _measure_database(self, rng, count, rounds):
+        seller = User.objects.create_user("bench-seller")
+        User.objects.bulk_create([User(username=f"bench-bidder-{i}")
+                                  for i in range(count + rounds)])
+        bidders = list(User.objects.exclude(pk=seller.pk).order_by("pk"))
+        listing = Listing.objects.create(
+            seller=seller, title="Contested", description="Desc",
+            starting_bid=10, category=Category.objects.for_name("Bench"))
+
+        # Every proxy but the last placed before the first bid, so the
+        # last one settles the whole field
+        ProxyBid.objects.bulk_create([
+            ProxyBid(listing=listing, bidder=bidder,
+                     maximum=rng.randint(10, 1_000_000))
+            for bidder in bidders[:count - 1]
+        ])
+        started = time.perf_counter()
+        place_proxy(listing, bidders[count - 1], rng.randint(10, 1_000_000))
+        self.stdout.write(
+            f"{connection.vendor}: first place_proxy() settling {count} "
+            f"proxies: {(time.perf_counter() - started) * 1000:.2f}ms")
+        first_price = Bid.objects.get(listing=listing).offer
+
+        # Challengers spread around the current price: some lose, some
+        # take the lead; each is settled against every proxy that can
+        # still reach the price
+        samples = []
+        for bidder in bidders[count:count + rounds]:
+            price = Bid.objects.get(listing=listing).offer
+            maximum = price + rng.randint(1, 2000) - 500
+            started = time.perf_counter()
+            place_proxy(listing, bidder, max(maximum, price + 1))
+            samples.append((time.perf_counter() - started) * 1000)
+
+        bid = Bid.objects.get(listing=listing)
+        self._report(f"{connection.vendor}: place_proxy() against {count} "
+                     f"proxies", samples)
+        self.stdout.write(
+            f"Price moved {first_price} -> {bid.offer} with "
+            f"{listing.offers.count()} offers written; bidding it up one "
+            f"increment at a time would have written "
+            f"{bid.offer - first_price}.")
@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from auctions.benchmarks.stats import percentile
+from auctions.models import User
+from auctions.ratelimit import RateLimitMiddleware
+
+
+class Command(BaseCommand):
+    help = ("Measure the per-request overhead of the rate limiting "
+            "middleware, in microseconds, view excluded.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100_000)
+        parser.add_argument("--clients", type=int, default=1000,
+                            help="Distinct users and addresses, one "
+                                 "bucket each.")
+        parser.add_argument("--batch", type=int, default=100,
+                            help="Calls timed together per sample.")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        clients = options["clients"]
+        users = [User(pk=pk) for pk in range(1, clients + 1)]
+        addresses = [f"10.0.{i // 256}.{i % 256}" for i in range(clients)]
+
+        def requests(method, path, anonymous=False):
+            built = []
+            for i in range(clients):
+                request = factory.generic(method, path,
+                                          REMOTE_ADDR=addresses[i])
+                request.user = AnonymousUser() if anonymous else users[i]
+                built.append(request)
+            return built
+
+        cases = [
+            ("GET, not counted", "1000000/s", requests("GET", "/")),
+            ("POST, unlimited view", "1000000/s",
+             requests("POST", "/comments/")),
+            ("POST, allowed (per user)", "1000000/s",
+             requests("POST", "/bidding/")),
+            ("POST, allowed (per IP)", "1000000/s",
+             requests("POST", "/bidding/", anonymous=True)),
+            ("POST, rejected (429)", "1/h", requests("POST", "/bidding/")),
+        ]
+
+        # The view's response, ready-made: only the middleware is timed
+        response = HttpResponse()
+        for label, rate, batch in cases:
+            with override_settings(RATE_LIMITS={"bid": rate}):
+                middleware = RateLimitMiddleware(lambda request: response)
+            self._report(label, middleware, batch, options)
+
+    def _report(self, label, middleware, requests, options):
+        size = options["batch"]
+        samples = []
+        calls = 0
+        while calls < options["requests"]:
+            chunk = [requests[(calls + i) % len(requests)]
+                     for i in range(size)]
+            started = time.perf_counter()
+            for request in chunk:
+                middleware(request)
+            samples.append((time.perf_counter() - started) * 1e6 / size)
+            calls += size
+
+        self.stdout.write(
+            f"{label:28} p50 {percentile(samples, 0.50):7.2f}us  "
+            f"p95 {percentile(samples, 0.95):7.2f}us  "
+            f"p99 {percentile(samples, 0.99):7.2f}us")
@@ -0,0 +1,99 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from auctions.benchmarks.stats import percentile
+from auctions.models import User, Category, Listing, Bid
+from auctions.search import get_backend
+
+
+class Command(BaseCommand):
+    help = ("Measure search latency on a synthetic corpus built in a "
+            "throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--listings", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           serialize=False)
+        try:
+            vocabulary = self._populate(rng, options["listings"],
+                                        options["batch_size"])
+            self._measure(rng, vocabulary, options["queries"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _populate(self, rng, total, batch_size):
+        vocabulary = ["".join(rng.choices(string.ascii_lowercase,
+                                          k=rng.randint(4, 9)))
+                      for _ in range(5000)]
+        seller = User.objects.create_user("bench-seller")
+        bidder = User.objects.create_user("bench-bidder")
+        categories = [Category.objects.for_name(f"Category {i}")
+                      for i in range(50)]
+        backend = get_backend()
+
+        started = time.perf_counter()
+        for start in range(0, total, batch_size):
+            count = min(batch_size, total - start)
+            with transaction.atomic():
+                listings = Listing.objects.bulk_create([
+                    Listing(seller=seller,
+                            title=" ".join(rng.choices(vocabulary, k=3)),
+                            description=" ".join(rng.choices(vocabulary,
+                                                             k=8)),
+                            starting_bid=rng.randint(1, 1000),
+                            category=rng.choice(categories),
+                            active=rng.random() < 0.8)
+                    for _ in range(count)
+                ])
+                # bulk_create only returns ids on some backends
+                ids = list(Listing.objects.order_by("-pk")
+                           .values_list("pk", flat=True)[:count])
+                Bid.objects.bulk_create([
+                    Bid(listing_id=listing_id, seller=seller,
+                        starting_bid=1, offer=rng.randint(1, 2000),
+                        bidder=bidder, offer_count=1)
+                    for listing_id in ids if rng.random() < 0.3
+                ])
+                backend.index(ids)
+            self.stdout.write(f"\r{start + len(listings)} listings",
+                              ending="")
+
+        self.stdout.write(
+            f"\nCorpus built in {time.perf_counter() - started:.1f}s")
+        return vocabulary
+
+    def _measure(self, rng, vocabulary, queries):
+        backend = get_backend()
+        samples = []
+
+        for _ in range(queries):
+            words = rng.choices(vocabulary, k=rng.randint(1, 2))
+            if rng.random() < 0.5:
+                words[-1] = words[-1][:3]
+            filters = {}
+            if rng.random() < 0.3:
+                filters["max_price"] = rng.randint(100, 1000)
+            if rng.random() < 0.2:
+                filters["active"] = None
+
+            started = time.perf_counter()
+            backend.search(" ".join(words), **filters)
+            samples.append((time.perf_counter() - started) * 1000)
+
+        self.stdout.write(
+            f"{connection.vendor}: {queries} queries, "
+            f"p50 {percentile(samples, 0.50):.2f}ms, "
+            f"p95 {percentile(samples, 0.95):.2f}ms, "
+            f"p99 {percentile(samples, 0.99):.2f}ms, "
+            f"max {max(samples):.2f}ms")
@@ -0,0 +1,151 @@
+import json
+import os
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from auctions.benchmarks.data import SCALES, generate, throwaway_database
+from auctions.benchmarks.stats import QueryCounter, peak_rss_mb
+from auctions.benchmarks.transports import TRANSPORTS
+from auctions.benchmarks.workloads import (DEFAULT_WORKLOADS, WORKLOADS,
+                                           compare, run_workload)
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "benchmarks", "baseline.json")
+
+
+class Command(BaseCommand):
+    help = ("Build a synthetic catalogue in a throwaway database, replay "
+            "request workloads against it and report throughput, latency, "
+            "queries per request and peak RSS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=SCALES, default="small")
+        for count in ("users", "listings", "bids", "comments", "watched"):
+            parser.add_argument(f"--{count}", type=int,
+                                help=f"Override the scale's {count} count.")
+        parser.add_argument("--transport", choices=TRANSPORTS,
+                            default="client")
+        parser.add_argument("--workloads", default=",".join(DEFAULT_WORKLOADS),
+                            help="Comma-separated; available: "
+                                 + ", ".join(WORKLOADS))
+        parser.add_argument("--requests", type=int, default=500,
+                            help="Timed requests per workload.")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--on-disk", action="store_true",
+                            help="Build the SQLite database in a temporary "
+                                 "file instead of in memory, so the "
+                                 "database profile's journal settings "
+                                 "apply.")
+        parser.add_argument("--profiling", action="store_true",
+                            help="Run with ProfilingMiddleware enabled, to "
+                                 "measure its overhead.")
+        parser.add_argument("--baseline", default=BASELINE,
+                            help="Results JSON to compare against.")
+        parser.add_argument("--save", nargs="?", const=BASELINE,
+                            help="Write results as JSON (default: the "
+                                 "stored baseline).")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options["workloads"].split(",")]
+        unknown = set(names) - set(WORKLOADS)
+        if unknown:
+            raise CommandError(f"Unknown workloads: {', '.join(unknown)}")
+
+        counts = dict(SCALES[options["scale"]])
+        for key in counts:
+            if options[key] is not None:
+                counts[key] = options[key]
+
+        # Measure the app as deployed, not with DEBUG's query log
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = ["testserver", "localhost", "127.0.0.1"]
+        settings.PROFILING = options["profiling"]
+        # A few sessions replaying thousands of writes would be throttled
+        settings.RATE_LIMITS = {}
+
+        results = {
+            "meta": {
+                "scale": options["scale"], **counts,
+                "transport": options["transport"],
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "profiling": options["profiling"],
+                "async_views": settings.ASYNC_VIEWS,
+                "database": connection.vendor,
+                "database_profile": settings.DATABASE_PROFILE,
+                "on_disk": options["on_disk"],
+                "python": platform.python_version(),
+                "django": django.get_version(),
+            },
+            "workloads": {},
+        }
+
+        counter = QueryCounter()
+        transport = TRANSPORTS[options["transport"]]()
+
+        with throwaway_database(on_disk=options["on_disk"]):
+            dataset = generate(**counts, seed=options["seed"],
+                               log=lambda line: self.stdout.write(
+                                   f"  generated {line}"))
+            counter.install()
+            transport.start()
+            try:
+                for name in names:
+                    results["workloads"][name] = run_workload(
+                        transport, dataset, WORKLOADS[name],
+                        options["requests"], options["concurrency"],
+                        counter, seed=options["seed"])
+                    self._row(name, results["workloads"][name])
+            finally:
+                transport.stop()
+                counter.uninstall()
+
+        results["peak_rss_mb"] = peak_rss_mb()
+        self.stdout.write(f"peak RSS: {results['peak_rss_mb']} MB")
+
+        self._compare(results, options["baseline"])
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+            self.stdout.write(f"Results saved to {options['save']}")
+
+    def _row(self, name, result):
+        self.stdout.write(
+            f"{name:<12} {result['throughput']:>9.1f} req/s  "
+            f"p50 {result['p50_ms']:>8.2f}ms  "
+            f"p95 {result['p95_ms']:>8.2f}ms  "
+            f"p99 {result['p99_ms']:>8.2f}ms  "
+            f"{result['queries_per_request']:>6.2f} queries/req  "
+            f"{result['errors']} errors")
+
+    def _compare(self, results, path):
+        if not path or not os.path.exists(path):
+            return
+
+        with open(path) as f:
+            baseline = json.load(f)
+
+        mismatched = [key for key in ("scale", "transport", "concurrency",
+                                      "database", "database_profile",
+                                      "on_disk", "profiling", "async_views")
+                      if baseline.get("meta", {}).get(key)
+                      != results["meta"][key]]
+        if mismatched:
+            self.stdout.write(self.style.WARNING(
+                f"Baseline differs in {', '.join(mismatched)}; "
+                f"deltas are not like for like."))
+
+        self.stdout.write(f"Change against {path}:")
+        for name, deltas in compare(results, baseline).items():
+            cells = "  ".join(
+                f"{metric} {'n/a' if delta is None else f'{delta:+.1f}%'}"
+                for metric, delta in deltas.items())
+            self.stdout.write(f"{name:<12} {cells}")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.notifications import DISPATCH_BATCH, dispatch_due
+
+
+class Command(BaseCommand):
+    help = ("Send the queued outbid and auction-closed notifications, one "
+            "message per recipient. Safe to run from several workers at "
+            "once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DISPATCH_BATCH)
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep running, checking every --interval "
+                                 "seconds.")
+        parser.add_argument("--interval", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            sent, failed = dispatch_due(batch_size=options["batch_size"])
+
+            if sent or failed or not options["loop"]:
+                self.stdout.write(
+                    f"Sent {sent} messages ({failed} failed, to be retried) "
+                    f"in {time.perf_counter() - started:.2f}s.")
+
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
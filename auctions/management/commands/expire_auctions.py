@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.expiry import EXPIRY_BATCH, expire_due
+
+
+class Command(BaseCommand):
+    help = ("Close every auction whose end time has passed. Safe to run "
+            "from several workers at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EXPIRY_BATCH)
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep running, checking every --interval "
+                                 "seconds.")
+        parser.add_argument("--interval", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            closed = expire_due(batch_size=options["batch_size"])
+
+            if closed or not options["loop"]:
+                self.stdout.write(
+                    f"Closed {closed} auctions in "
+                    f"{time.perf_counter() - started:.2f}s.")
+
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from auctions.models import Listing
+from auctions.transfer import (EXPORT_CHUNK, FORMATS, encode_rows,
+                               export_rows, guess_format)
+
+
+class Command(BaseCommand):
+    help = ("Export listings as CSV or NDJSON to a file (or - for stdout), "
+            "streaming them a chunk at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS,
+                            help="Default: from the file extension, else "
+                                 "ndjson.")
+        parser.add_argument("--active", action="store_true",
+                            help="Only export active listings.")
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK,
+                            help="Rows fetched per query round trip.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+
+        listings = Listing.objects.all()
+        if options["active"]:
+            listings = listings.filter(active=True)
+
+        stream = sys.stdout if path == "-" else open(path, "w", newline="",
+                                                     encoding="utf-8")
+        count = 0
+        try:
+            for line in encode_rows(export_rows(listings,
+                                                options["chunk_size"]), fmt):
+                stream.write(line)
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        # CSV output starts with a header line
+        if fmt == "csv":
+            count -= 1
+        if path != "-":
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported {count} listings to {path}."))
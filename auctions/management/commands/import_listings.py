@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.models import User
+from auctions.transfer import (FORMATS, IMPORT_BATCH, IMPORT_CHUNK,
+                               guess_format, import_rows, read_rows)
+
+
+class Command(BaseCommand):
+    help = ("Import listings from a CSV or NDJSON file (or - for stdin), "
+            "validated like the create form. Each chunk is committed on its "
+            "own; with --checkpoint an interrupted run resumes after the "
+            "last committed chunk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS,
+                            help="Default: from the file extension, else "
+                                 "ndjson.")
+        parser.add_argument("--seller",
+                            help="Username for rows without a seller column.")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH,
+                            help="Rows per INSERT.")
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK,
+                            help="Rows per transaction and checkpoint.")
+        parser.add_argument("--checkpoint",
+                            help="JSON file recording progress; resumed "
+                                 "from if it exists.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+
+        seller = None
+        if options["seller"]:
+            seller = User.objects.filter(username=options["seller"]).first()
+            if seller is None:
+                raise CommandError(f"Unknown seller {options['seller']!r}.")
+
+        checkpoint = options["checkpoint"]
+        skip = self._resume(checkpoint, path)
+        if skip:
+            self.stdout.write(f"Resuming after {skip} rows.")
+
+        def on_error(number, messages):
+            self.stderr.write(f"{path}:{number}: {'; '.join(messages)}")
+
+        def on_chunk(result):
+            if checkpoint:
+                self._save(checkpoint, path, result)
+            self.stdout.write(f"  {result.consumed} rows read, "
+                              f"{result.imported} imported, "
+                              f"{result.failed} rejected")
+
+        stream = sys.stdin if path == "-" else open(path, newline="",
+                                                    encoding="utf-8")
+        try:
+            result = import_rows(read_rows(stream, fmt), seller=seller,
+                                 batch_size=options["batch_size"],
+                                 chunk_size=options["chunk_size"],
+                                 skip=skip, on_error=on_error,
+                                 on_chunk=on_chunk)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} listings; "
+            f"{result.failed} rows rejected."))
+
+    def _resume(self, checkpoint, path):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+
+        with open(checkpoint) as f:
+            state = json.load(f)
+        if state.get("path") != path:
+            raise CommandError(f"{checkpoint} records progress through "
+                               f"{state.get('path')!r}, not {path!r}.")
+        return state["consumed"]
+
+    def _save(self, checkpoint, path, result):
+        # Written aside and renamed, so a crash never leaves half a file
+        partial = checkpoint + ".tmp"
+        with open(partial, "w") as f:
+            json.dump({"path": path, "consumed": result.consumed}, f)
+        os.replace(partial, checkpoint)
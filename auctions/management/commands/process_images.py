@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from auctions.images import BATCH_SIZE, process
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = ("Fetch and store the images of listings that don't have a "
+            "stored copy yet, in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Reprocess every listing with an image.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Listings processed per batch.")
+
+    def handle(self, *args, **options):
+        listings = Listing.objects.exclude(image="")
+        if not options["all"]:
+            listings = listings.filter(image_digest="")
+        pks = list(listings.order_by("pk").values_list("pk", flat=True))
+
+        size = options["batch_size"]
+        updated = 0
+        for start in range(0, len(pks), size):
+            updated += process(pks[start:start + size])
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  {min(start + size, len(pks))} "
+                                  f"of {len(pks)} listings")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored the images of {updated} of {len(pks)} listings."))
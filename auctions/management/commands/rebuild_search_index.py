@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from auctions.models import Listing
+from auctions.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Re-index every listing for full-text search, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        batch_size = options["batch_size"]
+        last_id = 0
+        total = 0
+
+        while True:
+            batch = list(Listing.objects.filter(pk__gt=last_id)
+                         .order_by("pk").values_list("pk", flat=True)
+                         [:batch_size])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                backend.index(batch)
+
+            last_id = batch[-1]
+            total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} listings."))
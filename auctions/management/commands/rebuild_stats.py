@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from auctions.stats import REBUILD_BATCH, rebuild
+
+
+class Command(BaseCommand):
+    help = ("Recompute the leaderboard and activity statistics from the "
+            "listings and bid history, in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH,
+                            help="Users recomputed per transaction.")
+
+    def handle(self, *args, **options):
+        log = None
+        if options["verbosity"] > 1:
+            def log(line):
+                self.stdout.write(f"  rebuilt {line}")
+
+        users, categories, days = rebuild(options["batch_size"], log=log)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt statistics for {users} users, {categories} categories "
+            f"and {days} days."))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from auctions.routers import PRIMARY
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database over each local replica, "
+            "for trying replica routing without a replicating server.")
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY]
+        if primary.vendor != "sqlite":
+            raise CommandError("Only SQLite replicas are synced here; "
+                               "server replicas follow their primary.")
+        if not settings.REPLICA_DATABASES:
+            raise CommandError("No replicas configured; set "
+                               "COMMERCE_REPLICA=1.")
+
+        primary.ensure_connection()
+        for alias in settings.REPLICA_DATABASES:
+            replica = connections[alias]
+            replica.ensure_connection()
+            # SQLite's online backup: a consistent copy while in use
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f"Synced {alias}.")
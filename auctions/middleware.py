@@ -0,0 +1,37 @@
+"""
+Shared base for the app's middleware.
+
+Django runs a sync-only middleware under ASGI by wrapping the rest of the
+chain in a thread, which would push the async views back onto one. The
+middleware here declare both kinds instead and take the mode of the
+handler they wrap:
+
+    class TimingMiddleware(HybridMiddleware):
+        def handle(self, request):            # under WSGI
+            return self.get_response(request)
+
+        async def __acall__(self, request):  # under ASGI
+            return await self.get_response(request)
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class HybridMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0003_alter_listing_category_alter_listing_image"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                fields=["active", "date_created", "id"],
+                name="listing_active_feed_idx",
+            ),
+        ),
+    ]
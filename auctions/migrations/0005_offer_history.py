@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def keep_highest_bid(apps, schema_editor):
+    # Older code could leave several Bid rows per listing; keep the best one
+    Bid = apps.get_model("auctions", "Bid")
+    seen = set()
+
+    for bid in Bid.objects.order_by("listing_id", "-offer", "-id"):
+        if bid.listing_id in seen:
+            bid.delete()
+        seen.add(bid.listing_id)
+
+
+def seed_offer_history(apps, schema_editor):
+    Bid = apps.get_model("auctions", "Bid")
+    Offer = apps.get_model("auctions", "Offer")
+
+    Offer.objects.bulk_create(
+        Offer(listing_id=bid.listing_id, bidder_id=bid.bidder_id,
+              amount=bid.offer)
+        for bid in Bid.objects.all()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0004_listing_active_feed_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Offer",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("amount", models.IntegerField()),
+                ("date_placed", models.DateTimeField(auto_now_add=True)),
+                (
+                    "bidder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="offers_made",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "listing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="offers",
+                        to="auctions.listing",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(keep_highest_bid, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="bid",
+            constraint=models.UniqueConstraint(
+                fields=("listing",), name="one_current_bid_per_listing"
+            ),
+        ),
+        migrations.RunPython(seed_offer_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.text import slugify
+
+
+def backfill_categories(apps, schema_editor):
+    Category = apps.get_model("auctions", "Category")
+    Listing = apps.get_model("auctions", "Listing")
+
+    names = Listing.objects.values_list("category_name", flat=True).distinct()
+    slugs = set()
+
+    for raw_name in names:
+        name = raw_name.strip() or "Unspecified"
+        category = Category.objects.filter(name=name).first()
+
+        if category is None:
+            base = slugify(name) or "category"
+            slug = base
+            suffix = 1
+            while slug in slugs:
+                suffix += 1
+                slug = f"{base}-{suffix}"
+            slugs.add(slug)
+            category = Category.objects.create(name=name, slug=slug)
+
+        Listing.objects.filter(category_name=raw_name) \
+            .update(category=category)
+
+    for category in Category.objects.all():
+        category.active_count = Listing.objects.filter(
+            category=category, active=True).count()
+        category.save(update_fields=["active_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0005_offer_history"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Category",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=24, unique=True)),
+                ("slug", models.SlugField(max_length=32, unique=True)),
+                ("active_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "categories",
+            },
+        ),
+        migrations.RenameField(
+            model_name="listing",
+            old_name="category",
+            new_name="category_name",
+        ),
+        migrations.AddField(
+            model_name="listing",
+            name="category",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="listings",
+                to="auctions.category",
+            ),
+        ),
+        migrations.RunPython(backfill_categories, migrations.RunPython.noop),
+    ]
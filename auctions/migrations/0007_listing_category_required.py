@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0006_category"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="listing",
+            name="category_name",
+        ),
+        migrations.AlterField(
+            model_name="listing",
+            name="category",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="listings",
+                to="auctions.category",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                fields=["category", "active", "date_created", "id"],
+                name="listing_category_feed_idx",
+            ),
+        ),
+    ]
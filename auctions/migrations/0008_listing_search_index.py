@@ -0,0 +1,73 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+    CREATE VIRTUAL TABLE auctions_listing_fts USING fts5(
+        title, description, category, active UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+"""
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE auctions_listing_search (
+        listing_id integer PRIMARY KEY
+            REFERENCES auctions_listing (id) ON DELETE CASCADE
+            DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL,
+        active boolean NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX auctions_listing_search_document
+        ON auctions_listing_search USING GIN (document)
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "sqlite":
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(
+            "INSERT INTO auctions_listing_fts"
+            " (rowid, title, description, category, active)"
+            " SELECT l.id, l.title, l.description, c.name, l.active"
+            " FROM auctions_listing l"
+            " JOIN auctions_category c ON c.id = l.category_id")
+
+    elif vendor == "postgresql":
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+        schema_editor.execute(
+            "INSERT INTO auctions_listing_search"
+            " (listing_id, document, active)"
+            " SELECT l.id,"
+            " setweight(to_tsvector('simple', l.title), 'A') ||"
+            " setweight(to_tsvector('simple', c.name), 'B') ||"
+            " setweight(to_tsvector('simple', l.description), 'D'),"
+            " l.active"
+            " FROM auctions_listing l"
+            " JOIN auctions_category c ON c.id = l.category_id")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE auctions_listing_fts")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP TABLE auctions_listing_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0007_listing_category_required"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:18
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_winners(apps, schema_editor):
+    # Listings closed before this migration won't have a winner; it's the
+    # bidder on their one remaining Bid row, if any
+    Bid = apps.get_model("auctions", "Bid")
+    Listing = apps.get_model("auctions", "Listing")
+
+    bidder = Bid.objects.filter(listing=OuterRef("pk")).values("bidder")
+    Listing.objects.filter(active=False, winner__isnull=True) \
+        .update(winner=Subquery(bidder[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0008_listing_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listing",
+            name="ends_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="listing",
+            name="winner",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="auctions_won",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                fields=["active", "ends_at"], name="listing_expiry_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_winners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0009_listing_ends_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listing",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0010_listing_version"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="listing",
+            name="listing_active_feed_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="listing",
+            name="listing_category_feed_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="listing",
+            name="listing_expiry_idx",
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                condition=models.Q(("active", True)),
+                fields=["date_created", "id"],
+                name="listing_active_feed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                condition=models.Q(("active", True)),
+                fields=["category", "date_created", "id"],
+                name="listing_category_feed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(
+                condition=models.Q(("active", True)),
+                fields=["ends_at"],
+                name="listing_expiry_idx",
+            ),
+        ),
+    ]
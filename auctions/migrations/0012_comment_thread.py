@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_comment_counts(apps, schema_editor):
+    Comment = apps.get_model("auctions", "Comment")
+    Listing = apps.get_model("auctions", "Listing")
+
+    counts = Comment.objects.filter(item=OuterRef("pk")) \
+        .order_by().values("item").annotate(count=Count("*")).values("count")
+    Listing.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0011_listing_partial_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["item", "date_published", "id"],
+                name="comment_thread_idx",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="comment",
+            name="item",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="comments",
+                to="auctions.listing",
+            ),
+        ),
+        migrations.AddField(
+            model_name="listing",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_comment_counts, migrations.RunPython.noop),
+    ]
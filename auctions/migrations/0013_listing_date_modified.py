@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0012_comment_thread"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listing",
+            name="date_modified",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
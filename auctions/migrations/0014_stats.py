@@ -0,0 +1,176 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:05
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+# Users backfilled per batch of bulk inserts
+BACKFILL_BATCH = 2000
+
+
+def _totals(rows, queryset, *fields):
+    # Group queryset's rows into rows[key][field], one field per
+    # aggregate, the key first in each row
+    for key, *values in queryset:
+        rows[key].update(zip(fields, values))
+
+
+def backfill_stats(apps, schema_editor):
+    # As auctions.stats.rebuild() does, frozen against these models
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Listing = apps.get_model("auctions", "Listing")
+    Offer = apps.get_model("auctions", "Offer")
+    UserStats = apps.get_model("auctions", "UserStats")
+    CategoryStats = apps.get_model("auctions", "CategoryStats")
+    DailyStats = apps.get_model("auctions", "DailyStats")
+
+    offers = Offer.objects.order_by()
+    listings = Listing.objects.order_by()
+    sold = listings.filter(active=False, winner__isnull=False)
+
+    last_id = 0
+    while True:
+        batch = list(User.objects.filter(pk__gt=last_id).order_by("pk")
+                     .values_list("pk", flat=True)[:BACKFILL_BATCH])
+        if not batch:
+            break
+        first_id, last_id = batch[0], batch[-1]
+
+        rows = defaultdict(dict)
+        _totals(rows, offers.filter(bidder_id__gte=first_id,
+                                    bidder_id__lte=last_id)
+                .values("bidder").annotate(n=Count("*"), s=Sum("amount"))
+                .values_list("bidder", "n", "s"),
+                "bids_placed", "amount_bid")
+        _totals(rows, listings.filter(seller_id__gte=first_id,
+                                      seller_id__lte=last_id)
+                .values("seller").annotate(n=Count("*"))
+                .values_list("seller", "n"),
+                "listings_created")
+        _totals(rows, sold.filter(seller_id__gte=first_id,
+                                  seller_id__lte=last_id)
+                .values("seller")
+                .annotate(n=Count("*"), s=Sum("bid_listing__offer"))
+                .values_list("seller", "n", "s"),
+                "listings_sold", "sales_total")
+        _totals(rows, sold.filter(winner_id__gte=first_id,
+                                  winner_id__lte=last_id)
+                .values("winner").annotate(n=Count("*"))
+                .values_list("winner", "n"),
+                "auctions_won")
+        UserStats.objects.bulk_create([
+            UserStats(user_id=user_id, **totals)
+            for user_id, totals in rows.items()])
+
+    rows = defaultdict(dict)
+    _totals(rows, offers.values("listing__category").annotate(n=Count("*"))
+            .values_list("listing__category", "n"),
+            "bids_placed")
+    _totals(rows, listings.values("category").annotate(n=Count("*"))
+            .values_list("category", "n"),
+            "listings_created")
+    _totals(rows, sold.values("category")
+            .annotate(n=Count("*"), s=Sum("bid_listing__offer"))
+            .values_list("category", "n", "s"),
+            "listings_sold", "sales_total")
+    CategoryStats.objects.bulk_create([
+        CategoryStats(category_id=category_id, **totals)
+        for category_id, totals in rows.items()], batch_size=BACKFILL_BATCH)
+
+    rows = defaultdict(dict)
+    _totals(rows, offers.annotate(day=TruncDate("date_placed")).values("day")
+            .annotate(n=Count("*"), s=Sum("amount"))
+            .values_list("day", "n", "s"),
+            "bids_placed", "amount_bid")
+    _totals(rows, listings.values("date_created").annotate(n=Count("*"))
+            .values_list("date_created", "n"),
+            "listings_created")
+    DailyStats.objects.bulk_create([
+        DailyStats(day=day, **totals) for day, totals in rows.items()],
+        batch_size=BACKFILL_BATCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0013_listing_date_modified"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyStats",
+            fields=[
+                ("day", models.DateField(primary_key=True, serialize=False)),
+                ("bids_placed", models.IntegerField(default=0)),
+                ("amount_bid", models.BigIntegerField(default=0)),
+                ("listings_created", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UserStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("bids_placed", models.IntegerField(default=0)),
+                ("amount_bid", models.BigIntegerField(default=0)),
+                ("listings_created", models.IntegerField(default=0)),
+                ("listings_sold", models.IntegerField(default=0)),
+                ("sales_total", models.BigIntegerField(default=0)),
+                ("auctions_won", models.IntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["-bids_placed", "user"],
+                        name="userstats_bidders_idx",
+                    ),
+                    models.Index(
+                        fields=["-sales_total", "user"],
+                        name="userstats_sellers_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="CategoryStats",
+            fields=[
+                (
+                    "category",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="auctions.category",
+                    ),
+                ),
+                ("bids_placed", models.IntegerField(default=0)),
+                ("listings_created", models.IntegerField(default=0)),
+                ("listings_sold", models.IntegerField(default=0)),
+                ("sales_total", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["-sales_total", "category"],
+                        name="categorystats_volume_idx",
+                    ),
+                ],
+            },
+        ),
+        # The running totals start from the history so far
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
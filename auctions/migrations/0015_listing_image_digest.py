@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0014_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listing",
+            name="image_digest",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auctions", "0015_listing_image_digest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProxyBid",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("maximum", models.PositiveIntegerField()),
+                (
+                    "date_placed",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "bidder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="proxy_bids",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "listing",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="proxies",
+                        to="auctions.listing",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["listing", "maximum"],
+                        name="proxybid_listing_max_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="proxybid",
+            constraint=models.UniqueConstraint(
+                fields=("listing", "bidder"), name="one_proxy_per_bidder"
+            ),
+        ),
+    ]
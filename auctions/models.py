@@ -1,6 +1,9 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
 
 
 # User model:
@@ -11,6 +14,83 @@ class User(AbstractUser):
         return self.username
 
 
+# Tries at creating a category before giving up on a contended name
+SLUG_ATTEMPTS = 3
+
+
+class CategoryManager(models.Manager):
+
+    # Fetch a category by its display name, creating it on first use
+    def for_name(self, name):
+        name = name.strip() or "Unspecified"
+        base = slugify(name) or "category"
+
+        for attempt in range(1, SLUG_ATTEMPTS + 1):
+            category = self.filter(name=name).first()
+            if category is not None:
+                return category
+
+            slug = base
+            suffix = 1
+            while self.filter(slug=slug).exists():
+                suffix += 1
+                slug = f"{base}-{suffix}"
+
+            # Another request may take the name or the slug first: the
+            # savepoint keeps the caller's transaction usable, and the
+            # next attempt finds the name or picks another slug
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(name=name, slug=slug)
+            except IntegrityError:
+                if attempt == SLUG_ATTEMPTS:
+                    raise
+
+    # Move a category's active-listing count by delta, without a read
+    def adjust_active_count(self, category_id, delta):
+        self.filter(pk=category_id) \
+            .update(active_count=F("active_count") + delta)
+
+
+# Listing category model:
+class Category(models.Model):
+    name = models.CharField(max_length=24, unique=True)
+    slug = models.SlugField(max_length=32, unique=True)
+
+    # Maintained incrementally as listings are created, closed and reopened
+    active_count = models.PositiveIntegerField(default=0)
+
+    objects = CategoryManager()
+
+    class Meta:
+        verbose_name_plural = "categories"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ListingQuerySet(models.QuerySet):
+
+    # Annotate each listing with its current offer and bid count
+    def with_current_bid(self):
+        current_bid = Bid.objects.filter(listing=OuterRef("pk"))
+
+        return self.annotate(
+            top_offer=Subquery(current_bid.values("offer")[:1]),
+            offer_count=Subquery(current_bid.values("offer_count")[:1]))
+
+    # Retire the cached fragments of these listings after they change,
+    # optionally in the same update as the change itself
+    def bump_version(self, **changes):
+        return self.update(version=F("version") + 1,
+                           date_modified=timezone.now(), **changes)
+
+    # Keep comment_count in step after comments are added or deleted
+    def adjust_comment_count(self, delta):
+        return self.update(comment_count=F("comment_count") + delta,
+                           date_modified=timezone.now())
+
+
 # Auction listing model:
 class Listing(models.Model):
     seller = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -21,16 +101,74 @@ class Listing(models.Model):
     description = models.TextField(max_length=64)
     starting_bid = models.PositiveIntegerField()
     image = models.URLField(blank=True)
-    category = models.CharField(max_length=24, blank=True)
+    # SHA-256 of the stored copy of the image, once fetched; see
+    # auctions.images
+    image_digest = models.CharField(max_length=64, blank=True, default="")
+    # Active listings are indexed by category through
+    # listing_category_feed_idx; the rest are only looked up by category
+    # when one is deleted
+    category = models.ForeignKey(Category,
+                                 on_delete=models.PROTECT,
+                                 related_name="listings",
+                                 db_index=False)
 
     date_created = models.DateField(auto_now_add=True)
+    # Also set by the queryset updates that change a listing's public data
+    date_modified = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
 
+    # Optional scheduled close; see auctions.expiry
+    ends_at = models.DateTimeField(null=True, blank=True)
+    winner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.SET_NULL,
+                               null=True, blank=True,
+                               related_name="auctions_won")
+
+    # Part of every cached fragment's key; see ListingQuerySet.bump_version
+    version = models.PositiveIntegerField(default=1)
+
+    # Denormalized number of comments, so pages needn't count them
+    comment_count = models.PositiveIntegerField(default=0)
+
+    objects = ListingQuerySet.as_manager()
+
+    class Meta:
+        # Partial rather than led by "active": filter(active=True) compiles
+        # to a bare "WHERE active", which SQLite can't match to an indexed
+        # "active = ?" prefix but does match to an index's WHERE clause
+        indexes = [
+            # Covers the active-listings feed and its keyset cursor
+            models.Index(fields=["date_created", "id"],
+                         condition=models.Q(active=True),
+                         name="listing_active_feed_idx"),
+            # Same feed, narrowed to one category
+            models.Index(fields=["category", "date_created", "id"],
+                         condition=models.Q(active=True),
+                         name="listing_category_feed_idx"),
+            # Finds auctions whose end time has passed
+            models.Index(fields=["ends_at"],
+                         condition=models.Q(active=True),
+                         name="listing_expiry_idx"),
+        ]
+
     def __str__(self) -> str:
         return self.title
 
+    # Edits made through save() (e.g. in the admin) retire the cached
+    # fragments too, in the same UPDATE
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+
+        self.version = F("version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version"}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=["version"])
 
-# Bidding model:
+
+# Bidding model (the current price record, one row per listing):
 class Bid(models.Model):
     is_open = models.BooleanField(default=True)
 
@@ -51,12 +189,62 @@ class Bid(models.Model):
 
     offer_count = models.IntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing"],
+                                    name="one_current_bid_per_listing"),
+        ]
+
+
+# Bid history model (append-only, one row per accepted offer):
+class Offer(models.Model):
+    listing = models.ForeignKey(Listing,
+                                on_delete=models.CASCADE,
+                                related_name="offers")
+
+    bidder = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE,
+                               related_name="offers_made")
+
+    amount = models.IntegerField()
+    date_placed = models.DateTimeField(auto_now_add=True)
+
+
+# Proxy bid model (a bidder's private maximum on a listing; see
+# auctions.proxies):
+class ProxyBid(models.Model):
+    listing = models.ForeignKey(Listing,
+                                on_delete=models.CASCADE,
+                                related_name="proxies",
+                                db_index=False)
+
+    bidder = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE,
+                               related_name="proxy_bids")
+
+    maximum = models.PositiveIntegerField()
+    # Reset when the maximum changes; the earlier of two equal maximums wins
+    date_placed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "bidder"],
+                                    name="one_proxy_per_bidder"),
+        ]
+        indexes = [
+            # The proxies still able to outbid a listing's price
+            models.Index(fields=["listing", "maximum"],
+                         name="proxybid_listing_max_idx"),
+        ]
+
 
 # Comments model:
 class Comment(models.Model):
+    # Indexed through comment_thread_idx, whose leading column it is
     item = models.ForeignKey(Listing,
                              on_delete=models.CASCADE,
-                             related_name="comments")
+                             related_name="comments",
+                             db_index=False)
 
     content = models.TextField(max_length=128, null=False, blank=False)
 
@@ -66,6 +254,13 @@ class Comment(models.Model):
 
     date_published = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # A listing's comments, newest first, and their keyset cursor
+            models.Index(fields=["item", "date_published", "id"],
+                         name="comment_thread_idx"),
+        ]
+
 
 # Watchlist model:
 class Watchlist(models.Model):
@@ -75,3 +270,84 @@ class Watchlist(models.Model):
 
     listings = models.ManyToManyField(Listing,
                                       related_name="watchlist_in")
+
+
+# Notification outbox (one pending notice per recipient, written with the
+# change it reports and drained by auctions.notifications):
+class Notification(models.Model):
+    OUTBID = "outbid"
+    CLOSED = "closed"
+    KINDS = [(OUTBID, "Outbid"), (CLOSED, "Auction closed")]
+
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                  on_delete=models.CASCADE,
+                                  related_name="notifications")
+
+    listing = models.ForeignKey(Listing,
+                                on_delete=models.CASCADE,
+                                related_name="notifications")
+
+    kind = models.CharField(max_length=16, choices=KINDS)
+    date_created = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    # Null once delivery has been given up on
+    next_attempt = models.DateTimeField(null=True, default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The notices due for a delivery attempt, oldest first
+            models.Index(fields=["next_attempt", "id"],
+                         name="notification_due_idx"),
+        ]
+
+
+# Statistics (running totals maintained by auctions.stats):
+class UserStats(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+
+    bids_placed = models.IntegerField(default=0)
+    amount_bid = models.BigIntegerField(default=0)
+    listings_created = models.IntegerField(default=0)
+    # Listings closed with a winner, and what they closed at
+    listings_sold = models.IntegerField(default=0)
+    sales_total = models.BigIntegerField(default=0)
+    auctions_won = models.IntegerField(default=0)
+
+    class Meta:
+        # One per leaderboard, read top-down
+        indexes = [
+            models.Index(fields=["-bids_placed", "user"],
+                         name="userstats_bidders_idx"),
+            models.Index(fields=["-sales_total", "user"],
+                         name="userstats_sellers_idx"),
+        ]
+
+
+class CategoryStats(models.Model):
+    category = models.OneToOneField(Category,
+                                    on_delete=models.CASCADE,
+                                    primary_key=True,
+                                    related_name="stats")
+
+    bids_placed = models.IntegerField(default=0)
+    listings_created = models.IntegerField(default=0)
+    listings_sold = models.IntegerField(default=0)
+    sales_total = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-sales_total", "category"],
+                         name="categorystats_volume_idx"),
+        ]
+
+
+class DailyStats(models.Model):
+    day = models.DateField(primary_key=True)
+
+    bids_placed = models.IntegerField(default=0)
+    amount_bid = models.BigIntegerField(default=0)
+    listings_created = models.IntegerField(default=0)
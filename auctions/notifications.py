@@ -0,0 +1,231 @@
+"""
+Outbid and auction-closed notifications, through a transactional outbox.
+
+Nothing is sent from a request. ``notify_outbid()`` and ``notify_closed()``
+each add a single INSERT ... SELECT to the transaction that moves the price
+or closes the auction, queueing one ``Notification`` row per recipient, so
+a notice exists exactly when the change it reports committed.
+
+``dispatch_due()`` (the ``dispatch_notifications`` worker) drains the
+outbox a batch at a time. It leases the due rows, folds each recipient's
+notices into one message, sends it through the ``NOTIFICATION_TRANSPORT``
+and deletes what was delivered. A failed message is retried with
+exponential backoff, up to ``MAX_ATTEMPTS`` times. A worker that dies
+mid-batch simply lets its lease run out, so delivery is at least once.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .database import claim_rows
+from .models import Bid, Listing, Notification, Offer, Watchlist
+
+
+logger = logging.getLogger(__name__)
+
+# Notices leased per batch, and how long a lease lasts
+DISPATCH_BATCH = 500
+LEASE = timedelta(minutes=5)
+
+# Retry delays double from BACKOFF_BASE up to BACKOFF_MAX
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+
+class EmailTransport:
+    """
+    Sends through a Django email backend: ``EMAIL_BACKEND`` unless
+    ``backend`` is given (the file and locmem backends stand in for SMTP).
+    """
+
+    def __init__(self, backend=None, from_email=None, **options):
+        self.connection = get_connection(backend, **options)
+        self.from_email = from_email
+
+    def send(self, user, subject, body):
+        EmailMessage(subject, body, self.from_email, [user.email],
+                     connection=self.connection).send()
+
+
+def get_transport():
+    transport = import_string(settings.NOTIFICATION_TRANSPORT)
+    return transport(**settings.NOTIFICATION_TRANSPORT_OPTIONS)
+
+
+# Queueing (called inside the transaction that makes the change)
+
+def notify_outbid(listing_id, first_offer_id, leader_id, using="default"):
+    """
+    Queue an outbid notice for everyone who led the listing before
+    ``first_offer_id``, the first offer written by this transaction, or
+    since it, other than the final ``leader_id``.
+    """
+    offers = Offer._meta.db_table
+    now = _now(using)
+    _insert(f"""
+        SELECT DISTINCT bidder_id, listing_id, %s, %s, 0, %s, ''
+        FROM {offers}
+        WHERE listing_id = %s AND bidder_id <> %s AND id >= COALESCE(
+            (SELECT MAX(id) FROM {offers}
+             WHERE listing_id = %s AND id < %s), %s)
+    """, [Notification.OUTBID, now, now, listing_id, leader_id,
+          listing_id, first_offer_id, first_offer_id], using)
+
+
+def notify_closed(listing_ids, using="default"):
+    """
+    Queue a closing notice for the watchers and the winner of each listing,
+    once each.
+    """
+    if not listing_ids:
+        return
+    through = Watchlist.listings.through._meta.db_table
+    watchlists = Watchlist._meta.db_table
+    listings = Listing._meta.db_table
+    ids = ", ".join(["%s"] * len(listing_ids))
+    now = _now(using)
+    _insert(f"""
+        SELECT w.user_id, wl.listing_id, %s, %s, 0, %s, ''
+        FROM {through} wl JOIN {watchlists} w ON w.id = wl.watchlist_id
+        WHERE wl.listing_id IN ({ids})
+        UNION
+        SELECT winner_id, id, %s, %s, 0, %s, ''
+        FROM {listings}
+        WHERE id IN ({ids}) AND winner_id IS NOT NULL
+    """, [Notification.CLOSED, now, now, *listing_ids,
+          Notification.CLOSED, now, now, *listing_ids], using)
+
+
+def _now(using):
+    return connections[using].ops.adapt_datetimefield_value(timezone.now())
+
+
+def _insert(select, params, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Notification._meta.db_table} (recipient_id, "
+            f"listing_id, kind, date_created, attempts, next_attempt, "
+            f"last_error) {select}", params)
+
+
+# Dispatching
+
+def dispatch_due(transport=None, now=None, batch_size=DISPATCH_BATCH,
+                 using="default"):
+    """
+    Send every notice due by ``now``; returns the messages sent and failed.
+    """
+    transport = transport or get_transport()
+    now = now or timezone.now()
+    sent = failed = 0
+
+    while True:
+        batch_sent, batch_failed, claimed = dispatch_batch(
+            transport, now, batch_size, using)
+        sent += batch_sent
+        failed += batch_failed
+        if claimed < batch_size:
+            return sent, failed
+
+
+def dispatch_batch(transport, now, batch_size=DISPATCH_BATCH,
+                   using="default"):
+    """
+    Lease a batch of due notices and send them, one message per recipient.
+    Returns the messages sent and failed, and the notices leased.
+    """
+    with transaction.atomic(using=using):
+        due = claim_rows(Notification.objects.using(using)
+                         .filter(next_attempt__lte=now)
+                         .order_by("next_attempt", "id"), using)
+        ids = list(due.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return 0, 0, 0
+        Notification.objects.using(using).filter(pk__in=ids) \
+            .update(next_attempt=now + LEASE)
+
+    notices = list(Notification.objects.using(using).filter(pk__in=ids)
+                   .select_related("recipient", "listing").order_by("id"))
+    prices = dict(Bid.objects.using(using)
+                  .filter(listing__in={notice.listing_id
+                                       for notice in notices})
+                  .values_list("listing_id", "offer"))
+
+    by_recipient = defaultdict(list)
+    for notice in notices:
+        by_recipient[notice.recipient].append(notice)
+
+    sent = failed = 0
+    delivered = []
+    for recipient, group in by_recipient.items():
+        # Nowhere to send it; dropped with the rest
+        if not recipient.email:
+            delivered += group
+            continue
+
+        try:
+            transport.send(recipient, *compose(recipient, group, prices))
+        except Exception as error:
+            logger.warning("Notifying %s failed: %s", recipient, error)
+            _retry(group, error, now, using)
+            failed += 1
+        else:
+            delivered += group
+            sent += 1
+
+    Notification.objects.using(using) \
+        .filter(pk__in=[notice.pk for notice in delivered]).delete()
+    return sent, failed, len(ids)
+
+
+def compose(recipient, notices, prices):
+    """The subject and body of one message covering all of ``notices``."""
+    lines = {}
+    for notice in notices:
+        listing = notice.listing
+        price = prices.get(listing.pk)
+
+        if notice.kind == Notification.OUTBID:
+            line = (f"You've been outbid on {listing.title}",
+                    f"the current bid is ${price}")
+        elif listing.winner_id == recipient.pk:
+            line = (f"You won {listing.title}", f"your bid was ${price}")
+        elif price is not None:
+            line = (f"{listing.title} has closed",
+                    f"the winning bid was ${price}")
+        else:
+            line = (f"{listing.title} has closed", "there were no bids")
+
+        # Repeats of one event on one listing collapse into one line
+        lines[notice.kind, listing.pk] = line
+
+    if len(lines) == 1:
+        subject, = (summary for summary, _ in lines.values())
+    else:
+        subject = f"{len(lines)} updates on your auctions"
+    body = "\n".join(f"{summary}: {detail}."
+                     for summary, detail in lines.values())
+    return subject, f"Hello {recipient.username},\n\n{body}\n"
+
+
+def _retry(notices, error, now, using):
+    attempts = max(notice.attempts for notice in notices) + 1
+    if attempts >= MAX_ATTEMPTS:
+        logger.error("Gave up on notices %s after %d attempts",
+                     [notice.pk for notice in notices], attempts)
+        next_attempt = None
+    else:
+        next_attempt = now + min(BACKOFF_BASE * 2 ** (attempts - 1),
+                                 BACKOFF_MAX)
+
+    Notification.objects.using(using) \
+        .filter(pk__in=[notice.pk for notice in notices]) \
+        .update(attempts=attempts, next_attempt=next_attempt,
+                last_error=str(error))
@@ -0,0 +1,130 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# Opaque cursor helpers:
+def encode_cursor(values) -> str:
+    raw = json.dumps([str(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+
+    try:
+        padding = "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(token + padding))
+
+    # A tampered or truncated cursor simply restarts from the first page
+    except (ValueError, TypeError):
+        return None
+
+    # Cursors are written as lists of strings
+    if not isinstance(values, list) \
+            or not all(isinstance(value, str) for value in values):
+        return None
+    return values
+
+
+# Keyset ("seek") pagination over a queryset:
+def keyset_page(queryset, cursor, size, fields=("date_created", "id"),
+                descending=True):
+    """
+    Return ``(items, next_cursor)`` for the page that follows ``cursor``.
+
+    Rows are ordered by ``fields`` and the page boundary is expressed as a
+    WHERE clause on those same columns instead of an OFFSET, so the cost of
+    a page stays flat however deep the reader goes, provided an index on
+    ``fields`` exists.
+    """
+    queryset = _seek(queryset, cursor, fields, descending)
+    return _split(list(queryset[:size + 1]), size, fields)
+
+
+# The same, read through the async ORM:
+async def akeyset_page(queryset, cursor, size, fields=("date_created", "id"),
+                       descending=True):
+    queryset = _seek(queryset, cursor, fields, descending)
+    return _split([item async for item in queryset[:size + 1]], size,
+                  fields)
+
+
+def _seek(queryset, cursor, fields, descending):
+    order = [("-" if descending else "") + field for field in fields]
+    queryset = queryset.order_by(*order)
+
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == len(fields):
+        values = _typed(queryset.model, fields, values)
+        if values is not None:
+            queryset = queryset.filter(_after(fields, values, descending))
+    return queryset
+
+
+def _typed(model, fields, values):
+    # The cursor's values as their fields' types; None if any of them isn't
+    # a valid one, which restarts from the first page like a bad cursor
+    typed = []
+    try:
+        for name, value in zip(fields, values):
+            field = _field(model, name)
+            value = field.to_python(value)
+            if value is None:
+                return None
+            # Range checks too, so the database can bind the value (SQLite
+            # declares no range of its own)
+            field.run_validators(value)
+            if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                return None
+            typed.append(value)
+    except (ValidationError, ValueError, TypeError):
+        return None
+    return typed
+
+
+def _field(model, path):
+    *relations, name = path.split("__")
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _split(items, size, fields):
+    # One row past the page tells whether there is a next one
+    next_cursor = None
+
+    if len(items) > size:
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            [_lookup(last, field) for field in fields])
+
+    return items, next_cursor
+
+
+def _after(fields, values, descending):
+    # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), expanded for N columns
+    op = "lt" if descending else "gt"
+    condition = Q()
+
+    for i, field in enumerate(fields):
+        term = Q(**{f"{field}__{op}": values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev_field: prev_value})
+        condition |= term
+
+    return condition
+
+
+def _lookup(obj, field):
+    # Rows from values() carry the whole lookup path as their key
+    if isinstance(obj, dict):
+        return obj[field]
+
+    for part in field.split("__"):
+        obj = getattr(obj, part)
+    return obj
@@ -0,0 +1,285 @@
+"""
+Opt-in per-request profiling.
+
+With ``PROFILING`` on, ``ProfilingMiddleware`` times every request and
+records, per URL name, the view's wall time, its ORM query count and time,
+the time spent rendering templates and the hits and misses of our cache
+helpers. The numbers are kept as in-process histograms and served in the
+Prometheus text format at ``/metrics``.
+
+A sampled fraction of requests (``PROFILING_SAMPLE_RATE``) also runs under
+cProfile; the ``PROFILING_SLOWEST`` slowest of those are kept as ``.prof``
+files in ``PROFILING_DIR`` for ``python -m pstats`` or snakeviz. cProfile
+follows a single thread, and under ASGI a request's work is spread over
+the event loop and ``sync_to_async()`` threads, so only requests handled
+synchronously are sampled.
+
+With ``PROFILING`` off the middleware removes itself at startup, and the
+cache helpers' ``record_cache()`` calls cost one context variable lookup.
+"""
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import heapq
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+
+from .middleware import HybridMiddleware
+
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+# Measurements of the request being handled, if it is being profiled
+_current = contextvars.ContextVar("profiling_request", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects them."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6g}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class Registry:
+    """Per-view histograms and cache counters, shared by every thread."""
+
+    HISTOGRAMS = {
+        "commerce_request_duration_seconds":
+            ("Time spent producing the response.", SECONDS_BUCKETS),
+        "commerce_db_queries":
+            ("ORM queries run per request.", QUERY_BUCKETS),
+        "commerce_db_duration_seconds":
+            ("Time spent in ORM queries per request.", SECONDS_BUCKETS),
+        "commerce_template_duration_seconds":
+            ("Time spent rendering templates per request.", SECONDS_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {
+                name: defaultdict(lambda bounds=bounds: Histogram(bounds))
+                for name, (_, bounds) in self.HISTOGRAMS.items()
+            }
+            # (view, cache helper, "hit" or "miss") -> count
+            self.cache = defaultdict(int)
+
+    def record(self, view, measurements):
+        with self._lock:
+            for name, value in zip(self.HISTOGRAMS, (
+                    measurements.duration, measurements.queries,
+                    measurements.query_time, measurements.template_time)):
+                self.histograms[name][view].observe(value)
+            for key, count in measurements.cache.items():
+                self.cache[(view, *key)] += count
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for view, histogram in sorted(self.histograms[name].items()):
+                    lines.extend(histogram.lines(name, f'view="{view}"'))
+
+            lines.append("# HELP commerce_cache_requests_total Cache helper "
+                         "lookups, by outcome.")
+            lines.append("# TYPE commerce_cache_requests_total counter")
+            for (view, helper, outcome), count in sorted(self.cache.items()):
+                lines.append(f'commerce_cache_requests_total{{view="{view}",'
+                             f'cache="{helper}",result="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Measurements:
+
+    def __init__(self):
+        self.duration = 0
+        self.queries = 0
+        self.query_time = 0
+        self.template_time = 0
+        # Inside a top-level template render
+        self.rendering = False
+        # (cache helper, "hit" or "miss") -> count
+        self.cache = defaultdict(int)
+
+
+# Installed as an execute wrapper on every connection, in every thread;
+# counts for the request in _current, which sync_to_async() carries over
+def _record_query(execute, sql, params, many, context):
+    measurements = _current.get()
+    if measurements is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        measurements.queries += 1
+        measurements.query_time += time.perf_counter() - started
+
+
+def _instrument_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Called by cache helpers on every lookup; free unless profiling:
+def record_cache(helper, hit):
+    measurements = _current.get()
+    if measurements is not None:
+        measurements.cache[(helper, "hit" if hit else "miss")] += 1
+
+
+class SlowestProfiles:
+    """Keeps the profiles of the N slowest sampled requests on disk."""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        # (duration, path) min-heap of the files currently kept
+        self._kept = []
+        self._lock = threading.Lock()
+
+    def offer(self, profiler, view, duration):
+        with self._lock:
+            if len(self._kept) >= self.keep and duration <= self._kept[0][0]:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "{}-{:.1f}ms-{}.prof".format(
+                view, duration * 1000, time.time_ns()))
+            profiler.dump_stats(path)
+
+            if len(self._kept) >= self.keep:
+                _, evicted = heapq.heapreplace(self._kept, (duration, path))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(evicted)
+            else:
+                heapq.heappush(self._kept, (duration, path))
+
+
+def _instrument_templates():
+    # Time top-level renders only; included templates run inside them
+    render = django_backend.Template.render
+    if getattr(render, "profiled", False):
+        return
+
+    def timed_render(self, context=None, request=None):
+        measurements = _current.get()
+        # Keep nested renders (e.g. from inclusion tags) out of the total
+        if measurements is None or measurements.rendering:
+            return render(self, context, request)
+
+        measurements.rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            measurements.template_time += time.perf_counter() - started
+            measurements.rendering = False
+
+    timed_render.profiled = True
+    django_backend.Template.render = timed_render
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """Records each request's measurements in ``registry``."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed()
+
+        super().__init__(get_response)
+
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.slowest = SlowestProfiles(settings.PROFILING_DIR,
+                                       settings.PROFILING_SLOWEST)
+        # cProfile only follows one thread at a time
+        self._profiling = threading.Lock()
+        _instrument_templates()
+
+        # Connections opened from now on, in any thread, and this thread's
+        for connection in connections.all():
+            _instrument_connection(connection)
+        connection_created.connect(_instrument_connection,
+                                   dispatch_uid="profiling")
+
+    def handle(self, request):
+        measurements = Measurements()
+        profiler = None
+        if random.random() < self.sample_rate \
+                and self._profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+
+        token = _current.set(measurements)
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling.release()
+            measurements.duration = time.perf_counter() - started
+            _current.reset(token)
+
+        view = self._record(request, measurements)
+        if profiler is not None:
+            self.slowest.offer(profiler, view, measurements.duration)
+        return response
+
+    async def __acall__(self, request):
+        measurements = Measurements()
+        token = _current.set(measurements)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            measurements.duration = time.perf_counter() - started
+            _current.reset(token)
+
+        self._record(request, measurements)
+        return response
+
+    def _record(self, request, measurements):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unmatched"
+        registry.record(view, measurements)
+        return view
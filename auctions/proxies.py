@@ -0,0 +1,82 @@
+"""
+Resolution engine for proxy (automatic maximum) bidding.
+
+Each bidder may keep a private maximum on a listing. Rather than replaying
+the bidding war one increment at a time, ``resolve()`` settles every
+competing maximum in a single pass. The price rises until only one bidder
+can still afford it, so the leader pays one increment over the runner-up's
+maximum and never more than their own. This is the outcome of the war, not
+its transcript, which is all the current price record needs.
+
+Ties go to the standing bid, then to the maximum placed first. The module
+is plain Python with no database access; ``auctions.bidding`` feeds it the
+listing's proxies and writes the result.
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Proxy:
+    bidder: int
+    maximum: int
+    # Orders proxies placed at the same maximum; earlier wins
+    placed: object
+
+
+@dataclass(frozen=True)
+class Resolution:
+    price: int
+    leader: int
+
+    # Whether the listing's current price record changes
+    changed: bool
+
+
+def resolve(proxies, price=None, leader=None, starting_bid=0, increment=1):
+    """
+    Settle ``proxies`` (at most one per bidder) against the listing's
+    standing ``price`` and ``leader``, both None before the first bid.
+
+    Returns the resulting Resolution, or None if the listing has no bid and
+    no proxy reaches ``starting_bid``. Runs in O(len(proxies)).
+    """
+    # The two strongest competitors other than the standing leader, as
+    # (maximum, placed, bidder); the leader's maximum is folded in below
+    best = second = None
+    leader_maximum = price
+
+    for proxy in proxies:
+        if proxy.bidder == leader:
+            leader_maximum = max(leader_maximum, proxy.maximum)
+            continue
+        if proxy.maximum < starting_bid:
+            continue
+
+        entry = (proxy.maximum, proxy.placed, proxy.bidder)
+        if best is None or _beats(entry, best):
+            best, second = entry, best
+        elif second is None or _beats(entry, second):
+            second = entry
+
+    if leader is not None:
+        # Outranks every proxy at its maximum
+        standing = (leader_maximum, None, leader)
+        if best is None or standing[0] >= best[0]:
+            best, second = standing, best
+        elif second is None or standing[0] >= second[0]:
+            second = standing
+
+    if best is None:
+        return None
+
+    new_price = starting_bid if price is None else price
+    if second is not None:
+        new_price = max(new_price, min(best[0], second[0] + increment))
+
+    return Resolution(price=new_price, leader=best[2],
+                      changed=(new_price, best[2]) != (price, leader))
+
+
+def _beats(entry, other):
+    return entry[0] > other[0] or \
+        (entry[0] == other[0] and entry[1] < other[1])
@@ -0,0 +1,166 @@
+"""
+Rate limiting for the endpoints that write.
+
+``RATE_LIMITS`` maps URL names to rates such as ``"30/m"``: a token bucket
+holding 30 requests that refills at 30 a minute, so a client can burst
+through the whole bucket and then keep to the rate. Signed-in users get a
+bucket per URL name, anonymous clients one per IP address (read through
+any trusted reverse proxies; see ``client_address()``). Only requests that
+change state are counted (not GET, HEAD or OPTIONS); one finding its
+bucket empty is answered with a 429 and ``Retry-After``.
+
+A bucket is stored in the ``RATE_LIMIT_CACHE`` as a single timestamp, the
+time at which it will be full again, so a check is one cache get and one
+set with no database access. LocMemCache keeps each process's buckets to
+itself; point the alias at a shared backend to limit clients across
+processes, where concurrent updates may let the odd extra request through.
+"""
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
+
+from .middleware import HybridMiddleware
+
+
+# Rate suffix -> period in seconds
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+UNLIMITED_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Makes each get-and-set atomic within the process
+_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """``"30/m"`` -> (30, 60): the bucket's size and its refill period."""
+    try:
+        count, period = rate.split("/")
+        count, seconds = int(count), PERIODS[period]
+    except (ValueError, KeyError):
+        count = 0
+    if count < 1:
+        raise ImproperlyConfigured(
+            f"Invalid rate limit {rate!r}; expected e.g. '30/m'.")
+    return count, seconds
+
+
+class TokenBucket:
+
+    def __init__(self, cache, rate):
+        count, period = parse_rate(rate)
+        self.cache = cache
+        self.period = period
+        # Seconds to refill one token
+        self.interval = period / count
+
+    def take(self, key, now=None):
+        """
+        Take a token from the bucket at ``key``. Returns 0 if there was one,
+        otherwise the seconds until there will be.
+        """
+        now = time.time() if now is None else now
+        with _lock:
+            # A missing bucket is a full one
+            full_at = max(self.cache.get(key, now), now) + self.interval
+            # More than a bucket's worth of tokens missing: none left
+            wait = full_at - now - self.period
+            if wait > 0:
+                return wait
+            self.cache.set(key, full_at, math.ceil(full_at - now))
+        return 0
+
+
+class RateLimitMiddleware(HybridMiddleware):
+    """Applies ``RATE_LIMITS`` to the views they name."""
+
+    def __init__(self, get_response):
+        if not settings.RATE_LIMITS:
+            raise MiddlewareNotUsed()
+
+        super().__init__(get_response)
+
+        cache = caches[settings.RATE_LIMIT_CACHE]
+        self.buckets = {name: TokenBucket(cache, rate)
+                        for name, rate in settings.RATE_LIMITS.items()}
+        self.trusted_proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+        self.client_header = settings.RATE_LIMIT_CLIENT_HEADER
+
+        # Requests are matched on the paths of the limited views, before
+        # the URL is resolved; only views taking arguments need resolving
+        self.paths = {}
+        self.resolving = False
+        for name in self.buckets:
+            try:
+                self.paths[reverse(name)] = name
+            except NoReverseMatch:
+                self.resolving = True
+
+    def handle(self, request):
+        name = self._limited(request)
+        if name is not None:
+            response = self._take(request, name)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        name = self._limited(request)
+        if name is not None:
+            # Reading request.user may load the session from the database
+            response = await sync_to_async(self._take)(request, name)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def _limited(self, request):
+        # The URL name whose limit applies to the request, if any
+        if request.method in UNLIMITED_METHODS:
+            return None
+        name = self.paths.get(request.path_info)
+        if name is None and self.resolving:
+            try:
+                name = resolve(request.path_info).url_name
+            except Resolver404:
+                return None
+            if name not in self.buckets:
+                return None
+        return name
+
+    def _take(self, request, name):
+        wait = self.buckets[name].take(
+            f"ratelimit:{name}:{self.client_key(request)}")
+        if not wait:
+            return None
+
+        # Plain text: the clients turned away most are the ones hammering us
+        response = HttpResponse("Too many requests. Try again shortly.",
+                                content_type="text/plain", status=429)
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
+
+    def client_key(self, request):
+        if request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"ip:{self.client_address(request)}"
+
+    def client_address(self, request):
+        """
+        The client's IP address: ``REMOTE_ADDR``, unless the app is behind
+        ``RATE_LIMIT_TRUSTED_PROXIES`` reverse proxies. Each of those
+        appends the address it was connected from to the
+        ``RATE_LIMIT_CLIENT_HEADER``, so the client's is the one added by
+        the outermost; any before it could be forged by the client.
+        """
+        if self.trusted_proxies:
+            addresses = [address.strip() for address in request.META.get(
+                self.client_header, "").split(",") if address.strip()]
+            if addresses:
+                return addresses[-min(self.trusted_proxies, len(addresses))]
+        return request.META.get("REMOTE_ADDR", "")
@@ -0,0 +1,62 @@
+from django.core.cache import cache
+
+from .models import Listing
+from .profiling import record_cache
+from .routers import cached_from_primary
+
+
+# Number of listings shown in the detail page's sidebar
+RELATED_LISTINGS = 6
+
+# Candidates cached per group; one spare so the current listing can be dropped
+CANDIDATES = RELATED_LISTINGS + 1
+
+CANDIDATES_TIMEOUT = 60 * 60
+
+
+def _key(category_id):
+    if category_id is None:
+        return "related:recent"
+    return f"related:category:{category_id}"
+
+
+# Newest active listings of a category (or overall when category is None):
+def candidates(category_id=None):
+    key = _key(category_id)
+    cached = cache.get(key)
+    record_cache("related", cached is not None)
+
+    if cached is None:
+        group = cached_from_primary(Listing.objects.filter(active=True))
+        if category_id is not None:
+            group = group.filter(category_id=category_id)
+
+        cached = list(group.order_by("-date_created", "-id")
+                      .values("id", "title", "image", "image_digest",
+                              "starting_bid")
+                      [:CANDIDATES])
+        cache.set(key, cached, CANDIDATES_TIMEOUT)
+
+    return cached
+
+
+# Sidebar listings for a detail page: same category first, then newest:
+def related_listings(listing):
+    related = []
+    seen = {listing.pk}
+
+    for group in (listing.category_id, None):
+        for candidate in candidates(group):
+            if candidate["id"] not in seen:
+                related.append(candidate)
+                seen.add(candidate["id"])
+
+        if len(related) >= RELATED_LISTINGS:
+            break
+
+    return related[:RELATED_LISTINGS]
+
+
+# Drop cached candidates after a listing is created, closed or reopened:
+def invalidate_related(category_id):
+    cache.delete_many([_key(category_id), _key(None)])
@@ -0,0 +1,109 @@
+"""
+Read-replica routing.
+
+Writes, and reads outside requests (workers, management commands), always
+go to the primary, ``default``. ``ReplicaMiddleware`` sends the reads of
+safe (GET or HEAD) requests to one of ``REPLICA_DATABASES``, chosen once
+per request so a page is read from a single snapshot, except:
+
+- reads after a write in the same request go back to the primary;
+- a request that writes pins its user's reads to the primary for
+  ``REPLICA_PIN_SECONDS`` (a cookie), long enough for the replicas to
+  catch up, so users always see their own bids, comments and watchlist
+  changes;
+- sessions are always read from the primary, as are the reads that fill
+  caches (``cached_from_primary()``).
+
+Without replicas configured the middleware removes itself and every query
+goes to the primary.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .middleware import HybridMiddleware
+
+
+PRIMARY = "default"
+
+# Apps whose reads never go to a replica
+PRIMARY_APPS = {"sessions"}
+
+PIN_COOKIE = "primary_pin"
+
+# Routing state of the request being handled, if any
+_request = contextvars.ContextVar("replica_request", default=None)
+
+
+# For reads whose results are cached: a lagging replica's answer would be
+# served from the cache for the whole timeout, long after the replica
+# caught up, so these always read the primary
+def cached_from_primary(queryset):
+    """``queryset`` (or a manager's rows) read from the primary."""
+    return queryset.using(PRIMARY)
+
+
+class RequestRouting:
+    # Shared by every context the request runs in (e.g. sync_to_async
+    # threads), so a write anywhere in it is seen by the middleware
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        routing = _request.get()
+        if routing is None or routing.wrote or routing.replica is None \
+                or model._meta.app_label in PRIMARY_APPS:
+            return PRIMARY
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _request.get()
+        if routing is not None:
+            routing.wrote = True
+        return PRIMARY
+
+
+class ReplicaMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def handle(self, request):
+        routing = self._routing(request)
+        token = _request.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self._pin(routing, response)
+
+    async def __acall__(self, request):
+        routing = self._routing(request)
+        token = _request.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self._pin(routing, response)
+
+    def _routing(self, request):
+        replica = None
+        if request.method in ("GET", "HEAD") \
+                and PIN_COOKIE not in request.COOKIES:
+            replica = random.choice(settings.REPLICA_DATABASES)
+        return RequestRouting(replica)
+
+    def _pin(self, routing, response):
+        if routing.wrote:
+            response.set_cookie(PIN_COOKIE, "1",
+                                max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,280 @@
+"""
+Full-text search over listings.
+
+Each database vendor keeps a side table keyed by listing id: an FTS5 virtual
+table on SQLite and a tsvector table with a GIN index on PostgreSQL. Both
+are reached through the same small interface:
+
+    backend = get_backend()
+    backend.index([listing.pk])
+    backend.remove([listing.pk])
+    listings, next_cursor = backend.search("lam", max_price=50)
+
+Results are ranked best first and paged with a (score, id) cursor.
+"""
+import math
+import re
+
+from django.db import connections
+from django.db.models.functions import Coalesce
+
+from .models import Listing
+from .pagination import decode_cursor, encode_cursor
+
+
+# Results per page
+RESULTS_PER_PAGE = 20
+
+# Listing ids re-indexed per statement (keeps SQLite under its variable limit)
+INDEX_BATCH = 500
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def terms(query):
+    return WORD.findall(query.lower())[:16]
+
+
+def cursor_position(cursor):
+    """The (score, listing id) a cursor resumes after, or None if invalid."""
+    after = decode_cursor(cursor)
+    if not after or len(after) != 2:
+        return None
+    try:
+        score, listing_id = float(after[0]), int(after[1])
+    except (ValueError, TypeError):
+        return None
+    # Also keeps out values the database can't bind
+    if not math.isfinite(score) or not 0 <= listing_id < 2 ** 63:
+        return None
+    return score, listing_id
+
+
+class SearchBackend:
+    """
+    Fallback for databases without a native full-text engine: maintains no
+    index and answers with unranked substring matches on the title.
+    """
+
+    def __init__(self, using="default"):
+        self.using = using
+
+    def index(self, listing_ids):
+        pass
+
+    def remove(self, listing_ids):
+        pass
+
+    def search(self, query, min_price=None, max_price=None, active=True,
+               cursor=None, limit=RESULTS_PER_PAGE):
+        words = terms(query)
+        if not words:
+            return [], None
+
+        group = Listing.objects.using(self.using).with_current_bid() \
+            .annotate(price=Coalesce("top_offer", "starting_bid"))
+        for word in words:
+            group = group.filter(title__icontains=word)
+        if active is not None:
+            group = group.filter(active=active)
+        if min_price is not None:
+            group = group.filter(price__gte=min_price)
+        if max_price is not None:
+            group = group.filter(price__lte=max_price)
+
+        after = cursor_position(cursor)
+        if after is not None:
+            group = group.filter(pk__gt=after[1])
+
+        scored = [(0, listing_id) for listing_id in
+                  group.order_by("pk").values_list("pk", flat=True)
+                  [:limit + 1]]
+        return self._page(scored, limit)
+
+    # Shared by every backend: load the page's listings in rank order
+    def _page(self, scored, limit):
+        next_cursor = None
+        if len(scored) > limit:
+            scored = scored[:limit]
+            next_cursor = encode_cursor(scored[-1])
+
+        found = Listing.objects.using(self.using) \
+            .select_related("seller", "category").with_current_bid() \
+            .in_bulk([listing_id for _, listing_id in scored])
+
+        return [found[listing_id] for _, listing_id in scored
+                if listing_id in found], next_cursor
+
+    def _filters(self, min_price, max_price, active, cursor, ascending):
+        # WHERE fragments over m.id/m.score/m.active and the joined l/b rows
+        where, params = [], []
+        joins = min_price is not None or max_price is not None
+
+        if active is not None:
+            where.append("m.active = %s")
+            params.append(bool(active))
+        if min_price is not None:
+            where.append("COALESCE(b.offer, l.starting_bid) >= %s")
+            params.append(min_price)
+        if max_price is not None:
+            where.append("COALESCE(b.offer, l.starting_bid) <= %s")
+            params.append(max_price)
+
+        after = cursor_position(cursor)
+        if after is not None:
+            score, listing_id = after
+            op = ">" if ascending else "<"
+            where.append(f"(m.score {op} %s OR "
+                         f"(m.score = %s AND m.id > %s))")
+            params.extend([score, score, listing_id])
+
+        return joins, where, params
+
+    def _run(self, ranked_sql, ranked_params, filters, ascending, limit):
+        joins, where, params = filters
+        sql = f"SELECT m.score, m.id FROM ({ranked_sql}) AS m"
+        if joins:
+            sql += (" JOIN auctions_listing l ON l.id = m.id"
+                    " LEFT JOIN auctions_bid b ON b.listing_id = m.id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.score {}, m.id LIMIT %s".format(
+            "ASC" if ascending else "DESC")
+
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, ranked_params + params + [limit + 1])
+            return cursor.fetchall()
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 table ``auctions_listing_fts`` with rowid = listing id."""
+
+    table = "auctions_listing_fts"
+
+    def index(self, listing_ids):
+        listing_ids = list(listing_ids)
+
+        with connections[self.using].cursor() as cursor:
+            for start in range(0, len(listing_ids), INDEX_BATCH):
+                batch = listing_ids[start:start + INDEX_BATCH]
+                marks = ", ".join(["%s"] * len(batch))
+                cursor.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN ({marks})",
+                    batch)
+                cursor.execute(
+                    f"INSERT INTO {self.table}"
+                    f" (rowid, title, description, category, active)"
+                    f" SELECT l.id, l.title, l.description, c.name, l.active"
+                    f" FROM auctions_listing l"
+                    f" JOIN auctions_category c ON c.id = l.category_id"
+                    f" WHERE l.id IN ({marks})", batch)
+
+    def remove(self, listing_ids):
+        listing_ids = list(listing_ids)
+
+        with connections[self.using].cursor() as cursor:
+            for start in range(0, len(listing_ids), INDEX_BATCH):
+                batch = listing_ids[start:start + INDEX_BATCH]
+                marks = ", ".join(["%s"] * len(batch))
+                cursor.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN ({marks})",
+                    batch)
+
+    def search(self, query, min_price=None, max_price=None, active=True,
+               cursor=None, limit=RESULTS_PER_PAGE):
+        words = terms(query)
+        if not words:
+            return [], None
+
+        # Every word must match; each one also matches as a prefix
+        match = " ".join(f'"{word}"*' for word in words)
+
+        # bm25() is lower-is-better; title and category outweigh description
+        ranked = (f"SELECT rowid AS id, active,"
+                  f" bm25({self.table}, 10.0, 1.0, 5.0) AS score"
+                  f" FROM {self.table} WHERE {self.table} MATCH %s")
+
+        filters = self._filters(min_price, max_price, active, cursor,
+                                ascending=True)
+        rows = self._run(ranked, [match], filters, True, limit)
+        return self._page(rows, limit)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """``auctions_listing_search`` (listing_id, document tsvector, active)."""
+
+    table = "auctions_listing_search"
+
+    def index(self, listing_ids):
+        listing_ids = list(listing_ids)
+
+        with connections[self.using].cursor() as cursor:
+            for start in range(0, len(listing_ids), INDEX_BATCH):
+                cursor.execute(
+                    f"INSERT INTO {self.table} (listing_id, document, active)"
+                    f" SELECT l.id,"
+                    f" setweight(to_tsvector('simple', l.title), 'A') ||"
+                    f" setweight(to_tsvector('simple', c.name), 'B') ||"
+                    f" setweight(to_tsvector('simple', l.description), 'D'),"
+                    f" l.active"
+                    f" FROM auctions_listing l"
+                    f" JOIN auctions_category c ON c.id = l.category_id"
+                    f" WHERE l.id = ANY(%s)"
+                    f" ON CONFLICT (listing_id) DO UPDATE"
+                    f" SET document = EXCLUDED.document,"
+                    f" active = EXCLUDED.active",
+                    [listing_ids[start:start + INDEX_BATCH]])
+
+    def remove(self, listing_ids):
+        # The foreign key's ON DELETE CASCADE covers deletes made in SQL
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE listing_id = ANY(%s)",
+                [list(listing_ids)])
+
+    def search(self, query, min_price=None, max_price=None, active=True,
+               cursor=None, limit=RESULTS_PER_PAGE):
+        words = terms(query)
+        if not words:
+            return [], None
+
+        match = " & ".join(f"{word}:*" for word in words)
+
+        # ts_rank_cd() is higher-is-better, hence the descending order
+        ranked = (f"SELECT listing_id AS id, active,"
+                  f" ts_rank_cd(document, query) AS score"
+                  f" FROM {self.table}, to_tsquery('simple', %s) AS query"
+                  f" WHERE document @@ query")
+
+        filters = self._filters(min_price, max_price, active, cursor,
+                                ascending=False)
+        rows = self._run(ranked, [match], filters, False, limit)
+        return self._page(rows, limit)
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(using="default"):
+    vendor = connections[using].vendor
+    return BACKENDS.get(vendor, SearchBackend)(using)
+
+
+# Keep the index in step after a queryset update closes or reopens a
+# listing (save() and delete() are covered by the receivers below):
+def index_listing(listing):
+    get_backend().index([listing.pk])
+
+
+# Signal receivers; connected in AuctionsConfig.ready()
+
+def listing_saved(sender, instance, raw=False, using="default", **kwargs):
+    if not raw:
+        get_backend(using).index([instance.pk])
+
+
+def listing_deleted(sender, instance, using="default", **kwargs):
+    get_backend(using).remove([instance.pk])
@@ -0,0 +1,226 @@
+"""
+Static asset pipeline, for deployments without a separate static server.
+
+With ``STATIC_PIPELINE`` on (``COMMERCE_STATIC_PIPELINE=1``),
+``collectstatic`` writes each asset to ``STATIC_ROOT`` under a
+content-hashed name, which ``{% static %}`` then links to, and stores gzip
+copies of the text assets next to them, plus brotli copies when the brotli
+package is installed.
+
+``StaticFilesMiddleware`` serves ``STATIC_ROOT`` from the application
+process, WSGI or ASGI, out of an index built at startup (so files collected
+later need a restart). Each response is the precompressed copy the client
+accepts, and hashed names are cached for a year without revalidation: a
+changed file gets a new name.
+"""
+import gzip
+import mimetypes
+import os
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .middleware import HybridMiddleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Assets worth compressing, and the smallest size worth it
+COMPRESSIBLE = (".css", ".js", ".mjs", ".json", ".map", ".svg", ".txt",
+                ".html", ".xml")
+MIN_COMPRESS_SIZE = 256
+
+# Precompressed copies: file suffix -> Content-Encoding, best first
+ENCODINGS = {".br": "br", ".gz": "gzip"}
+
+# Browser cache lifetimes, in seconds
+HASHED_MAX_AGE = 365 * 24 * 60 * 60
+UNHASHED_MAX_AGE = 60
+
+# Files up to this size are served from memory
+MEMORY_LIMIT = 512 * 1024
+
+
+def compress(data):
+    """The precompressed copies of ``data`` worth keeping, by suffix."""
+    copies = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies[".br"] = brotli.compress(data)
+
+    # Not worth a second representation unless it saves 5%
+    return {suffix: compressed for suffix, compressed in copies.items()
+            if len(compressed) < len(data) * 0.95}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes precompressed copies of text assets,
+    under both their original and their hashed names.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        names = set()
+        for name in paths:
+            if name.endswith(COMPRESSIBLE):
+                names.add(name)
+                names.add(self.stored_name(name))
+
+        for name in sorted(names):
+            with self.open(name) as file:
+                data = file.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+
+            for suffix, compressed in compress(data).items():
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+                yield name, name + suffix, True
+
+
+class StaticFile:
+    """One collected asset and its precompressed copies."""
+
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.immutable = immutable
+        self.last_modified = int(stat.st_mtime)
+        self.etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if content_type.startswith("text/") or \
+                content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+
+        # Encoding -> (path, size, bytes if held in memory), best first
+        self.representations = {}
+        for suffix, encoding in ENCODINGS.items():
+            if os.path.exists(path + suffix):
+                self.representations[encoding] = _representation(
+                    path + suffix)
+        self.representations["identity"] = _representation(path)
+
+    def response(self, request):
+        accepted = _accepted_encodings(
+            request.headers.get("Accept-Encoding", ""))
+        encoding = next(encoding for encoding in self.representations
+                        if encoding in accepted or "*" in accepted
+                        or encoding == "identity")
+        path, size, data = self.representations[encoding]
+
+        etag = f'"{self.etag}-{encoding}"'
+        response = get_conditional_response(
+            request, etag=etag, last_modified=self.last_modified)
+        if response is None:
+            if request.method == "HEAD":
+                response = HttpResponse(content_type=self.content_type)
+            elif data is not None:
+                response = HttpResponse(data, content_type=self.content_type)
+            else:
+                response = FileResponse(open(path, "rb"),
+                                        content_type=self.content_type)
+            response["Content-Length"] = size
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        if len(self.representations) > 1:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        if self.immutable:
+            response["Cache-Control"] = \
+                f"public, max-age={HASHED_MAX_AGE}, immutable"
+        else:
+            response["Cache-Control"] = f"public, max-age={UNHASHED_MAX_AGE}"
+        return response
+
+
+def _representation(path):
+    size = os.path.getsize(path)
+    data = None
+    if size <= MEMORY_LIMIT:
+        with open(path, "rb") as file:
+            data = file.read()
+    return path, size, data
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for item in header.split(","):
+        coding, _, parameter = item.partition(";")
+        parameter = parameter.strip()
+        if parameter.startswith("q="):
+            try:
+                if float(parameter[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def collected_files(root, hashed_names):
+    """Index of the assets under ``root``, by name relative to it."""
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            base, suffix = os.path.splitext(path)
+            # Precompressed copies are served in place of their original
+            if suffix in ENCODINGS and os.path.exists(base):
+                continue
+            files[name] = StaticFile(path, name in hashed_names)
+    return files
+
+
+class StaticFilesMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        prefix = urlsplit(settings.STATIC_URL or "").path
+        if not settings.STATIC_PIPELINE or not prefix.startswith("/"):
+            raise MiddlewareNotUsed()
+
+        super().__init__(get_response)
+
+        self.prefix = prefix
+        hashed_names = set(getattr(staticfiles_storage, "hashed_files",
+                                   {}).values())
+        self.files = collected_files(settings.STATIC_ROOT, hashed_names)
+
+    def handle(self, request):
+        response = self._serve(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self._serve(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    def _serve(self, request):
+        if request.method not in ("GET", "HEAD") \
+                or not request.path_info.startswith(self.prefix):
+            return None
+
+        static_file = self.files.get(request.path_info[len(self.prefix):])
+        if static_file is None:
+            return None
+        return static_file.response(request)
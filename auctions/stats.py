@@ -0,0 +1,239 @@
+"""
+Leaderboards and activity statistics.
+
+``UserStats``, ``CategoryStats`` and ``DailyStats`` hold running totals
+that the bid, create and close code paths move forward as they go:
+``record_bid()``, ``record_listings()`` and ``record_closings()`` each add
+their deltas with one ``UPDATE ... SET n = n + delta`` per affected row,
+so no request ever aggregates over ``Offer`` or ``Listing``. The dashboard
+reads the top rows of an index and nothing else.
+
+``rebuild()`` (the ``rebuild_stats`` command) recomputes every table from
+the listings and bid history, e.g. to repair drift; migration 0014 fills
+them the same way when it creates them.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (CategoryStats, DailyStats, Listing, Offer, User,
+                     UserStats)
+
+
+# Rows per leaderboard, and days of activity shown
+LEADERBOARD_SIZE = 10
+RECENT_DAYS = 30
+
+# Users recomputed per transaction by rebuild()
+REBUILD_BATCH = 2000
+
+
+def _add(model, key, deltas, using="default"):
+    """Add ``deltas`` to the ``model`` row keyed by ``key``, creating it."""
+    if not any(deltas.values()):
+        return
+    manager = model.objects.db_manager(using)
+    increments = {name: F(name) + delta for name, delta in deltas.items()}
+
+    # Two passes: the second one runs if another request created the row
+    # between our UPDATE and our INSERT
+    for _ in range(2):
+        if manager.filter(**key).update(**increments):
+            return
+        try:
+            with transaction.atomic(using=using):
+                manager.create(**key, **deltas)
+            return
+        except IntegrityError:
+            continue
+
+
+def _day(moment):
+    # The calendar day TruncDate() gives for the same timestamp
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date()
+
+
+# Count an accepted offer (from place_bid, inside its transaction):
+def record_bid(offer, category_id):
+    _add(UserStats, {"user_id": offer.bidder_id},
+         {"bids_placed": 1, "amount_bid": offer.amount})
+    _add(CategoryStats, {"category_id": category_id}, {"bids_placed": 1})
+    _add(DailyStats, {"day": _day(offer.date_placed)},
+         {"bids_placed": 1, "amount_bid": offer.amount})
+
+
+# Count newly created listings, one or a bulk import's worth:
+def record_listings(listings):
+    for field, model, key in (
+            ("seller_id", UserStats, "user_id"),
+            ("category_id", CategoryStats, "category_id"),
+            ("date_created", DailyStats, "day")):
+        counts = Counter(getattr(listing, field) for listing in listings)
+        for value, count in counts.items():
+            _add(model, {key: value}, {"listings_created": count})
+
+
+# Count auctions closed with a winner, or (sign=-1) reopened after that:
+def record_closings(sales, sign=1, using="default"):
+    """``sales`` are (seller id, winner id, category id, price) tuples."""
+    sellers = defaultdict(Counter)
+    winners = Counter()
+    categories = defaultdict(Counter)
+
+    for seller_id, winner_id, category_id, price in sales:
+        sellers[seller_id].update(listings_sold=sign, sales_total=sign * price)
+        winners[winner_id] += sign
+        categories[category_id].update(listings_sold=sign,
+                                       sales_total=sign * price)
+
+    for seller_id, deltas in sellers.items():
+        _add(UserStats, {"user_id": seller_id}, deltas, using)
+    for winner_id, count in winners.items():
+        _add(UserStats, {"user_id": winner_id}, {"auctions_won": count},
+             using)
+    for category_id, deltas in categories.items():
+        _add(CategoryStats, {"category_id": category_id}, deltas, using)
+
+
+# Dashboard reads; each walks one index from the top:
+def top_bidders(limit=LEADERBOARD_SIZE):
+    return UserStats.objects.filter(bids_placed__gt=0) \
+        .select_related("user").order_by("-bids_placed", "user")[:limit]
+
+
+def top_sellers(limit=LEADERBOARD_SIZE):
+    return UserStats.objects.filter(sales_total__gt=0) \
+        .select_related("user").order_by("-sales_total", "user")[:limit]
+
+
+def top_categories(limit=LEADERBOARD_SIZE):
+    return CategoryStats.objects.filter(sales_total__gt=0) \
+        .select_related("category") \
+        .order_by("-sales_total", "category")[:limit]
+
+
+def recent_days(days=RECENT_DAYS):
+    since = datetime.date.today() - datetime.timedelta(days=days - 1)
+    return DailyStats.objects.filter(day__gte=since).order_by("-day")
+
+
+def rebuild(batch_size=REBUILD_BATCH, log=None):
+    """
+    Recompute every statistics table from scratch: users a batch at a
+    time, categories and days (a row per category or day, so few) in one
+    transaction each.
+    """
+    log = log or (lambda message: None)
+
+    last_id = 0
+    users = 0
+    while True:
+        batch = list(User.objects.filter(pk__gt=last_id).order_by("pk")
+                     .values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            break
+        users += _rebuild_users(batch[0], batch[-1])
+        last_id = batch[-1]
+        log(f"users up to #{last_id}")
+
+    categories = _rebuild_categories()
+    days = _rebuild_days()
+    return users, categories, days
+
+
+def _sold():
+    return Listing.objects.filter(active=False, winner__isnull=False) \
+        .order_by()
+
+
+def _rebuild_users(first_id, last_id):
+    # Related fields don't support __range
+    def span(field):
+        return {f"{field}__gte": first_id, f"{field}__lte": last_id}
+
+    with transaction.atomic():
+        # Deleting first takes the write lock (SQLite) or the rows' locks,
+        # so bids can't land between our reads and our writes
+        UserStats.objects.filter(**span("pk")).delete()
+
+        rows = defaultdict(dict)
+        for user_id, count, total in Offer.objects \
+                .filter(**span("bidder_id")).order_by().values("bidder") \
+                .annotate(count=Count("*"), total=Sum("amount")) \
+                .values_list("bidder", "count", "total"):
+            rows[user_id].update(bids_placed=count, amount_bid=total)
+
+        for user_id, count in Listing.objects \
+                .filter(**span("seller_id")).order_by().values("seller") \
+                .annotate(count=Count("*")).values_list("seller", "count"):
+            rows[user_id]["listings_created"] = count
+
+        for user_id, count, total in _sold() \
+                .filter(**span("seller_id")).values("seller") \
+                .annotate(count=Count("*"), total=Sum("bid_listing__offer")) \
+                .values_list("seller", "count", "total"):
+            rows[user_id].update(listings_sold=count, sales_total=total)
+
+        for user_id, count in _sold() \
+                .filter(**span("winner_id")).values("winner") \
+                .annotate(count=Count("*")).values_list("winner", "count"):
+            rows[user_id]["auctions_won"] = count
+
+        UserStats.objects.bulk_create([
+            UserStats(user_id=user_id, **totals)
+            for user_id, totals in rows.items()])
+    return len(rows)
+
+
+def _rebuild_categories():
+    with transaction.atomic():
+        CategoryStats.objects.all().delete()
+
+        rows = defaultdict(dict)
+        for category_id, count in Offer.objects.order_by() \
+                .values("listing__category") \
+                .annotate(count=Count("*")) \
+                .values_list("listing__category", "count"):
+            rows[category_id]["bids_placed"] = count
+
+        for category_id, count in Listing.objects.order_by() \
+                .values("category").annotate(count=Count("*")) \
+                .values_list("category", "count"):
+            rows[category_id]["listings_created"] = count
+
+        for category_id, count, total in _sold().values("category") \
+                .annotate(count=Count("*"), total=Sum("bid_listing__offer")) \
+                .values_list("category", "count", "total"):
+            rows[category_id].update(listings_sold=count, sales_total=total)
+
+        CategoryStats.objects.bulk_create([
+            CategoryStats(category_id=category_id, **totals)
+            for category_id, totals in rows.items()])
+    return len(rows)
+
+
+def _rebuild_days():
+    with transaction.atomic():
+        DailyStats.objects.all().delete()
+
+        rows = defaultdict(dict)
+        for day, count, total in Offer.objects.order_by() \
+                .annotate(day=TruncDate("date_placed")).values("day") \
+                .annotate(count=Count("*"), total=Sum("amount")) \
+                .values_list("day", "count", "total"):
+            rows[day].update(bids_placed=count, amount_bid=total)
+
+        for day, count in Listing.objects.order_by().values("date_created") \
+                .annotate(count=Count("*")) \
+                .values_list("date_created", "count"):
+            rows[day]["listings_created"] = count
+
+        DailyStats.objects.bulk_create([
+            DailyStats(day=day, **totals) for day, totals in rows.items()])
+    return len(rows)
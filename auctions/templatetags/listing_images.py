@@ -0,0 +1,17 @@
+from django import template
+from django.urls import reverse
+
+register = template.Library()
+
+
+# A listing's stored image rendition, or its external URL until stored:
+@register.filter
+def image_url(listing, rendition):
+    if isinstance(listing, dict):
+        image, digest = listing["image"], listing.get("image_digest")
+    else:
+        image, digest = listing.image, listing.image_digest
+
+    if not digest:
+        return image
+    return reverse("image", args=[digest, rendition])
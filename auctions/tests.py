@@ -1,3 +1,2581 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import gzip
+import hashlib
+import http.server
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.base import BaseHandler
+from django.core import mail
+from django.core.management import call_command
+from django.db import (OperationalError, connection, connections, router,
+                       transaction)
+from django.db.models.signals import pre_save
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.templatetags.static import static
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import async_views, views
+from .benchmarks.data import generate
+from .benchmarks.stats import QueryCounter, percentile
+from .benchmarks.transports import ClientTransport
+from .benchmarks.workloads import WORKLOADS, compare, run_workload
+from .bidding import BidRejected, place_bid, place_proxy
+from .events import EventBroker, broker
+from .expiry import expire_batch, expire_due
+from .images import (RENDITIONS, HTTPFetcher, ImageError, LocalFileFetcher,
+                     process, public_address, schedule, store)
+from .images import Image as PillowImage
+from .models import (User, Category, Listing, Bid, Offer, Comment, Watchlist,
+                     ProxyBid, Notification, UserStats, CategoryStats,
+                     DailyStats)
+from .notifications import (BACKOFF_BASE, MAX_ATTEMPTS, EmailTransport,
+                            compose, dispatch_due, notify_closed)
+from .pagination import decode_cursor, encode_cursor
+from .profiling import ProfilingMiddleware, registry
+from .proxies import Proxy, resolve
+from .ratelimit import RateLimitMiddleware, TokenBucket, parse_rate
+from .related import RELATED_LISTINGS, related_listings
+from .routers import PIN_COOKIE, ReplicaMiddleware
+from .search import SearchBackend, get_backend
+from .staticfiles import StaticFilesMiddleware, brotli
+from .stats import top_bidders, top_categories, top_sellers
+from .views import listing_feed
+from .watchlists import watched_ids
+
+
+# Index feed:
+class IndexFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.bidder = User.objects.create_user("bidder", "b@example.com",
+                                              "password")
+        category = Category.objects.for_name("Books")
+        Listing.objects.bulk_create([
+            Listing(seller=cls.seller, title=f"Item {i}", category=category,
+                    description="Desc", starting_bid=10, active=i % 5 != 0)
+            for i in range(60)
+        ])
+
+    def test_pages_cover_every_active_listing_once(self):
+        seen = []
+        cursor = None
+
+        while True:
+            url = reverse("index")
+            if cursor:
+                url += f"?cursor={cursor}"
+            response = self.client.get(url)
+            seen.extend(item.pk for item in response.context["listings"])
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = Listing.objects.filter(active=True) \
+            .order_by("-date_created", "-id").values_list("pk", flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_current_bid_is_annotated(self):
+        listing = Listing.objects.filter(active=True).latest("id")
+        Bid.objects.create(listing=listing, seller=self.seller,
+                           starting_bid=10, offer=25, bidder=self.bidder,
+                           offer_count=3)
+
+        response = self.client.get(reverse("index"))
+        first = response.context["listings"][0]
+        self.assertEqual((first.top_offer, first.offer_count), (25, 3))
+
+    def test_bad_cursor_restarts_from_first_page(self):
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+        self.assertEqual(decode_cursor(encode_cursor(["2022-10-10", 4])),
+                         ["2022-10-10", "4"])
+        response = self.client.get(reverse("index") + "?cursor=%%%")
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursors_with_bad_values_restart_from_first_page(self):
+        listing = Listing.objects.filter(active=True).first()
+        first = self.client.get(reverse("index")).context["listings"]
+        urls = [reverse("index"), reverse("api_listings"),
+                reverse("listing_comments", args=[listing.pk])]
+
+        for values in (["abc", "1"], ["2024-13-45", "1"], ["", ""],
+                       ["2024-01-01", "99999999999999999999999"],
+                       [["nested"], 1], {"not": "a list"}):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(values).encode()).decode()
+            for url in urls:
+                with self.subTest(values=values, url=url):
+                    response = self.client.get(url, {"cursor": cursor})
+                    self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse("index"), {"cursor": cursor})
+            self.assertEqual(list(response.context["listings"]), list(first))
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite query plans")
+    def test_feeds_are_read_in_index_order(self):
+        books = Category.objects.get(name="Books")
+        feeds = {
+            "listing_active_feed_idx": listing_feed(),
+            "listing_category_feed_idx": listing_feed()
+            .filter(category=books),
+            "listing_expiry_idx": Listing.objects
+            .filter(active=True, ends_at__lte=timezone.now()),
+        }
+        orderings = {"listing_expiry_idx": ("ends_at",)}
+
+        for index, feed in feeds.items():
+            with self.subTest(index=index):
+                plan = feed.order_by(*orderings.get(
+                    index, ("-date_created", "-id")))[:25].explain()
+                self.assertIn(f"USING INDEX {index}", plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+
+# Bid placement:
+class PlaceBidTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.alice = User.objects.create_user("alice", "a@example.com",
+                                             "password")
+        cls.bob = User.objects.create_user("bob", "b@example.com",
+                                           "password")
+        cls.listing = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=10, category=Category.objects.for_name("Home"))
+
+    def test_offers_update_price_and_append_history(self):
+        place_bid(self.listing, self.alice, 10)
+        place_bid(self.listing, self.bob, 15)
+
+        bid = Bid.objects.get(listing=self.listing)
+        self.assertEqual((bid.offer, bid.bidder, bid.offer_count),
+                         (15, self.bob, 2))
+        self.assertEqual(
+            list(self.listing.offers.order_by("id")
+                 .values_list("bidder__username", "amount")),
+            [("alice", 10), ("bob", 15)])
+
+    def test_rejections(self):
+        with self.assertRaisesMessage(BidRejected, "too low"):
+            place_bid(self.listing, self.alice, 5)
+
+        place_bid(self.listing, self.alice, 20)
+        with self.assertRaisesMessage(BidRejected, "too low"):
+            place_bid(self.listing, self.bob, 20)
+
+        with self.assertRaisesMessage(BidRejected, "own listing"):
+            place_bid(self.listing, self.seller, 50)
+
+        Bid.objects.filter(listing=self.listing).update(is_open=False)
+        with self.assertRaisesMessage(BidRejected, "closed"):
+            place_bid(self.listing, self.bob, 50)
+
+        self.assertEqual(self.listing.offers.count(), 1)
+
+    def test_bids_on_a_listing_closed_since_it_was_read(self):
+        stale = Listing.objects.get(pk=self.listing.pk)
+        Listing.objects.filter(pk=self.listing.pk).update(active=False)
+        for place in (place_bid, place_proxy):
+            with self.assertRaisesMessage(BidRejected, "closed"):
+                place(stale, self.alice, 20)
+        self.assertFalse(Bid.objects.filter(listing=self.listing).exists())
+
+
+# Closing and reopening auctions:
+class BidStatusTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.alice = User.objects.create_user("alice", "a@example.com",
+                                             "password")
+        cls.bob = User.objects.create_user("bob", "b@example.com",
+                                           "password")
+        cls.home = Category.objects.for_name("Home")
+        cls.lamp = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=10, category=cls.home)
+        Category.objects.adjust_active_count(cls.home.pk, 1)
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def post(self, action):
+        return self.client.post(reverse("status"), {
+            "listing": self.lamp.pk, "status": action})
+
+    def test_closing_without_bids(self):
+        self.assertEqual(self.post("Close Auction").status_code, 302)
+        self.lamp.refresh_from_db()
+        self.home.refresh_from_db()
+        self.assertEqual((self.lamp.active, self.lamp.winner), (False, None))
+        self.assertEqual(self.home.active_count, 0)
+        self.assertFalse(UserStats.objects.filter(listings_sold__gt=0)
+                         .exists())
+
+        self.post("Open Auction")
+        self.lamp.refresh_from_db()
+        self.assertTrue(self.lamp.active)
+
+    def test_repeated_actions_count_once(self):
+        place_bid(self.lamp, self.alice, 20)
+        version = Listing.objects.get(pk=self.lamp.pk).version
+        self.post("Close Auction")
+        self.post("Close Auction")
+
+        self.home.refresh_from_db()
+        self.assertEqual(self.home.active_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.seller)
+                         .listings_sold, 1)
+        self.assertEqual(Listing.objects.get(pk=self.lamp.pk).version,
+                         version + 1)
+        self.assertEqual(Notification.objects.filter(kind="closed")
+                         .count(), 1)
+
+        self.post("Open Auction")
+        self.assertEqual(UserStats.objects.get(user=self.seller)
+                         .listings_sold, 0)
+        self.assertTrue(Bid.objects.get(listing=self.lamp).is_open)
+
+    def test_close_keeps_changes_made_since_the_listing_was_read(self):
+        place_bid(self.lamp, self.alice, 20)
+        stale = Listing.objects.get(pk=self.lamp.pk)
+        place_bid(self.lamp, self.bob, 30)
+        Listing.objects.filter(pk=self.lamp.pk).adjust_comment_count(1)
+
+        with transaction.atomic():
+            views._set_open(stale, False)
+
+        listing = Listing.objects.get(pk=self.lamp.pk)
+        bid = Bid.objects.get(listing=self.lamp)
+        self.assertEqual((listing.active, listing.winner), (False, self.bob))
+        self.assertEqual(listing.comment_count, 1)
+        self.assertEqual((bid.offer, bid.bidder, bid.offer_count, bid.is_open),
+                         (30, self.bob, 2, False))
+
+
+# Concurrent bidding:
+class ConcurrentBiddingTests(TransactionTestCase):
+    """
+    Fire bids from many threads at once against the configured database
+    (SQLite locally, PostgreSQL when DATABASES points at it) and check that
+    every accepted bid made it into the history and the price record.
+    """
+
+    THREADS = 8
+    BIDS_PER_THREAD = 250
+
+    def test_no_accepted_bid_is_lost(self):
+        seller = User.objects.create_user("seller", "s@example.com", "pw")
+        bidders = [User.objects.create_user(f"bidder{i}", "", "pw")
+                   for i in range(self.THREADS)]
+        listing = Listing.objects.create(
+            seller=seller, title="Lamp", description="Desc", starting_bid=1,
+            category=Category.objects.for_name("Home"))
+
+        accepted = []
+        lock = threading.Lock()
+
+        def bid_repeatedly(bidder, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.BIDS_PER_THREAD):
+                    offer = rng.randint(1, self.THREADS * self.BIDS_PER_THREAD)
+                    while True:
+                        try:
+                            place_bid(listing, bidder, offer)
+                        except BidRejected:
+                            break
+                        # Busy/locked database: retry like a client would
+                        except OperationalError:
+                            time.sleep(0.001)
+                            continue
+                        with lock:
+                            accepted.append(offer)
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid_repeatedly, args=(bidder, i))
+                   for i, bidder in enumerate(bidders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        bid = Bid.objects.get(listing=listing)
+        history = sorted(Offer.objects.filter(listing=listing)
+                         .values_list("amount", flat=True))
+
+        self.assertTrue(accepted)
+        self.assertEqual(history, sorted(accepted))
+        self.assertEqual(bid.offer_count, len(accepted))
+        self.assertEqual(bid.offer, max(accepted))
+        # Accepted offers must be strictly increasing in commit order
+        self.assertEqual(len(set(accepted)), len(accepted))
+
+
+# Reference for resolve(): raise the price one step at a time while two
+# competitors can still afford the next one
+def _clock(proxies, price, leader, starting_bid):
+    competitors = {proxy.bidder: (proxy.maximum, proxy.placed)
+                   for proxy in proxies if proxy.maximum >= starting_bid}
+    if leader is not None:
+        maximum = competitors.get(leader, (price,))[0]
+        competitors[leader] = (max(price, maximum), -1)
+
+    current = starting_bid if price is None else price
+    alive = {bidder: entry for bidder, entry in competitors.items()
+             if entry[0] >= current}
+    if not alive:
+        return None
+    while sum(maximum > current for maximum, _ in alive.values()) >= 2:
+        current += 1
+
+    # At most one can go higher; it does if anyone else is still in
+    able = [bidder for bidder, (maximum, _) in alive.items()
+            if maximum > current]
+    rivals = [bidder for bidder, (maximum, _) in alive.items()
+              if maximum == current]
+    if able and rivals:
+        return current + 1, able[0]
+    return current, min(alive, key=lambda bidder: (
+        -alive[bidder][0], alive[bidder][1]))
+
+
+# Proxy resolution engine:
+class ProxyResolutionTests(TestCase):
+
+    def cases(self, count, seed=0):
+        rng = random.Random(seed)
+        for _ in range(count):
+            bidders = rng.sample(range(1, 30), rng.randint(0, 8))
+            placed = rng.sample(range(100), len(bidders))
+            proxies = [Proxy(bidder, rng.randint(1, 120), order)
+                       for bidder, order in zip(bidders, placed)]
+            starting_bid = rng.randint(1, 40)
+            price = leader = None
+            if rng.random() < 0.5:
+                price = rng.randint(starting_bid, 100)
+                leader = rng.choice(bidders + [99])
+            yield proxies, price, leader, starting_bid
+
+    def test_matches_an_increment_by_increment_auction(self):
+        for proxies, price, leader, starting_bid in self.cases(2000):
+            with self.subTest(proxies=proxies, price=price, leader=leader,
+                              starting_bid=starting_bid):
+                resolution = resolve(proxies, price, leader, starting_bid)
+                expected = _clock(proxies, price, leader, starting_bid)
+                self.assertEqual(
+                    resolution and (resolution.price, resolution.leader),
+                    expected)
+                if resolution is not None:
+                    self.assertEqual(resolution.changed,
+                                     expected != (price, leader))
+
+    def test_arrival_order_does_not_matter(self):
+        # Settling each proxy as it arrives ends where settling them all
+        # at once does
+        for proxies, _, _, starting_bid in self.cases(500, seed=1):
+            arrivals = sorted(proxies, key=lambda proxy: proxy.placed)
+            random.Random(len(proxies)).shuffle(proxies)
+            price = leader = None
+            for count in range(1, len(arrivals) + 1):
+                resolution = resolve(arrivals[:count], price, leader,
+                                     starting_bid)
+                if resolution is not None:
+                    price, leader = resolution.price, resolution.leader
+
+            batch = resolve(proxies, None, None, starting_bid)
+            self.assertEqual(batch and (batch.price, batch.leader),
+                             leader and (price, leader))
+
+    def test_leader_pays_one_increment_over_the_runner_up(self):
+        proxies = [Proxy(1, 100, 0), Proxy(2, 40, 1), Proxy(3, 70, 2)]
+        resolution = resolve(proxies, 20, 2, starting_bid=10, increment=5)
+        self.assertEqual((resolution.price, resolution.leader), (75, 1))
+
+        # Capped at the leader's own maximum, which wins ties
+        resolution = resolve([Proxy(1, 100, 0), Proxy(2, 100, 1)], None,
+                             None, starting_bid=10, increment=5)
+        self.assertEqual((resolution.price, resolution.leader), (100, 1))
+        resolution = resolve([Proxy(2, 100, 1)], 100, 1, starting_bid=10)
+        self.assertFalse(resolution.changed)
+
+
+class ProxyBiddingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.alice = User.objects.create_user("alice", "a@example.com",
+                                             "password")
+        cls.bob = User.objects.create_user("bob", "b@example.com",
+                                           "password")
+        cls.listing = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=10, category=Category.objects.for_name("Home"))
+
+    def history(self):
+        return list(self.listing.offers.order_by("id")
+                    .values_list("bidder__username", "amount"))
+
+    def test_competing_proxies_settle_in_one_offer(self):
+        place_proxy(self.listing, self.alice, 100)
+        _, offer = place_proxy(self.listing, self.bob, 50)
+        self.assertEqual((offer.bidder, offer.amount), (self.alice, 51))
+
+        bid = Bid.objects.get(listing=self.listing)
+        self.assertEqual((bid.offer, bid.bidder, bid.offer_count),
+                         (51, self.alice, 2))
+        self.assertEqual(self.history(), [("alice", 10), ("alice", 51)])
+
+        # Raising your own maximum while leading changes nothing visible
+        self.assertEqual(place_proxy(self.listing, self.alice, 200)[1], None)
+        self.assertEqual(ProxyBid.objects.get(bidder=self.alice).maximum,
+                         200)
+
+    def test_manual_bids_are_answered(self):
+        place_proxy(self.listing, self.alice, 100)
+        offer = place_bid(self.listing, self.bob, 60)
+        self.assertEqual((offer.bidder, offer.amount), (self.alice, 61))
+        self.assertEqual(self.history(),
+                         [("alice", 10), ("bob", 60), ("alice", 61)])
+
+        # Outbidding the maximum takes the lead
+        offer = place_bid(self.listing, self.bob, 101)
+        self.assertEqual((offer.bidder, offer.amount), (self.bob, 101))
+
+    def test_equal_maximums_go_to_the_earlier(self):
+        place_proxy(self.listing, self.alice, 80)
+        place_proxy(self.listing, self.bob, 80)
+        bid = Bid.objects.get(listing=self.listing)
+        self.assertEqual((bid.offer, bid.bidder), (80, self.alice))
+
+    def test_rejections(self):
+        with self.assertRaisesMessage(BidRejected, "too low"):
+            place_proxy(self.listing, self.alice, 5)
+        with self.assertRaisesMessage(BidRejected, "own listing"):
+            place_proxy(self.listing, self.seller, 50)
+
+        place_bid(self.listing, self.alice, 30)
+        with self.assertRaisesMessage(BidRejected, "too low"):
+            place_proxy(self.listing, self.bob, 30)
+        self.assertFalse(ProxyBid.objects.exists())
+
+    def test_view(self):
+        self.client.force_login(self.bob)
+        page = self.client.get(reverse("listing", args=[self.listing.pk]))
+        self.assertContains(page, reverse("proxy_bid"))
+
+        response = self.client.post(reverse("proxy_bid"), {
+            "listing": self.listing.pk, "maximum": 40})
+        self.assertRedirects(response,
+                             reverse("listing", args=[self.listing.pk]))
+        self.assertEqual(self.history(), [("bob", 10)])
+
+
+# Detail page sidebar:
+class RelatedListingsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.books = Category.objects.for_name("Books")
+        fashion = Category.objects.for_name("Fashion")
+        Listing.objects.bulk_create([
+            Listing(seller=cls.seller, title=f"Item {i}", description="Desc",
+                    starting_bid=10,
+                    category=cls.books if i < 3 else fashion)
+            for i in range(20)
+        ])
+        Watchlist.objects.create(user=cls.seller)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_same_category_first_then_newest(self):
+        book = Listing.objects.filter(category=self.books).first()
+        related = related_listings(book)
+
+        self.assertEqual(len(related), RELATED_LISTINGS)
+        self.assertNotIn(book.pk, [item["id"] for item in related])
+        self.assertEqual([item["title"] for item in related[:2]],
+                         ["Item 2", "Item 1"])
+
+    def test_detail_page_is_bounded_and_sees_new_listings(self):
+        book = Listing.objects.filter(category=self.books).first()
+        self.client.get(reverse("listing", args=[book.pk]))
+
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create"), {
+            "title": "New book", "description": "Desc", "starting_bid": 5,
+            "image": "", "category": "Books"})
+
+        response = self.client.get(reverse("listing", args=[book.pk]))
+        titles = [item["title"] for item in response.context["related"]]
+        self.assertEqual(titles[0], "New book")
+        self.assertEqual(len(titles), RELATED_LISTINGS)
+
+    def test_closing_drops_cached_candidates_once_committed(self):
+        book, other = Listing.objects.filter(category=self.books)[:2]
+        Listing.objects.filter(pk=other.pk).update(
+            ends_at=timezone.now() - datetime.timedelta(minutes=1))
+        Category.objects.adjust_active_count(self.books.pk, 3)
+        key = f"related:category:{self.books.pk}"
+
+        for close in (lambda: views._set_open(book, False),
+                      lambda: expire_batch(timezone.now())):
+            related_listings(book)
+            with self.captureOnCommitCallbacks() as callbacks:
+                with transaction.atomic():
+                    close()
+                # Still there while the close may be uncommitted
+                self.assertIsNotNone(cache.get(key))
+            for callback in callbacks:
+                callback()
+            self.assertIsNone(cache.get(key))
+
+
+# Query budgets:
+class QueryBudgetTests(TestCase):
+    """
+    Every view must load its data in a fixed number of queries. Each check
+    measures a request at several fixture sizes; the counts must be equal
+    and within the view's budget, so an N+1 regression fails here.
+    """
+
+    SIZES = (10, 10_000)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.viewer = User.objects.create_user("viewer", "v@example.com",
+                                              "password")
+        Watchlist.objects.create(user=cls.seller)
+        Watchlist.objects.create(user=cls.viewer)
+        cls.books = Category.objects.for_name("Books")
+        cls.focus = Listing.objects.create(seller=cls.seller, title="Focus",
+                                           description="Desc",
+                                           starting_bid=1, category=cls.books)
+
+    def setUp(self):
+        cache.clear()
+        self.size = 0
+        self.client.force_login(self.viewer)
+
+    def grow(self, size):
+        # Bring listings, bids, comments and watchlist entries up to `size`
+        new = Listing.objects.bulk_create([
+            Listing(seller=self.seller, title=f"Item {i}", description="Desc",
+                    starting_bid=1, category=self.books)
+            for i in range(self.size, size)
+        ])
+
+        Bid.objects.bulk_create([
+            Bid(listing=item, seller=self.seller, starting_bid=1, offer=2,
+                bidder=self.viewer, offer_count=1)
+            for item in new
+        ])
+        Comment.objects.bulk_create([
+            Comment(item=self.focus, content="Hello", author=self.seller)
+            for _ in range(self.size, size)
+        ])
+        self.viewer.watchlist_owned.get().listings.add(*new)
+        self.size = size
+
+    def requests(self):
+        # view -> (query budget, request)
+        anonymous = Client()
+        listing_url = reverse("listing", args=[self.focus.pk])
+        offers = iter(range(100, 1000))
+        maximums = iter(range(10_000, 20_000))
+
+        return {
+            "index": (2, lambda: self.client.get(reverse("index"))),
+            "listing": (4, lambda: self.client.get(listing_url)),
+            "listing (anonymous)": (2, lambda: anonymous.get(listing_url)),
+            "categories": (2, lambda: self.client.get(reverse("categories"))),
+            "category": (3, lambda: self.client.get(
+                reverse("a_category", args=["books"]))),
+            "watchlist": (2, lambda: self.client.get(reverse("watchlist"))),
+            "stats": (5, lambda: self.client.get(reverse("stats"))),
+            # One read of the proxies able to answer the bid, one INSERT
+            # queueing the outbid notices, one read of the committed price
+            # for the live event
+            "bid": (13, lambda: self.client.post(reverse("bid"), {
+                "listing": self.focus.pk, "offer": next(offers)})),
+            "proxy bid": (8, lambda: self.client.post(reverse("proxy_bid"), {
+                "listing": self.focus.pk, "maximum": next(maximums)})),
+        }
+
+    def test_query_counts_do_not_grow_with_data(self):
+        requests = self.requests()
+        counts = {name: [] for name in requests}
+
+        for size in self.SIZES:
+            self.grow(size)
+            for name, (_, request) in requests.items():
+                # Warm caches first; budgets are for steady-state requests
+                request()
+                with CaptureQueriesContext(connection) as queries:
+                    response = request()
+                self.assertLess(response.status_code, 400, name)
+                counts[name].append(len(queries))
+
+        for name, (budget, _) in requests.items():
+            with self.subTest(view=name):
+                self.assertEqual(len(set(counts[name])), 1,
+                                 f"query count grows with data: "
+                                 f"{counts[name]}")
+                self.assertLessEqual(counts[name][0], budget)
+
+
+# Authenticated requests:
+class AuthenticatedRequestTests(TestCase):
+    """
+    Signed-in requests shouldn't look their user up again: the cached
+    backend serves request.user, views use it as is, and with cached_db
+    sessions the session isn't read from the database either.
+    """
+
+    MODEL_BACKEND = "django.contrib.auth.backends.ModelBackend"
+    CACHED_DB = "django.contrib.sessions.backends.cached_db"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.bidder = User.objects.create_user("bidder", "b@example.com",
+                                              "password")
+        Watchlist.objects.create(user=cls.bidder)
+        cls.item = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=1, category=Category.objects.for_name("Lighting"))
+        Category.objects.adjust_active_count(cls.item.category_id, 1)
+
+    def setUp(self):
+        cache.clear()
+
+    def requests(self):
+        # name -> (user, request)
+        item = self.item.pk
+        offers = itertools.count(10)
+        comments = itertools.count()
+        actions = itertools.cycle(["Close Auction", "Open Auction"])
+
+        def delete_comment(client):
+            comment = Comment.objects.create(item_id=item, content="Hi",
+                                             author=self.bidder)
+            Listing.objects.filter(pk=item).adjust_comment_count(1)
+            return client.post(reverse("listing", args=[item]), {
+                "delete-comment": "", "comment-pk": comment.pk})
+
+        return {
+            "index": (self.bidder, lambda client: client.get(
+                reverse("index"))),
+            "listing": (self.bidder, lambda client: client.get(
+                reverse("listing", args=[item]))),
+            "delete comment": (self.bidder, delete_comment),
+            "create": (self.seller, lambda client: client.get(
+                reverse("create"))),
+            "bid": (self.bidder, lambda client: client.post(
+                reverse("bid"), {"listing": item, "offer": next(offers)})),
+            "proxy bid": (self.bidder, lambda client: client.post(
+                reverse("proxy_bid"),
+                {"listing": item, "maximum": next(offers) + 1000})),
+            "watchlist": (self.bidder, lambda client: client.get(
+                reverse("watchlist"))),
+            "watch": (self.bidder, lambda client: client.post(
+                reverse("watchlist"), {"item_id": item, "state": "Add"})),
+            "comment": (self.bidder, lambda client: client.post(
+                reverse("comments"),
+                {"listing": item, "content": f"Hi {next(comments)}"})),
+            "status": (self.seller, lambda client: client.post(
+                reverse("status"),
+                {"listing": item, "status": next(actions)})),
+        }
+
+    def lookups(self, user, request):
+        client = Client()
+        client.force_login(user)
+        # Warm the caches first
+        request(client)
+        with CaptureQueriesContext(connection) as queries:
+            response = request(client)
+        self.assertLess(response.status_code, 400)
+
+        sql = [query["sql"] for query in queries]
+        return (sum('FROM "auctions_user" WHERE' in line for line in sql),
+                sum('FROM "django_session" WHERE' in line for line in sql))
+
+    def test_signed_in_requests_skip_user_and_session_reads(self):
+        for name, (user, request) in self.requests().items():
+            with self.subTest(view=name):
+                with self.settings(AUTHENTICATION_BACKENDS=[
+                        self.MODEL_BACKEND]):
+                    users, sessions = self.lookups(user, request)
+                self.assertEqual((users, sessions), (1, 1))
+
+                users, sessions = self.lookups(user, request)
+                self.assertEqual((users, sessions), (0, 1))
+
+                with self.settings(SESSION_ENGINE=self.CACHED_DB):
+                    users, sessions = self.lookups(user, request)
+                self.assertEqual((users, sessions), (0, 0))
+
+    def test_cached_users_are_forgotten_on_change_and_logout(self):
+        client = Client()
+        client.force_login(self.bidder)
+        client.get(reverse("watchlist"))
+
+        # A password change ends the user's other sessions at once
+        self.bidder.set_password("changed")
+        self.bidder.save()
+        response = client.get(reverse("watchlist"))
+        self.assertRedirects(response, reverse("login") + "?next="
+                             + reverse("watchlist"))
+
+        client.force_login(self.bidder)
+        client.get(reverse("watchlist"))
+        client.get(reverse("logout"))
+        with CaptureQueriesContext(connection) as queries:
+            client.force_login(self.bidder)
+            client.get(reverse("watchlist"))
+        self.assertTrue(any('FROM "auctions_user" WHERE' in query["sql"]
+                            for query in queries))
+
+
+# Categories:
+class CategoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        Watchlist.objects.create(user=cls.seller)
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def create(self, title, category):
+        self.client.post(reverse("create"), {
+            "title": title, "description": "Desc", "starting_bid": 5,
+            "image": "", "category": category})
+        return Listing.objects.get(title=title)
+
+    def test_names_are_normalized_and_slugs_unique(self):
+        self.assertEqual(Category.objects.for_name("  ").name, "Unspecified")
+        first = Category.objects.for_name("Home & Garden")
+        second = Category.objects.for_name("Home Garden")
+        self.assertEqual((first.slug, second.slug),
+                         ("home-garden", "home-garden-2"))
+        self.assertEqual(Category.objects.for_name("Home & Garden"), first)
+
+    def race(self, **taken):
+        # Another request creates a category once for_name() has found a
+        # slug free, before it inserts its own
+        pending = [taken]
+
+        def create_first(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if pending and '"slug" = ' in sql:
+                Category.objects.bulk_create(
+                    [Category(**{"slug": params[-1], **pending.pop()})])
+            return result
+
+        return connection.execute_wrapper(create_first)
+
+    def test_losing_a_race_for_the_slug_or_name(self):
+        with self.race(name="Home-Garden"), transaction.atomic():
+            category = Category.objects.for_name("Home & Garden")
+        self.assertEqual((category.name, category.slug),
+                         ("Home & Garden", "home-garden-2"))
+
+        with self.race(name="Garden", slug="elsewhere"):
+            category = Category.objects.for_name("Garden")
+        self.assertEqual(category.slug, "elsewhere")
+        self.assertEqual(Category.objects.filter(name="Garden").count(), 1)
+
+    def test_failed_create_leaves_nothing_behind(self):
+        def fail(sender, instance, **kwargs):
+            raise OperationalError("disk I/O error")
+
+        pre_save.connect(fail, sender=DailyStats)
+        self.addCleanup(pre_save.disconnect, fail, sender=DailyStats)
+        with self.assertRaises(OperationalError):
+            self.create("Trunk", "Attic")
+        self.assertFalse(Listing.objects.exists())
+        self.assertFalse(Category.objects.filter(name="Attic").exists())
+        self.assertFalse(UserStats.objects.exists())
+
+    def test_active_counts_follow_create_close_and_reopen(self):
+        lamp = self.create("Lamp", "Home")
+        self.create("Chair", "Home")
+        home = Category.objects.get(name="Home")
+        self.assertEqual(home.active_count, 2)
+
+        buyer = User.objects.create_user("buyer", "", "password")
+        place_bid(lamp, buyer, 10)
+        for action, expected in [("Close Auction", 1), ("Close Auction", 1),
+                                 ("Open Auction", 2)]:
+            self.client.post(reverse("status"),
+                             {"listing": lamp.pk, "status": action})
+            home.refresh_from_db()
+            self.assertEqual(home.active_count, expected)
+
+        response = self.client.get(reverse("categories"))
+        self.assertContains(response, "Home</a> (2)")
+
+        response = self.client.get(reverse("a_category", args=["home"]))
+        self.assertEqual(len(response.context["group"]), 2)
+
+    def test_admin_edits_leave_active_counts_alone(self):
+        lamp = self.create("Lamp", "Home")
+        garden = Category.objects.for_name("Garden")
+        self.seller.is_staff = self.seller.is_superuser = True
+        self.seller.save()
+
+        response = self.client.post(
+            reverse("admin:auctions_listing_change", args=[lamp.pk]), {
+                "seller": self.seller.pk, "title": "Desk lamp",
+                "description": "Desc", "starting_bid": 5, "image": "",
+                "category": garden.pk, "active": ""})
+        self.assertEqual(response.status_code, 302)
+
+        lamp.refresh_from_db()
+        self.assertEqual((lamp.title, lamp.category.name, lamp.active),
+                         ("Desk lamp", "Home", True))
+        self.assertEqual(
+            dict(Category.objects.values_list("name", "active_count")),
+            {"Home": 1, "Garden": 0})
+
+
+# Rendered fragment cache:
+class FragmentCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        Watchlist.objects.create(user=cls.buyer)
+        cls.lamp = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=5, category=Category.objects.for_name("Lighting"))
+        Category.objects.adjust_active_count(cls.lamp.category_id, 1)
+
+    def setUp(self):
+        caches["template_fragments"].clear()
+
+    def test_cards_are_shared_and_follow_bids_and_closing(self):
+        anonymous = Client()
+        anonymous.get(reverse("index"))
+        fragments = len(caches["template_fragments"]._cache)
+
+        self.client.force_login(self.buyer)
+        self.client.get(reverse("index"))
+        self.client.get(reverse("a_category", args=["lighting"]))
+        self.assertEqual(len(caches["template_fragments"]._cache), fragments)
+
+        self.client.post(reverse("bid"), {"listing": self.lamp.pk,
+                                          "offer": 12})
+        self.assertContains(anonymous.get(reverse("index")),
+                            "Current bid: $12 (1 bid(s))")
+
+        self.client.force_login(self.seller)
+        self.client.post(reverse("status"), {"listing": self.lamp.pk,
+                                             "status": "Close Auction"})
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.version, 3)
+
+    def test_detail_page_keeps_per_user_parts_fresh(self):
+        Comment.objects.create(item=self.lamp, content="Nice",
+                               author=self.buyer)
+        url = reverse("listing", args=[self.lamp.pk])
+        self.assertNotContains(Client().get(url), "delete-comment")
+
+        self.client.force_login(self.buyer)
+        response = self.client.get(url)
+        self.assertContains(response, "buyer: Nice")
+        self.assertContains(response, "delete-comment")
+        self.assertContains(response, "Add to watchlist")
+
+        self.client.force_login(self.seller)
+        response = self.client.get(url)
+        self.assertContains(response, "Starting Bid: $5")
+        self.assertNotContains(response, "delete-comment")
+        self.assertContains(response, "There are no bids yet.")
+
+    def test_edits_through_save_replace_cached_fragments(self):
+        comment = Comment.objects.create(item=self.lamp, content="Nice",
+                                         author=self.buyer)
+        url = reverse("listing", args=[self.lamp.pk])
+        api_url = reverse("api_listing", args=[self.lamp.pk])
+        self.client.get(reverse("index"))
+        self.client.get(url)
+        etag = self.client.get(api_url)["ETag"]
+
+        # As the admin saves them
+        lamp = Listing.objects.get(pk=self.lamp.pk)
+        lamp.title = "Desk lamp"
+        lamp.save()
+        self.assertEqual(lamp.version, self.lamp.version + 1)
+        comment.content = "Very nice"
+        comment.save()
+
+        self.assertContains(self.client.get(reverse("index")), "Desk lamp")
+        response = self.client.get(url)
+        self.assertContains(response, "<h1>Desk lamp</h1>")
+        self.assertContains(response, "buyer: Very nice")
+        self.assertEqual(
+            self.client.get(api_url, HTTP_IF_NONE_MATCH=etag).status_code,
+            200)
+
+
+# Comment threads:
+class CommentThreadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        Watchlist.objects.create(user=cls.buyer)
+        cls.lamp = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=5, category=Category.objects.for_name("Lighting"))
+        Comment.objects.bulk_create([
+            Comment(item=cls.lamp, content=f"Comment {i}",
+                    author=cls.buyer if i % 2 else cls.seller)
+            for i in range(45)
+        ])
+
+    def setUp(self):
+        caches["template_fragments"].clear()
+
+    def test_pages_walk_every_comment_newest_first(self):
+        response = self.client.get(reverse("listing", args=[self.lamp.pk]))
+        seen = [comment.pk for comment in response.context["comments"]]
+        cursor = response.context["comments_cursor"]
+        self.assertEqual(len(seen), 20)
+
+        url = reverse("listing_comments", args=[self.lamp.pk])
+        while cursor:
+            page = self.client.get(url, {"cursor": cursor}).json()
+            seen.extend(comment["id"] for comment in page["comments"])
+            cursor = page["next_cursor"]
+
+        expected = Comment.objects.filter(item=self.lamp) \
+            .order_by("-date_published", "-id").values_list("pk", flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_deletable_flag_follows_the_viewer(self):
+        url = reverse("listing_comments", args=[self.lamp.pk])
+        self.assertFalse(any(comment["deletable"]
+                             for comment in self.client.get(url).json()
+                             ["comments"]))
+
+        self.client.force_login(self.buyer)
+        for comment in self.client.get(url).json()["comments"]:
+            self.assertEqual(comment["deletable"],
+                             comment["author"] == "buyer")
+
+    def test_count_follows_new_and_deleted_comments(self):
+        Listing.objects.filter(pk=self.lamp.pk).update(comment_count=45)
+        self.client.force_login(self.buyer)
+        self.client.post(reverse("comments"), {"listing": self.lamp.pk,
+                                               "content": "Still for sale?"})
+        mine = Comment.objects.filter(author=self.buyer).first()
+        for _ in range(2):
+            self.client.post(reverse("listing", args=[self.lamp.pk]), {
+                "comment-pk": mine.pk, "delete-comment": "Delete"})
+
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.comment_count, 45)
+        response = self.client.get(reverse("listing", args=[self.lamp.pk]))
+        self.assertContains(response, "Comments (45)")
+
+
+# The JSON API:
+class ApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        Watchlist.objects.create(user=cls.buyer)
+        lighting = Category.objects.for_name("Lighting")
+        cls.lamps = [Listing.objects.create(
+            seller=cls.seller, title=f"Lamp {i}", description="Desc",
+            starting_bid=5, category=lighting) for i in range(7)]
+        Category.objects.adjust_active_count(lighting.pk, 7)
+
+    def test_sparse_fields_and_pages(self):
+        url = reverse("api_listings")
+        page = self.client.get(url, {"fields": "id,title,current_bid",
+                                     "limit": 3}).json()
+        self.assertEqual(page["results"][0], {
+            "id": self.lamps[-1].pk, "title": "Lamp 6", "current_bid": None})
+
+        seen = []
+        while True:
+            seen.extend(row["id"] for row in page["results"])
+            if not page["next_cursor"]:
+                break
+            page = self.client.get(url, {"fields": "id", "limit": 3,
+                                         "cursor": page["next_cursor"]}) \
+                .json()
+        self.assertEqual(seen, [lamp.pk for lamp in reversed(self.lamps)])
+
+        response = self.client.get(url, {"fields": "title,password"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error":
+                                           "Unknown fields: password."})
+
+    def test_collection_revalidates_on_its_etag_alone(self):
+        url = reverse("api_listings")
+        response = self.client.get(url, {"limit": 3})
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, {"limit": 3},
+                                         HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 304)
+
+        # An older listing takes the closed one's place on the page
+        Listing.objects.filter(pk=self.lamps[-1].pk).bump_version(
+            active=False)
+        response = self.client.get(
+            url, {"limit": 3}, HTTP_IF_NONE_MATCH=etag,
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][-1]["id"],
+                         self.lamps[-4].pk)
+
+    def test_detail_revalidates_until_the_listing_changes(self):
+        url = reverse("api_listing", args=[self.lamps[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()["category"], "lighting")
+        self.assertEqual(response.json()["bid_count"], 0)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.buyer)
+        self.client.post(reverse("bid"), {"listing": self.lamps[0].pk,
+                                          "offer": 12})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["current_bid"], 12)
+
+        self.assertEqual(self.client.get(
+            reverse("api_listing", args=[0])).status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+    def test_categories(self):
+        response = self.client.get(reverse("api_categories"))
+        self.assertEqual(response.json(), {"results": [
+            {"name": "Lighting", "slug": "lighting", "active_count": 7}]})
+        self.assertEqual(self.client.get(
+            reverse("api_categories"),
+            HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+
+# Bulk import and export:
+class TransferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.other = User.objects.create_user("other", "o@example.com",
+                                             "password")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def rows(self, count):
+        return [json.dumps({"title": f"Lamp {i}", "description": "Brass",
+                            "starting_bid": 5 + i, "category": "Lighting"})
+                for i in range(count)]
+
+    def test_valid_rows_are_imported_and_bad_ones_reported(self):
+        past = (timezone.now() - datetime.timedelta(days=1)).isoformat()
+        path = self.write("listings.ndjson", self.rows(3) + [
+            json.dumps({"title": "Chair", "description": "Oak",
+                        "starting_bid": 1, "seller": "other"}),
+            json.dumps({"description": "No title", "starting_bid": 1}),
+            "{not json",
+            json.dumps({"title": "Late", "description": "x",
+                        "starting_bid": 1, "ends_at": past}),
+            json.dumps({"title": "Ghost", "description": "x",
+                        "starting_bid": 1, "seller": "nobody"}),
+        ])
+        errors = io.StringIO()
+        call_command("import_listings", path, seller="seller",
+                     batch_size=2, chunk_size=3, stdout=io.StringIO(),
+                     stderr=errors)
+
+        self.assertEqual(Listing.objects.count(), 4)
+        self.assertEqual(Listing.objects.get(title="Chair").seller,
+                         self.other)
+        self.assertEqual(Category.objects.get(name="Lighting").active_count,
+                         3)
+        self.assertEqual(Category.objects.get(name="Unspecified")
+                         .active_count, 1)
+        results, _ = get_backend().search("brass")
+        self.assertEqual(len(results), 3)
+
+        reported = errors.getvalue().splitlines()
+        self.assertEqual([line.split(":")[1] for line in reported],
+                         ["5", "6", "7", "8"])
+        self.assertIn("title: This field is required.", reported[0])
+        self.assertIn("unknown user 'nobody'", reported[3])
+
+    def test_checkpoint_resumes_after_committed_rows(self):
+        path = self.write("listings.ndjson", self.rows(5))
+        checkpoint = os.path.join(self.directory, "progress.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"path": path, "consumed": 3}, f)
+
+        call_command("import_listings", path, seller="seller",
+                     chunk_size=1, checkpoint=checkpoint,
+                     stdout=io.StringIO())
+
+        self.assertEqual(sorted(Listing.objects.values_list("title",
+                                                            flat=True)),
+                         ["Lamp 3", "Lamp 4"])
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)["consumed"], 5)
+
+    def test_export_round_trips_through_import(self):
+        source = self.write("listings.ndjson", self.rows(3))
+        call_command("import_listings", source, seller="seller",
+                     stdout=io.StringIO())
+        exported = os.path.join(self.directory, "export.csv")
+        call_command("export_listings", exported, chunk_size=2,
+                     stdout=io.StringIO())
+
+        Listing.objects.all().delete()
+        call_command("import_listings", exported, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Listing.objects.values_list("title", "seller__username")),
+            [(f"Lamp {i}", "seller") for i in range(3)])
+
+    def test_closed_listings_round_trip_closed(self):
+        past = timezone.now() - datetime.timedelta(days=1)
+        source = self.write("listings.ndjson", self.rows(2))
+        call_command("import_listings", source, seller="seller",
+                     stdout=io.StringIO())
+        Listing.objects.filter(title="Lamp 0").update(active=False,
+                                                      ends_at=past)
+        exported = os.path.join(self.directory, "export.csv")
+        call_command("export_listings", exported, stdout=io.StringIO())
+
+        Listing.objects.all().delete()
+        Category.objects.update(active_count=0)
+        call_command("import_listings", exported, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Listing.objects.values_list("title", "active", "ends_at")),
+            [("Lamp 0", False, past), ("Lamp 1", True, None)])
+        self.assertEqual(Category.objects.get(name="Lighting").active_count,
+                         1)
+
+        # Open auctions must still end in the future
+        path = self.write("bad.ndjson", [
+            json.dumps({"title": "Late", "description": "x",
+                        "starting_bid": 1, "ends_at": past.isoformat(),
+                        "active": True}),
+            json.dumps({"title": "Odd", "description": "x",
+                        "starting_bid": 1, "active": "sometimes"}),
+        ])
+        errors = io.StringIO()
+        call_command("import_listings", path, seller="seller",
+                     stdout=io.StringIO(), stderr=errors)
+        reported = errors.getvalue().splitlines()
+        self.assertIn("ends_at: The end time must be in the future.",
+                      reported[0])
+        self.assertIn("active: Expected true or false.", reported[1])
+        self.assertEqual(Listing.objects.count(), 2)
+
+    def test_http_export_streams_for_staff_only(self):
+        Listing.objects.create(seller=self.seller, title="Lamp",
+                               description="Desc", starting_bid=5,
+                               category=Category.objects.for_name("Home"))
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.get(reverse("export")).status_code, 302)
+
+        # Through save(), which also drops the cached copy of the user
+        self.seller.is_staff = True
+        self.seller.save(update_fields=["is_staff"])
+        response = self.client.get(reverse("export"), {"format": "ndjson"})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in
+                b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["title"], row["category"]) for row in rows],
+                         [("Lamp", "Home")])
+
+        response = self.client.get(reverse("export"), {"format": "csv"})
+        self.assertTrue(b"".join(response.streaming_content)
+                        .startswith(b"id,title,"))
+
+
+# Search:
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        Watchlist.objects.create(user=cls.seller)
+        lighting = Category.objects.for_name("Lighting")
+
+        cls.lamps = [
+            Listing.objects.create(seller=cls.seller, title=title,
+                                   description=description, starting_bid=bid,
+                                   category=lighting)
+            for title, description, bid in [
+                ("Brass lamp", "Old desk lamp", 40),
+                ("Table", "Comes with a lamp", 10),
+                ("Floor lamp", "Tall", 90),
+            ]
+        ]
+        Category.objects.adjust_active_count(lighting.pk, len(cls.lamps))
+        get_backend().index([listing.pk for listing in cls.lamps])
+
+    def titles(self, query, **filters):
+        results, _ = get_backend().search(query, **filters)
+        return [listing.title for listing in results]
+
+    def test_prefix_match_ranks_titles_first(self):
+        titles = self.titles("lam")
+        self.assertEqual(set(titles), {"Brass lamp", "Table", "Floor lamp"})
+        self.assertEqual(titles[-1], "Table")
+        self.assertEqual(self.titles("light"), self.titles("lamp"))
+        self.assertEqual(self.titles("??"), [])
+
+    def test_price_and_status_filters(self):
+        place_bid(self.lamps[1], self.buyer, 95)
+        self.assertEqual(self.titles("lamp", max_price=50), ["Brass lamp"])
+        self.assertEqual(set(self.titles("lamp", min_price=90)),
+                         {"Floor lamp", "Table"})
+
+        self.client.force_login(self.seller)
+        self.client.post(reverse("status"), {"listing": self.lamps[1].pk,
+                                             "status": "Close Auction"})
+        self.assertNotIn("Table", self.titles("lamp"))
+        self.assertEqual(self.titles("lamp", active=False), ["Table"])
+        self.assertEqual(len(self.titles("lamp", active=None)), 3)
+
+    def test_cursor_pages_through_results(self):
+        first, cursor = get_backend().search("lamp", limit=2)
+        second, end = get_backend().search("lamp", cursor=cursor, limit=2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertIsNone(end)
+        self.assertFalse({item.pk for item in first} &
+                         {item.pk for item in second})
+
+    def test_cursors_with_bad_values_restart_from_first_page(self):
+        for backend in (get_backend(), SearchBackend()):
+            first, _ = backend.search("lamp", limit=2)
+            for values in (["abc", "1"], ["1", "abc"], ["nan", "1"],
+                           ["1", "99999999999999999999999"]):
+                with self.subTest(backend=backend, values=values):
+                    page, _ = backend.search(
+                        "lamp", cursor=encode_cursor(values), limit=2)
+                    self.assertEqual(page, first)
+
+        response = self.client.get(reverse("search"), {
+            "q": "lamp", "cursor": encode_cursor(["abc", "x"])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_listings_are_searchable(self):
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create"), {
+            "title": "Lava lamp", "description": "Groovy",
+            "starting_bid": 5, "image": "", "category": "Lighting"})
+
+        response = self.client.get(reverse("search"), {"q": "grOOv"})
+        self.assertEqual([item.title for item in response.context["results"]],
+                         ["Lava lamp"])
+
+    def test_edits_and_deletes_reach_the_index(self):
+        # As the admin saves and deletes them
+        floor = Listing.objects.get(pk=self.lamps[2].pk)
+        floor.description = "Short"
+        floor.save()
+        self.assertEqual(self.titles("short"), ["Floor lamp"])
+        self.assertEqual(self.titles("tall"), [])
+
+        self.lamps[0].delete()
+        # Unfiltered, so the ranked ids aren't joined back to the listings
+        page, cursor = get_backend().search("lamp", active=None, limit=2)
+        self.assertEqual({item.title for item in page},
+                         {"Table", "Floor lamp"})
+        self.assertIsNone(cursor)
+
+
+# Live listing events:
+class ListingEventTests(TestCase):
+
+    def test_events_published_from_threads_reach_every_subscriber(self):
+        events = EventBroker()
+
+        async def listen():
+            streams = [events.stream(7, lifetime=5) for _ in range(3)]
+            for stream in streams:
+                self.assertTrue((await stream.__anext__()).startswith("retry"))
+            self.assertEqual(events.subscriber_count(7), 3)
+
+            pending = [asyncio.ensure_future(stream.__anext__())
+                       for stream in streams]
+            thread = threading.Thread(target=events.publish,
+                                      args=(7, "bid", {"offer": 12}))
+            thread.start()
+            received = await asyncio.gather(*pending)
+            thread.join()
+
+            for stream in streams:
+                await stream.aclose()
+            return received
+
+        received = async_to_sync(listen)()
+        self.assertEqual(received,
+                         ['id: 1\nevent: bid\ndata: {"offer": 12}\n\n'] * 3)
+        self.assertEqual(events.subscriber_count(7), 0)
+
+    def test_bidding_publishes_after_commit(self):
+        seller = User.objects.create_user("seller", "", "password")
+        buyer = User.objects.create_user("buyer", "", "password")
+        listing = Listing.objects.create(
+            seller=seller, title="Lamp", description="Desc", starting_bid=1,
+            category=Category.objects.for_name("Home"))
+        published = []
+        self.client.force_login(buyer)
+
+        original = broker.publish
+        broker.publish = lambda *args: published.append(args)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("bid"), {"listing": listing.pk,
+                                                  "offer": 5})
+            # A proxy's answer is a second bid, reported in one event
+            proxy = User.objects.create_user("proxy", "", "password")
+            place_proxy(listing, proxy, 20)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("bid"), {"listing": listing.pk,
+                                                  "offer": 8})
+        finally:
+            broker.publish = original
+
+        self.assertEqual(published, [
+            (listing.pk, "bid",
+             {"offer": 5, "bidder": "buyer", "offer_count": 1}),
+            (listing.pk, "bid",
+             {"offer": 9, "bidder": "proxy", "offer_count": 4}),
+        ])
+
+    def test_stream_needs_asgi(self):
+        response = self.client.get(reverse("listing_events", args=[1]))
+        self.assertEqual(response.status_code, 501)
+
+
+# Watchlists:
+class WatchlistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "", "password")
+        cls.viewer = User.objects.create_user("viewer", "", "password")
+        Watchlist.objects.create(user=cls.viewer)
+        category = Category.objects.for_name("Home")
+        cls.listings = Listing.objects.bulk_create([
+            Listing(seller=cls.seller, title=f"Item {i}", description="Desc",
+                    starting_bid=1, category=category)
+            for i in range(30)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+
+    def toggle(self, listing, state):
+        self.client.post(reverse("watchlist"), {"item_id": listing.pk,
+                                                "state": state})
+
+    def test_membership_is_cached_and_invalidated(self):
+        lamp = Listing.objects.get(title="Item 0")
+        self.assertEqual(watched_ids(self.viewer), frozenset())
+
+        self.toggle(lamp, "Add")
+        watched_ids(self.viewer)
+        with self.assertNumQueries(0):
+            self.assertEqual(watched_ids(self.viewer), {lamp.pk})
+        response = self.client.get(reverse("listing", args=[lamp.pk]))
+        self.assertTrue(response.context["is_watched"])
+
+        self.toggle(lamp, "Remove")
+        response = self.client.get(reverse("listing", args=[lamp.pk]))
+        self.assertFalse(response.context["is_watched"])
+
+    def test_watchlist_page_is_paginated(self):
+        for listing in Listing.objects.all():
+            self.toggle(listing, "Add")
+
+        first = self.client.get(reverse("watchlist"))
+        second = self.client.get(reverse("watchlist"),
+                                 {"cursor": first.context["next_cursor"]})
+        shown = [item.pk for item in first.context["watchlist"]] + \
+            [item.pk for item in second.context["watchlist"]]
+
+        self.assertEqual(sorted(shown),
+                         sorted(Listing.objects.values_list("pk", flat=True)))
+        self.assertIsNone(second.context["next_cursor"])
+
+
+# Scheduled expiry:
+def create_expiring(seller, category, count, ends_at):
+    listings = Listing.objects.bulk_create([
+        Listing(seller=seller, title=f"Item {i}", description="Desc",
+                starting_bid=1, category=category, ends_at=ends_at)
+        for i in range(count)
+    ])
+    Category.objects.adjust_active_count(category.pk, count)
+    return listings
+
+
+class ExpiryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "", "password")
+        cls.buyer = User.objects.create_user("buyer", "", "password")
+        cls.category = Category.objects.for_name("Home")
+
+    def test_due_auctions_close_with_their_winner(self):
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        future = timezone.now() + datetime.timedelta(days=1)
+        create_expiring(self.seller, self.category, 25, past)
+        create_expiring(self.seller, self.category, 5, future)
+        won = Listing.objects.filter(ends_at=past).first()
+        Bid.objects.create(listing=won, seller=self.seller, starting_bid=1,
+                           offer=9, bidder=self.buyer, offer_count=1)
+
+        self.assertEqual(expire_due(batch_size=10), 25)
+        self.assertEqual(expire_due(batch_size=10), 0)
+
+        won.refresh_from_db()
+        self.category.refresh_from_db()
+        self.assertEqual((won.active, won.winner), (False, self.buyer))
+        self.assertFalse(Bid.objects.get(listing=won).is_open)
+        self.assertEqual(self.category.active_count, 5)
+        self.assertEqual(Listing.objects.filter(active=True).count(), 5)
+
+    def test_bids_after_end_time_are_rejected(self):
+        past = timezone.now() - datetime.timedelta(seconds=1)
+        listing, = create_expiring(self.seller, self.category, 1, past)
+        with self.assertRaisesMessage(BidRejected, "ended"):
+            place_bid(listing, self.buyer, 5)
+
+
+class ConcurrentExpiryTests(TransactionTestCase):
+
+    def test_workers_never_close_the_same_listing_twice(self):
+        seller = User.objects.create_user("seller", "", "password")
+        category = Category.objects.for_name("Home")
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        create_expiring(seller, category, 2000, past)
+        closed = []
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        count = expire_batch(timezone.now(), 100)
+                    except OperationalError:
+                        time.sleep(0.001)
+                        continue
+                    if not count:
+                        return
+                    closed.append(count)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        category.refresh_from_db()
+        self.assertEqual(sum(closed), 2000)
+        self.assertEqual(category.active_count, 0)
+
+
+# Notification outbox:
+class FailingTransport:
+    def __init__(self):
+        self.calls = 0
+
+    def send(self, user, subject, body):
+        self.calls += 1
+        raise OSError("connection refused")
+
+
+class NotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.alice = User.objects.create_user("alice", "a@example.com",
+                                             "password")
+        cls.bob = User.objects.create_user("bob", "b@example.com",
+                                           "password")
+        cls.home = Category.objects.for_name("Home")
+        cls.lamp = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=10, category=cls.home)
+        Category.objects.adjust_active_count(cls.home.pk, 1)
+
+    def pending(self):
+        return sorted(Notification.objects.values_list(
+            "recipient__username", "kind", "listing__title"))
+
+    def test_outbid_bidders_are_queued(self):
+        place_bid(self.lamp, self.alice, 10)
+        self.assertEqual(self.pending(), [])
+
+        # Raising your own lead isn't being outbid
+        place_bid(self.lamp, self.alice, 12)
+        place_bid(self.lamp, self.bob, 15)
+        self.assertEqual(self.pending(), [("alice", "outbid", "Lamp")])
+
+    def test_proxy_answers_queue_every_displaced_bidder(self):
+        carol = User.objects.create_user("carol", "c@example.com")
+        place_bid(self.lamp, carol, 10)
+        place_proxy(self.lamp, self.alice, 100)
+        Notification.objects.all().delete()
+
+        # Bob briefly leads, then Alice's proxy answers
+        place_bid(self.lamp, self.bob, 60)
+        self.assertEqual(self.pending(), [("bob", "outbid", "Lamp")])
+
+        place_proxy(self.lamp, self.bob, 200)
+        self.assertIn(("alice", "outbid", "Lamp"), self.pending())
+
+    def test_notices_roll_back_with_their_change(self):
+        place_bid(self.lamp, self.alice, 10)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            place_bid(self.lamp, self.bob, 15)
+            self.assertEqual(len(self.pending()), 1)
+            raise RuntimeError
+        self.assertEqual(self.pending(), [])
+
+    def test_closing_notifies_watchers_and_winner_once(self):
+        place_bid(self.lamp, self.alice, 10)
+        Notification.objects.all().delete()
+        for user in (self.alice, self.bob):
+            Watchlist.objects.create(user=user).listings.add(self.lamp)
+
+        self.client.force_login(self.seller)
+        for action in ("Close Auction", "Open Auction"):
+            self.client.post(reverse("status"), {
+                "listing": self.lamp.pk, "status": action})
+        self.assertEqual(self.pending(), [("alice", "closed", "Lamp"),
+                                          ("bob", "closed", "Lamp")])
+
+        notify_closed([])
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_expiry_notifies(self):
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        listing, = create_expiring(self.seller, self.home, 1, past)
+        Bid.objects.create(listing=listing, seller=self.seller,
+                           starting_bid=1, offer=9, bidder=self.bob,
+                           offer_count=1)
+        expire_due()
+        self.assertEqual(self.pending(), [("bob", "closed", listing.title)])
+
+    def test_dispatch_sends_one_message_per_recipient(self):
+        vase = Listing.objects.create(
+            seller=self.seller, title="Vase", description="Desc",
+            starting_bid=1, category=self.home)
+        for listing in (self.lamp, vase):
+            place_bid(listing, self.alice, 10)
+            place_bid(listing, self.bob, 20)
+        place_bid(self.lamp, self.alice, 30)
+
+        self.assertEqual(dispatch_due(EmailTransport()), (2, 0))
+        self.assertFalse(Notification.objects.exists())
+
+        messages = {message.to[0]: message for message in mail.outbox}
+        self.assertEqual(messages["a@example.com"].subject,
+                         "2 updates on your auctions")
+        self.assertIn("You've been outbid on Vase: the current bid is $20.",
+                      messages["a@example.com"].body)
+        self.assertEqual(messages["b@example.com"].subject,
+                         "You've been outbid on Lamp")
+
+    def test_compose(self):
+        self.lamp.winner = self.alice
+        notices = [Notification(recipient=self.alice, listing=self.lamp,
+                                kind=kind)
+                   for kind in ("outbid", "outbid", "closed")]
+        subject, body = compose(self.alice, notices, {self.lamp.pk: 30})
+        self.assertEqual(subject, "2 updates on your auctions")
+        self.assertEqual(body.count("outbid"), 1)
+        self.assertIn("You won Lamp: your bid was $30.", body)
+
+        subject, _ = compose(self.bob, notices[2:], {})
+        self.assertEqual(subject, "Lamp has closed")
+
+    def test_failed_messages_back_off_then_give_up(self):
+        place_bid(self.lamp, self.alice, 10)
+        place_bid(self.lamp, self.bob, 15)
+        transport = FailingTransport()
+        now = timezone.now()
+
+        with self.assertLogs("auctions.notifications", "WARNING"):
+            self.assertEqual(dispatch_due(transport, now), (0, 1))
+        notice = Notification.objects.get()
+        self.assertEqual((notice.attempts, notice.next_attempt),
+                         (1, now + BACKOFF_BASE))
+        self.assertIn("refused", notice.last_error)
+
+        # Not due again until the delay has passed
+        self.assertEqual(dispatch_due(transport, now), (0, 0))
+        self.assertEqual(transport.calls, 1)
+
+        with self.assertLogs("auctions.notifications", "WARNING") as logs:
+            for day in range(1, MAX_ATTEMPTS):
+                dispatch_due(transport, now + datetime.timedelta(days=day))
+        self.assertIn("Gave up", logs.output[-1])
+        notice.refresh_from_db()
+        self.assertEqual((notice.attempts, notice.next_attempt),
+                         (MAX_ATTEMPTS, None))
+
+        # Given up on, but kept for inspection
+        dispatch_due(transport, now + datetime.timedelta(days=MAX_ATTEMPTS))
+        self.assertEqual(transport.calls, MAX_ATTEMPTS)
+
+    def test_command_and_file_transport(self):
+        place_bid(self.lamp, self.alice, 10)
+        place_bid(self.lamp, self.bob, 15)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        output = io.StringIO()
+        with self.settings(NOTIFICATION_TRANSPORT_OPTIONS={
+                "backend": "django.core.mail.backends.filebased.EmailBackend",
+                "file_path": directory}):
+            call_command("dispatch_notifications", stdout=output)
+        self.assertIn("Sent 1 messages", output.getvalue())
+
+        filename, = os.listdir(directory)
+        with open(os.path.join(directory, filename)) as file:
+            self.assertIn("To: a@example.com", file.read())
+
+
+class BenchmarkTests(TransactionTestCase):
+
+    def test_percentile_picks_nearest_rank(self):
+        self.assertEqual(percentile(range(1, 101), 0.95), 95)
+        self.assertEqual(percentile([5], 0.99), 5)
+
+    def test_workloads_replay_against_generated_data(self):
+        dataset = generate(users=3, listings=20, bids=30, comments=10,
+                           watched=2)
+        self.assertEqual(len(dataset.listing_ids), 20)
+        offers = Offer.objects.count()
+
+        counter = QueryCounter()
+        counter.install()
+        try:
+            results = {name: run_workload(ClientTransport(), dataset,
+                                          WORKLOADS[name], 6, 1, counter)
+                       for name in ("index", "bidding")}
+        finally:
+            counter.uninstall()
+
+        for result in results.values():
+            self.assertEqual(result["requests"], 6)
+            self.assertEqual(result["errors"], 0)
+            self.assertGreater(result["queries_per_request"], 0)
+        # Six timed bids plus the session's warm-up bid
+        self.assertEqual(Offer.objects.count() - offers, 7)
+
+        deltas = compare({"workloads": results}, {"workloads": results})
+        self.assertEqual(deltas["index"]["throughput"], 0)
+
+
+# Leaderboards and activity statistics:
+class StatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        cls.rival = User.objects.create_user("rival", "r@example.com",
+                                             "password")
+
+    def snapshot(self):
+        return {
+            "users": set(UserStats.objects.values_list()),
+            "categories": set(CategoryStats.objects.values_list()),
+            "days": set(DailyStats.objects.values_list()),
+        }
+
+    def test_running_totals_match_a_rebuild(self):
+        self.client.force_login(self.seller)
+        for title in ("Lamp", "Chair", "Vase"):
+            self.client.post(reverse("create"), {
+                "title": title, "description": "Desc", "starting_bid": 5,
+                "image": "", "category": "Home"})
+        lamp, chair, vase = Listing.objects.order_by("pk")
+
+        place_bid(lamp, self.buyer, 10)
+        place_bid(lamp, self.rival, 12)
+        place_bid(chair, self.buyer, 30)
+        place_bid(vase, self.rival, 7)
+        for action in ("Close Auction", "Open Auction", "Close Auction"):
+            self.client.post(reverse("status"),
+                             {"listing": lamp.pk, "status": action})
+        self.client.post(reverse("status"),
+                         {"listing": vase.pk, "status": "Close Auction"})
+        self.client.post(reverse("status"),
+                         {"listing": vase.pk, "status": "Open Auction"})
+        Listing.objects.filter(pk=chair.pk).update(
+            ends_at=timezone.now() - datetime.timedelta(minutes=1))
+        expire_due()
+
+        seller = UserStats.objects.get(user=self.seller)
+        self.assertEqual((seller.listings_created, seller.listings_sold,
+                          seller.sales_total), (3, 2, 42))
+        rival = UserStats.objects.get(user=self.rival)
+        self.assertEqual((rival.bids_placed, rival.amount_bid,
+                          rival.auctions_won), (2, 19, 1))
+        home = CategoryStats.objects.get(category__name="Home")
+        self.assertEqual((home.bids_placed, home.listings_sold,
+                          home.sales_total), (4, 2, 42))
+
+        incremental = self.snapshot()
+        out = io.StringIO()
+        call_command("rebuild_stats", batch_size=2, stdout=out)
+        self.assertIn("3 users", out.getvalue())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_reopening_a_sale_closed_before_winners_were_recorded(self):
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create"), {
+            "title": "Lamp", "description": "Desc", "starting_bid": 5,
+            "image": "", "category": "Home"})
+        lamp = Listing.objects.get()
+        place_bid(lamp, self.buyer, 10)
+        # As closed by older code: no winner, so not counted as a sale
+        Listing.objects.filter(pk=lamp.pk).update(active=False)
+        Bid.objects.filter(listing=lamp).update(is_open=False)
+        call_command("rebuild_stats", stdout=io.StringIO())
+
+        for action, sold in (("Open Auction", 0), ("Close Auction", 1)):
+            self.client.post(reverse("status"),
+                             {"listing": lamp.pk, "status": action})
+            seller = UserStats.objects.get(user=self.seller)
+            buyer = UserStats.objects.get(user=self.buyer)
+            self.assertEqual((seller.listings_sold, seller.sales_total,
+                              buyer.auctions_won), (sold, sold * 10, sold))
+
+        incremental = self.snapshot()
+        call_command("rebuild_stats", stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_dashboard_reads_leaderboards(self):
+        UserStats.objects.bulk_create([
+            UserStats(user=self.buyer, bids_placed=5, amount_bid=50),
+            UserStats(user=self.rival, bids_placed=9, amount_bid=20),
+            UserStats(user=self.seller, sales_total=70, listings_sold=2),
+        ])
+        DailyStats.objects.create(day=datetime.date.today(), bids_placed=14)
+
+        response = self.client.get(reverse("stats"))
+        self.assertEqual([row.user.username for row in
+                          response.context["bidders"]], ["rival", "buyer"])
+        self.assertEqual([row.user.username for row in
+                          response.context["sellers"]], ["seller"])
+        self.assertContains(response, "seller: $70 from 2 sale(s)")
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite query plans")
+    def test_leaderboards_are_read_in_index_order(self):
+        for index, board in [("userstats_bidders_idx", top_bidders()),
+                             ("userstats_sellers_idx", top_sellers()),
+                             ("categorystats_volume_idx", top_categories())]:
+            with self.subTest(index=index):
+                plan = board.explain()
+                self.assertIn(f"USING INDEX {index}", plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+
+# Database profiles:
+class DatabaseProfileTests(TestCase):
+
+    def test_pragmas_apply_to_each_new_sqlite_connection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        handler = ConnectionHandler({"default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(directory, "db.sqlite3"),
+            "PRAGMAS": {"journal_mode": "WAL", "synchronous": "NORMAL",
+                        "busy_timeout": 1234},
+        }})
+
+        for _ in range(2):
+            tuned = handler["default"]
+            with tuned.cursor() as cursor:
+                settings = [cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                            for name in ("journal_mode", "synchronous",
+                                         "busy_timeout")]
+            tuned.close()
+            self.assertEqual(settings, ["wal", 1, 1234])
+
+
+# Async read views:
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.buyer = User.objects.create_user("buyer", "b@example.com",
+                                             "password")
+        lighting = Category.objects.for_name("Lighting")
+        cls.lamp, cls.chair = [Listing.objects.create(
+            seller=cls.seller, title=title, description="Desc",
+            starting_bid=5, category=lighting) for title in ("Lamp", "Chair")]
+        Category.objects.adjust_active_count(lighting.pk, 2)
+        Watchlist.objects.create(user=cls.buyer).listings.add(cls.lamp)
+        place_bid(cls.lamp, cls.buyer, 9)
+        Comment.objects.create(item=cls.lamp, content="Nice",
+                               author=cls.buyer)
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, view, user, *args):
+        request = RequestFactory().get("/")
+        request.user = user
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, *args)
+        # CSRF tokens are masked afresh on every render
+        content = re.sub(r'name="csrfmiddlewaretoken" value="\w+"', "",
+                         response.content.decode())
+        return content, len(queries)
+
+    def test_pages_match_the_sync_views(self):
+        pages = [("index",), ("categories",), ("category", "lighting"),
+                 ("listing", self.lamp.pk)]
+        # Not found: the async views have fetched more by then
+        missing = [("category", "nothing"), ("listing", 0)]
+
+        for user in (AnonymousUser(), self.buyer):
+            signed_in = [("watchlist",)] if user.is_authenticated else []
+            for name, *args in pages + signed_in + missing:
+                with self.subTest(view=name, user=str(user), args=args):
+                    sync_page, sync_queries = self.render(
+                        getattr(views, name), user, *args)
+                    async_page, async_queries = self.render(
+                        async_to_sync(getattr(async_views, name)), user,
+                        *args)
+                    self.assertEqual(async_page, sync_page)
+                    if (name, *args) not in missing:
+                        self.assertLessEqual(async_queries, sync_queries)
+
+        page, _ = self.render(async_to_sync(async_views.listing), self.buyer,
+                              self.lamp.pk)
+        self.assertIn("Remove from watchlist", page)
+        self.assertIn("Your bid is the current bid.", page)
+
+    def test_watchlist_needs_a_signed_in_user(self):
+        request = RequestFactory().get("/watchlist/")
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.watchlist)(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse("login")))
+
+
+# Read-replica routing:
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaRoutingTests(TestCase):
+
+    def route(self, method="get", cookies=None, write=False):
+        # Where a request's reads go: before and after any write it makes
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Listing))
+            seen.append(router.db_for_read(Session))
+            if write:
+                router.db_for_write(Listing)
+                seen.append(router.db_for_read(Listing))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)("/")
+        request.COOKIES.update(cookies or {})
+        response = ReplicaMiddleware(view)(request)
+        return seen, response.cookies
+
+    def test_browsing_reads_from_the_replica_until_a_write(self):
+        seen, cookies = self.route()
+        self.assertEqual(seen, ["replica", "default"])
+        self.assertNotIn(PIN_COOKIE, cookies)
+
+        seen, cookies = self.route(write=True)
+        self.assertEqual(seen, ["replica", "default", "default"])
+        self.assertEqual(cookies[PIN_COOKIE]["max-age"], 5)
+
+    def test_writers_and_other_methods_stay_on_the_primary(self):
+        self.assertEqual(self.route(cookies={PIN_COOKIE: "1"})[0],
+                         ["default", "default"])
+        self.assertEqual(self.route("post")[0], ["default", "default"])
+        self.assertEqual(router.db_for_read(Listing), "default")
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_middleware_drops_out_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(lambda request: HttpResponse())
+
+
+# Read-replica routing over two SQLite files, as with COMMERCE_REPLICA=1:
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaFilesTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user("seller", "s@example.com",
+                                               "password")
+        self.buyer = User.objects.create_user("buyer", "b@example.com",
+                                              "password")
+        self.lamp = Listing.objects.create(
+            seller=self.seller, title="Lamp", description="Desc",
+            starting_bid=5, category=Category.objects.for_name("Lighting"))
+
+        # The test database copied to a primary file, which stands in for
+        # it until the test ends, and an empty replica file
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        files = ConnectionHandler({alias: {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(directory, f"{alias}.sqlite3"),
+        } for alias in ("default", "replica")})
+        connection.ensure_connection()
+        files["default"].ensure_connection()
+        connection.connection.backup(files["default"].connection)
+
+        test_database = connections["default"]
+        connections["default"] = files["default"]
+        connections["replica"] = files["replica"]
+        self.addCleanup(files.close_all)
+        self.addCleanup(connections.__delitem__, "replica")
+        self.addCleanup(connections.__setitem__, "default", test_database)
+
+        call_command("sync_replica", stdout=io.StringIO())
+
+    def test_reads_go_to_the_replica_until_the_reader_writes(self):
+        # Lands on the primary only, until the replica is next synced
+        Listing.objects.filter(pk=self.lamp.pk).bump_version(title="Desk lamp")
+        url = reverse("listing", args=[self.lamp.pk])
+
+        response = self.client.get(url)
+        self.assertContains(response, "<h1>Lamp</h1>")
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        # A comment pins its author's reads to the primary
+        self.client.force_login(self.buyer)
+        response = self.client.post(reverse("comments"), {
+            "listing": self.lamp.pk, "content": "Does it work?"})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        page = self.client.get(url).content.decode()
+        self.assertIn("<h1>Desk lamp</h1>", page)
+        self.assertIn("Does it work?", page)
+
+        # Once the pin lapses they're back on the replica, until it syncs
+        del self.client.cookies[PIN_COOKIE]
+        self.assertNotContains(self.client.get(url), "Does it work?")
+        call_command("sync_replica", stdout=io.StringIO())
+        self.assertContains(self.client.get(url), "Does it work?")
+
+    def test_cached_user_and_watchlist_come_from_the_primary(self):
+        # Neither is on the replica yet
+        newcomer = User.objects.create_user("newcomer", "n@example.com",
+                                            "password")
+        watchlist = Watchlist.objects.create(user=newcomer)
+        watchlist.listings.add(self.lamp)
+
+        self.client.force_login(newcomer)
+        response = self.client.get(reverse("listing", args=[self.lamp.pk]))
+        self.assertContains(response, "Signed in as <strong>newcomer")
+        self.assertContains(response, "Remove from watchlist")
+
+
+# Profiling middleware:
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.item = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=1, category=Category.objects.for_name("Lighting"))
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.profiles = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profiles)
+
+    def test_metrics_are_hidden_when_disabled(self):
+        self.client.get(reverse("index"))
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        self.assertFalse(registry.histograms[
+            "commerce_request_duration_seconds"])
+
+    def test_requests_are_aggregated_per_view(self):
+        with self.settings(PROFILING=True, PROFILING_SAMPLE_RATE=0):
+            client = Client()
+            client.get(reverse("index"))
+            for _ in range(2):
+                client.get(reverse("listing", args=[self.item.pk]))
+            metrics = client.get("/metrics").content.decode()
+
+        self.assertIn('commerce_request_duration_seconds_count'
+                      '{view="listing"} 2', metrics)
+        self.assertIn('commerce_db_queries_count{view="index"} 1', metrics)
+        self.assertIn('commerce_template_duration_seconds_count'
+                      '{view="index"} 1', metrics)
+        # The related sidebar misses its two groups once, then hits them
+        self.assertIn('commerce_cache_requests_total{view="listing",'
+                      'cache="related",result="miss"} 2', metrics)
+        self.assertIn('commerce_cache_requests_total{view="listing",'
+                      'cache="related",result="hit"} 2', metrics)
+
+        listing = registry.histograms["commerce_db_queries"]["listing"]
+        self.assertGreater(listing.sum, 0)
+        self.assertGreater(registry.histograms[
+            "commerce_template_duration_seconds"]["listing"].sum, 0)
+
+    def test_only_the_slowest_sampled_profiles_are_kept(self):
+        with self.settings(PROFILING=True, PROFILING_SAMPLE_RATE=1,
+                           PROFILING_SLOWEST=2, PROFILING_DIR=self.profiles):
+            client = Client()
+            for _ in range(5):
+                client.get(reverse("index"))
+
+        files = os.listdir(self.profiles)
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(name.startswith("index-") for name in files))
+
+    @override_settings(PROFILING=True, PROFILING_SAMPLE_RATE=1)
+    def test_async_requests_count_queries_from_other_threads(self):
+        def query():
+            # A thread of its own, so a connection of its own
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connections["default"].close()
+
+        async def view(request):
+            await sync_to_async(query, thread_sensitive=False)()
+            await sync_to_async(query, thread_sensitive=False)()
+            return HttpResponse()
+
+        middleware = ProfilingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        async_to_sync(middleware)(RequestFactory().get("/"))
+        queries = registry.histograms["commerce_db_queries"]["unmatched"]
+        self.assertEqual((queries.count, queries.sum), (1, 2))
+
+        with self.settings(DEBUG=True), \
+                self.assertLogs("django.request", "DEBUG") as logs:
+            BaseHandler().load_middleware(is_async=True)
+            logging.getLogger("django.request").debug("loaded")
+        self.assertFalse([line for line in logs.output
+                          if "ProfilingMiddleware" in line])
+
+
+# A solid grey PNG, built by hand so the tests don't need Pillow
+def _png(width, height):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(
+            ">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + b"\x80" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0,
+                                         0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows))
+            + chunk(b"IEND", b""))
+
+
+class CountingFetcher(LocalFileFetcher):
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.fetched = []
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        return super().fetch(url)
+
+
+# Listing image proxy:
+class ImageTests(TestCase):
+    URL = "https://images.example.com/photos/lamp.png"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.category = Category.objects.for_name("Lighting")
+
+    def setUp(self):
+        cache.clear()
+        caches["template_fragments"].clear()
+        self.sources = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sources)
+        stored = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, stored)
+
+        os.mkdir(os.path.join(self.sources, "photos"))
+        self.data = _png(800, 600)
+        with open(os.path.join(self.sources, "photos", "lamp.png"),
+                  "wb") as file:
+            file.write(self.data)
+
+        settings = override_settings(
+            IMAGES_DIR=stored, IMAGE_WORKERS=0,
+            IMAGE_FETCHER="auctions.images.LocalFileFetcher",
+            IMAGE_FETCHER_OPTIONS={"root": self.sources})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def listing(self, image=URL):
+        return Listing.objects.create(
+            seller=self.seller, title="Lamp", description="Desc",
+            starting_bid=1, image=image, category=self.category)
+
+    def test_each_url_is_fetched_once(self):
+        first, second = self.listing(), self.listing()
+        fetcher = CountingFetcher(self.sources)
+
+        self.assertEqual(process([first.pk, second.pk], fetcher), 2)
+        self.assertEqual(fetcher.fetched, [self.URL])
+
+        # Later listings reuse the stored copy
+        third = self.listing()
+        self.assertEqual(process([third.pk], fetcher), 1)
+        self.assertEqual(fetcher.fetched, [self.URL])
+
+        digest = hashlib.sha256(self.data).hexdigest()
+        first.refresh_from_db()
+        self.assertEqual(first.image_digest, digest)
+        # Cached cards showing the external URL are retired
+        self.assertEqual(first.version, 2)
+
+    def test_cards_embed_the_stored_rendition(self):
+        item = self.listing()
+        self.assertContains(self.client.get(reverse("index")), self.URL)
+
+        process([item.pk])
+        item.refresh_from_db()
+        thumb = reverse("image", args=[item.image_digest, "thumb"])
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, thumb)
+        self.assertNotContains(response, self.URL)
+        self.assertContains(
+            self.client.get(reverse("listing", args=[item.pk])),
+            reverse("image", args=[item.image_digest, "detail"]))
+
+    def test_images_are_served_immutable(self):
+        item = self.listing()
+        process([item.pk])
+        item.refresh_from_db()
+        url = reverse("image", args=[item.image_digest, "thumb"])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        self.assertEqual(response["Content-Type"],
+                         "image/png" if PillowImage is None else "image/jpeg")
+        response.close()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        original = self.client.get(
+            reverse("image", args=[item.image_digest, "original"]))
+        self.assertEqual(b"".join(original.streaming_content), self.data)
+
+    def test_unknown_images_are_not_found(self):
+        digest = hashlib.sha256(self.data).hexdigest()
+        for args in ([digest, "thumb"], [digest, "huge"],
+                     ["..", "thumb"], ["0" * 63 + "g", "original"]):
+            self.assertEqual(
+                self.client.get(reverse("image", args=args)).status_code,
+                404)
+
+    def test_failures_leave_the_external_url(self):
+        broken = self.listing("https://images.example.com/missing.png")
+        outside = self.listing("https://images.example.com/../../passwd")
+        with open(os.path.join(self.sources, "page.png"), "wb") as file:
+            file.write(b"<html></html>")
+        page = self.listing("https://images.example.com/page.png")
+
+        with self.assertLogs("auctions.images", "WARNING"):
+            self.assertEqual(process([broken.pk, outside.pk, page.pk]), 0)
+        self.assertFalse(Listing.objects.exclude(image_digest=""))
+        with self.assertRaises(ImageError):
+            store(b"GIF8")
+
+    def test_internal_addresses_are_never_fetched(self):
+        requested = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                requested.append(self.path)
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+
+        fetcher = HTTPFetcher(timeout=1)
+        for url in [f"http://127.0.0.1:{port}/lamp.png",
+                    f"http://localhost:{port}/lamp.png",
+                    "http://169.254.169.254/latest/meta-data/",
+                    "http://10.0.0.7/lamp.png", "http://[::1]/lamp.png",
+                    "http://[::ffff:127.0.0.1]/lamp.png",
+                    "ftp://images.example.com/lamp.png"]:
+            with self.assertRaises(ImageError, msg=url):
+                fetcher.fetch(url)
+        self.assertEqual(requested, [])
+        self.assertEqual(public_address("93.184.216.34", 80),
+                         "93.184.216.34")
+
+    def test_schedule_waits_for_commit_and_workers(self):
+        item = self.listing()
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule([item, self.listing("")])
+        self.assertEqual(callbacks, [])
+
+        with self.settings(IMAGE_WORKERS=2):
+            with self.captureOnCommitCallbacks() as callbacks:
+                schedule([item, self.listing("")])
+        self.assertEqual(len(callbacks), 1)
+
+    @skipUnless(PillowImage, "needs Pillow")
+    def test_renditions_are_resized(self):
+        item = self.listing()
+        process([item.pk])
+        item.refresh_from_db()
+
+        for name, (width, height, crop) in RENDITIONS.items():
+            response = self.client.get(
+                reverse("image", args=[item.image_digest, name]))
+            image = PillowImage.open(io.BytesIO(
+                b"".join(response.streaming_content)))
+            if crop:
+                self.assertEqual(image.size, (width, height))
+            else:
+                self.assertLessEqual(image.size[0], width)
+                self.assertLessEqual(image.size[1], height)
+
+
+# Static asset pipeline:
+class StaticPipelineTests(TestCase):
+    STORAGE = "auctions.staticfiles.CompressedManifestStaticFilesStorage"
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(
+            STATIC_PIPELINE=True, STATIC_ROOT=root, STORAGES={
+                "default": {"BACKEND":
+                            "django.core.files.storage.FileSystemStorage"},
+                "staticfiles": {"BACKEND": self.STORAGE},
+            })
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.root = root
+        self.url = static("auctions/styles.css")
+        with open(os.path.join(root, "auctions", "styles.css"), "rb") as file:
+            self.css = file.read()
+
+    def test_assets_are_hashed_and_precompressed(self):
+        self.assertRegex(self.url, r"^/static/auctions/styles\.\w{12}\.css$")
+        with open(os.path.join(self.root, self.url[len("/static/"):])
+                  + ".gz", "rb") as file:
+            self.assertEqual(gzip.decompress(file.read()), self.css)
+
+        # Pages link the hashed name
+        self.assertContains(self.client.get(reverse("index")), self.url)
+
+    def test_hashed_assets_are_served_immutable(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"],
+                         "br" if brotli else "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(response["Cache-Control"],
+                         "public, max-age=31536000, immutable")
+        self.assertTrue(response["Content-Type"].startswith("text/css"))
+        if not brotli:
+            self.assertEqual(gzip.decompress(response.content), self.css)
+
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response["ETag"],
+                                   HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response.status_code, 304)
+
+    def test_encoding_negotiation(self):
+        for header in ("", "identity", "gzip;q=0", "deflate"):
+            with self.subTest(accept_encoding=header):
+                response = self.client.get(self.url,
+                                           HTTP_ACCEPT_ENCODING=header)
+                self.assertFalse(response.has_header("Content-Encoding"))
+                self.assertEqual(response.content, self.css)
+                self.assertEqual(int(response["Content-Length"]),
+                                 len(self.css))
+
+    def test_other_paths_pass_through(self):
+        # Unhashed names are served, but only cached briefly
+        response = self.client.get("/static/auctions/styles.css")
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+        self.assertEqual(self.client.get("/static/missing.css").status_code,
+                         404)
+        self.assertEqual(self.client.get(reverse("index")).status_code, 200)
+
+    def test_async_requests(self):
+        async def get_response(request):
+            return HttpResponse("view")
+
+        middleware = StaticFilesMiddleware(get_response)
+        factory = RequestFactory()
+        response = async_to_sync(middleware)(
+            factory.get(self.url, HTTP_ACCEPT_ENCODING="gzip"))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        response = async_to_sync(middleware)(factory.get("/"))
+        self.assertEqual(response.content, b"view")
+
+    def test_off_by_default(self):
+        with self.settings(STATIC_PIPELINE=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                StaticFilesMiddleware(lambda request: HttpResponse())
+
+
+# Rate limiting:
+class RateLimitTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "s@example.com",
+                                              "password")
+        cls.alice = User.objects.create_user("alice", "a@example.com",
+                                             "password")
+        cls.bob = User.objects.create_user("bob", "b@example.com",
+                                           "password")
+        cls.lamp = Listing.objects.create(
+            seller=cls.seller, title="Lamp", description="Desc",
+            starting_bid=10, category=Category.objects.for_name("Home"))
+
+    def setUp(self):
+        # Buckets outlive the test's users, whose ids are reused
+        caches["ratelimit"].clear()
+        self.addCleanup(caches["ratelimit"].clear)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("30/m"), (30, 60))
+        self.assertEqual(parse_rate("5/h"), (5, 3600))
+        for rate in ("30", "0/m", "x/m", "30/week"):
+            with self.subTest(rate=rate):
+                with self.assertRaises(ImproperlyConfigured):
+                    parse_rate(rate)
+
+    def test_bucket_bursts_then_refills(self):
+        bucket = TokenBucket(caches["ratelimit"], "3/m")
+        now = 1000.0
+        self.assertEqual([bucket.take("k", now) for _ in range(3)],
+                         [0, 0, 0])
+        self.assertAlmostEqual(bucket.take("k", now), 20)
+
+        # One token back every 20 seconds, up to the bucket's size
+        self.assertAlmostEqual(bucket.take("k", now + 15), 5)
+        self.assertEqual(bucket.take("k", now + 20), 0)
+        self.assertGreater(bucket.take("k", now + 20), 0)
+        self.assertEqual([bucket.take("k", now + 600) for _ in range(4)][3],
+                         20)
+        self.assertEqual(bucket.take("other", now), 0)
+
+    def test_users_are_limited_separately(self):
+        with self.settings(RATE_LIMITS={"bid": "2/m"}):
+            alice, bob = Client(), Client()
+            alice.force_login(self.alice)
+            bob.force_login(self.bob)
+
+            def bid(client, offer):
+                return client.post(reverse("bid"), {"listing": self.lamp.pk,
+                                                    "offer": offer})
+
+            self.assertEqual(bid(alice, 10).status_code, 302)
+            self.assertEqual(bid(alice, 11).status_code, 302)
+            response = bid(alice, 12)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "30")
+            self.assertContains(response, "Too many requests",
+                                status_code=429)
+            self.assertEqual(bid(bob, 13).status_code, 302)
+
+            # Reads aren't counted
+            self.assertEqual(alice.get(reverse("index")).status_code, 200)
+        self.assertEqual(Bid.objects.get(listing=self.lamp).offer, 13)
+
+    def test_anonymous_clients_are_limited_by_address(self):
+        with self.settings(RATE_LIMITS={"login": "1/h"}):
+            client = Client()
+            credentials = {"username": "alice", "password": "wrong"}
+            self.assertEqual(
+                client.post(reverse("login"), credentials).status_code, 200)
+            response = client.post(reverse("login"), credentials)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "3600")
+
+            self.assertEqual(client.get(reverse("login")).status_code, 200)
+            self.assertEqual(
+                client.post(reverse("login"), credentials,
+                            REMOTE_ADDR="10.0.0.2").status_code, 200)
+            # Unlisted views are never limited
+            for _ in range(3):
+                self.assertEqual(client.post(reverse("comments"), {})
+                                 .status_code, 302)
+
+    def test_off_without_limits(self):
+        with self.settings(RATE_LIMITS={}):
+            with self.assertRaises(MiddlewareNotUsed):
+                RateLimitMiddleware(lambda request: HttpResponse())
+
+    def test_clients_behind_trusted_proxies(self):
+        factory = RequestFactory()
+        headers = {"REMOTE_ADDR": "10.0.0.1",
+                   "HTTP_X_FORWARDED_FOR": "6.6.6.6, 1.2.3.4, 10.0.0.9"}
+
+        def address(proxies, **extra):
+            with self.settings(RATE_LIMIT_TRUSTED_PROXIES=proxies):
+                middleware = RateLimitMiddleware(
+                    lambda request: HttpResponse())
+            return middleware.client_address(
+                factory.post("/login/", **{**headers, **extra}))
+
+        self.assertEqual(address(0), "10.0.0.1")
+        # The address the outermost proxy saw; earlier ones are the client's
+        self.assertEqual(address(1), "10.0.0.9")
+        self.assertEqual(address(2), "1.2.3.4")
+        self.assertEqual(address(5), "6.6.6.6")
+        self.assertEqual(address(2, HTTP_X_FORWARDED_FOR=""), "10.0.0.1")
+
+        with self.settings(RATE_LIMITS={"login": "1/h"},
+                           RATE_LIMIT_TRUSTED_PROXIES=1):
+            client = Client(REMOTE_ADDR="10.0.0.1")
+            for forwarded, status in (("1.2.3.4", 200), ("1.2.3.5", 200),
+                                      ("9.9.9.9, 1.2.3.4", 429)):
+                response = client.post(reverse("login"), {
+                    "username": "alice", "password": "wrong"},
+                    HTTP_X_FORWARDED_FOR=forwarded)
+                self.assertEqual(response.status_code, status)
+
+    def test_async_requests(self):
+        async def get_response(request):
+            return HttpResponse("view")
+
+        with self.settings(RATE_LIMITS={"bid": "1/h"}):
+            middleware = RateLimitMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        factory = RequestFactory()
+        requests = [factory.post(reverse("bid")) for _ in range(2)]
+        requests.append(factory.get(reverse("bid")))
+        for request in requests:
+            request.user = self.alice
+        statuses = [async_to_sync(middleware)(request).status_code
+                    for request in requests]
+        self.assertEqual(statuses, [200, 429, 200])
+
+    def test_async_stack_is_not_adapted(self):
+        # Django logs each sync/async bridge in the chain, with DEBUG on
+        with self.settings(DEBUG=True), \
+                self.assertLogs("django.request", "DEBUG") as logs:
+            BaseHandler().load_middleware(is_async=True)
+            logging.getLogger("django.request").debug("loaded")
+        self.assertFalse([line for line in logs.output
+                          if "RateLimitMiddleware" in line])
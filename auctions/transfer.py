@@ -0,0 +1,265 @@
+"""
+Bulk transfer of listings, as CSV or NDJSON.
+
+Both directions stream. ``read_rows()`` yields one row per input line;
+``import_rows()`` validates rows with ``ListingForm`` and writes them with
+``bulk_create`` a batch at a time, committing every ``chunk_size`` rows;
+``export_rows()`` walks the table with ``iterator()``. Memory use is
+bounded by the chunk size, not by the size of the catalogue.
+
+An export re-imports as it was, closed listings included: import honors
+``active`` (true when absent) and skips the future end time check for
+closed rows, though an open auction must still end in the future. The
+``id``, ``date_created`` and ``current_bid`` columns are informational;
+imported listings get new ids, today's date and no bids or winner.
+"""
+import csv
+import io
+import itertools
+import json
+from collections import Counter
+from dataclasses import dataclass
+from functools import partial
+
+from django import forms
+from django.db import transaction
+
+from .forms import ListingForm
+from .images import schedule as schedule_images
+from .models import Category, Listing, User
+from .related import invalidate_related
+from .search import get_backend
+from .stats import record_listings
+
+
+FORMATS = ("csv", "ndjson")
+
+# Columns written by export; import reads the ListingForm ones plus seller
+# and active
+EXPORT_FIELDS = ["id", "title", "description", "starting_bid", "image",
+                 "category", "seller", "ends_at", "active", "date_created",
+                 "current_bid"]
+
+# Rows per INSERT, and rows per transaction (and checkpoint)
+IMPORT_BATCH = 1000
+IMPORT_CHUNK = 10_000
+
+# Rows fetched per round trip while exporting
+EXPORT_CHUNK = 2000
+
+# Usernames resolved per query (keeps SQLite under its variable limit)
+SELLER_LOOKUP_BATCH = 500
+
+
+def guess_format(path):
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+# (line number, row dict or None, parse error or None) per input row:
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f"invalid JSON: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "expected a JSON object"
+            continue
+        yield number, row, None
+
+
+class RowForm(ListingForm):
+    """
+    ListingForm rebound to each row in turn: constructing a form per row
+    deep-copies all of its fields, which costs more than validating it.
+    """
+    active = forms.NullBooleanField(required=False)
+
+    def clean_ends_at(self):
+        # Checked in clean(), once the row's active flag is known
+        return self.cleaned_data["ends_at"]
+
+    def clean_active(self):
+        active = self.cleaned_data["active"]
+        if active is None:
+            if self.data.get("active", "") != "":
+                raise forms.ValidationError("Expected true or false.")
+            return True
+        return active
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Closed listings keep whatever end time they had
+        if cleaned_data.get("active") and "ends_at" in cleaned_data:
+            try:
+                super().clean_ends_at()
+            except forms.ValidationError as error:
+                self.add_error("ends_at", error)
+        return cleaned_data
+
+    def validate(self, data):
+        self.data = data
+        self.is_bound = True
+        self.instance = Listing()
+        self._errors = None
+        return self.is_valid()
+
+
+@dataclass
+class ImportResult:
+    # Input rows consumed, including skipped and rejected ones
+    consumed: int = 0
+    imported: int = 0
+    failed: int = 0
+
+
+def import_rows(rows, seller=None, batch_size=IMPORT_BATCH,
+                chunk_size=IMPORT_CHUNK, skip=0, on_error=None,
+                on_chunk=None):
+    """
+    Validate and insert ``rows`` from ``read_rows()``.
+
+    Rows name their seller by username in a ``seller`` column; ``seller``
+    is used for rows without one. The first ``skip`` rows are passed over,
+    to resume an earlier run. ``on_error(number, messages)`` is called per
+    rejected row and ``on_chunk(result)`` after each committed chunk.
+    """
+    result = ImportResult(consumed=skip)
+    rows = itertools.islice(rows, skip, None)
+    form = RowForm()
+    categories = {}
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return result
+
+        sellers = _sellers(row.get("seller") for _, row, _ in chunk if row)
+        with transaction.atomic():
+            created = []
+            pending = []
+            for number, row, error in chunk:
+                listing, messages = _build(form, row, error, seller,
+                                           sellers, categories)
+                if listing is None:
+                    result.failed += 1
+                    if on_error:
+                        on_error(number, messages)
+                    continue
+
+                pending.append(listing)
+                if len(pending) >= batch_size:
+                    created += Listing.objects.bulk_create(pending)
+                    pending = []
+            created += Listing.objects.bulk_create(pending)
+            _after_insert(created)
+
+        result.consumed += len(chunk)
+        result.imported += len(created)
+        if on_chunk:
+            on_chunk(result)
+
+
+def _sellers(usernames):
+    names = sorted({name for name in usernames if name})
+    found = {}
+    for start in range(0, len(names), SELLER_LOOKUP_BATCH):
+        found.update(User.objects.filter(
+            username__in=names[start:start + SELLER_LOOKUP_BATCH])
+            .values_list("username", "pk"))
+    return found
+
+
+def _build(form, row, error, default_seller, sellers, categories):
+    if error:
+        return None, [error]
+
+    if not form.validate({key: "" if value is None else value
+                          for key, value in row.items()}):
+        return None, [f"{name}: {message}"
+                      for name, messages in form.errors.items()
+                      for message in messages]
+
+    username = row.get("seller")
+    if username:
+        seller_id = sellers.get(username)
+        if seller_id is None:
+            return None, [f"seller: unknown user {username!r}"]
+    elif default_seller is not None:
+        seller_id = default_seller.pk
+    else:
+        return None, ["seller: no seller given"]
+
+    name = form.cleaned_data["category"]
+    if name not in categories:
+        categories[name] = Category.objects.for_name(name)
+
+    # The form has already copied the validated fields onto its instance
+    listing = form.instance
+    listing.seller_id = seller_id
+    listing.active = form.cleaned_data["active"]
+    listing.category = categories[name]
+    return listing, None
+
+
+def _after_insert(created):
+    # What create_item does per listing, once per chunk
+    counts = Counter(listing.category_id for listing in created
+                     if listing.active)
+    for category_id, count in counts.items():
+        Category.objects.adjust_active_count(category_id, count)
+        transaction.on_commit(partial(invalidate_related, category_id))
+    get_backend().index([listing.pk for listing in created])
+    record_listings(created)
+    schedule_images(created)
+
+
+# Every listing as a dict of EXPORT_FIELDS, read a chunk at a time:
+def export_rows(queryset=None, chunk_size=EXPORT_CHUNK):
+    if queryset is None:
+        queryset = Listing.objects.all()
+
+    listings = queryset.select_related("seller", "category") \
+        .with_current_bid().order_by("pk")
+    for listing in listings.iterator(chunk_size=chunk_size):
+        yield {
+            "id": listing.pk,
+            "title": listing.title,
+            "description": listing.description,
+            "starting_bid": listing.starting_bid,
+            "image": listing.image,
+            "category": listing.category.name,
+            "seller": listing.seller.username,
+            "ends_at": listing.ends_at.isoformat()
+            if listing.ends_at else None,
+            "active": listing.active,
+            "date_created": listing.date_created.isoformat(),
+            "current_bid": listing.top_offer,
+        }
+
+
+# Serialized lines (header first, for CSV) for rows from export_rows():
+def encode_rows(rows, fmt):
+    if fmt == "ndjson":
+        for row in rows:
+            yield json.dumps(row) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in itertools.chain([None], rows):
+        if row is not None:
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
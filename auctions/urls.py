@@ -1,17 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
+
+# The hot read views, native async for ASGI deployments (see async_views)
+reads = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("", views.index, name="index"),
+    path("", reads.index, name="index"),
     path("create/", views.create_item, name="create"),
-    path("listing/<int:item_id>/", views.listing, name="listing"),
+    path("listing/<int:item_id>/", reads.listing, name="listing"),
+    path("listing/<int:item_id>/comments/", views.listing_comments,
+         name="listing_comments"),
+    path("listing/<int:item_id>/events/", views.listing_events,
+         name="listing_events"),
     path("bidding/", views.bidding, name="bid"),
+    path("bidding/proxy/", views.proxy_bidding, name="proxy_bid"),
     path("status/", views.bid_status, name="status"),
-    path("watchlist/", views.watchlist, name="watchlist"),
+    path("watchlist/", reads.watchlist, name="watchlist"),
     path("comments/", views.create_comments, name="comments"),
-    path("categories/", views.categories, name="categories"),
-    path("categories/<str:category_name>/", views.category, name="a_category"),
+    path("categories/", reads.categories, name="categories"),
+    path("categories/<slug:slug>/", reads.category, name="a_category"),
+    path("search/", views.search, name="search"),
+    path("stats/", views.stats, name="stats"),
+    path("export/", views.export_listings, name="export"),
+    path("images/<str:digest>/<str:rendition>", views.listing_image,
+         name="image"),
+    path("metrics", views.metrics, name="metrics"),
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:item_id>", api.listing, name="api_listing"),
+    path("api/v1/categories", api.categories, name="api_categories"),
     path("login/", views.login_view, name="login"),
     path("logout/", views.logout_view, name="logout"),
     path("register/", views.register, name="register"),
@@ -1,89 +1,195 @@
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (FileResponse, HttpResponse, HttpResponseNotFound,
+                         HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
 
 from django.core.exceptions import ObjectDoesNotExist
 
-from .models import User, Listing, Watchlist, Bid, Comment
-from .forms import ListingForm, BidForm, CommentForm
+from .models import User, Category, Listing, Watchlist, Bid, Comment
+from .forms import ListingForm, BidForm, CommentForm, ProxyBidForm
+from .images import locate as locate_image, schedule as schedule_images
+from .notifications import notify_closed
+from .bidding import BidRejected, place_bid, place_proxy
+from .events import broker, publish_on_commit
+from .pagination import keyset_page
+from .profiling import registry as metrics_registry
+from .related import invalidate_related, related_listings
+from .search import get_backend as search_backend, index_listing
+from .stats import (record_closings, record_listings, recent_days,
+                    top_bidders, top_categories, top_sellers)
+from .transfer import encode_rows, export_rows
+from .watchlists import invalidate_watched, watched_ids
+
+
+# Number of listing cards rendered per page
+LISTINGS_PER_PAGE = 24
+
+# Comments rendered with a listing, and served per follow-up page
+COMMENTS_PER_PAGE = 20
+
+# Catalogue export formats, and lines sent per write
+EXPORT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_LINES_PER_WRITE = 500
+
+# Browser cache lifetime of stored listing images, in seconds
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# Active listings annotated with their current bid, in a single query:
+def listing_feed():
+    return Listing.objects.filter(active=True) \
+        .select_related("seller").with_current_bid()
+
+
+# A listing's comments with their authors, and their page order:
+def comment_thread(item_id):
+    return Comment.objects.filter(item_id=item_id).select_related("author")
+
+
+COMMENT_ORDER = ("date_published", "id")
 
 
-# Default page (displays all the listings):
+# One page of a listing's comments, newest first:
+def comment_page(item_id, cursor=None):
+    return keyset_page(comment_thread(item_id), cursor, COMMENTS_PER_PAGE,
+                       fields=COMMENT_ORDER)
+
+
+# Default page (displays the active listings, newest first):
 def index(request):
-    active_listings = Listing.objects.filter(active=True)
+    active_listings, next_cursor = keyset_page(listing_feed(),
+                                               request.GET.get("cursor"),
+                                               LISTINGS_PER_PAGE)
 
     return render(request,
-                  "auctions/index.html", {"listings": active_listings})
+                  "auctions/index.html", {"listings": active_listings,
+                                          "next_cursor": next_cursor})
 
 
 # View for each Individual listing:
 def listing(request, item_id):
     if request.method == "GET":
-        all_listings = Listing.objects.all()
 
         # Get listing and comments data
         try:
-            listing = Listing.objects.get(pk=item_id)
-            comments = Comment.objects.filter(item=listing)
+            listing = Listing.objects.select_related("seller", "category") \
+                .get(pk=item_id)
 
         # 404
         except ObjectDoesNotExist:
             return render(request, "auctions/error_page.html",
                           {"error": "Listing not found."})
 
-        # Check if user is authenticated
-        try:
-            user_id = request.user.id
-            current_user = User.objects.get(pk=user_id)
+        # First page of comments; the page fetches the rest as JSON
+        comments, comments_cursor = comment_page(listing.pk)
+
+        # Sidebar listings (cached, bounded in size)
+        related = related_listings(listing)
+
+        # The user AuthenticationMiddleware loaded for the request
+        current_user = request.user
 
         # If user is anonymous
-        except ObjectDoesNotExist:
+        if not current_user.is_authenticated:
             return render(request, "auctions/listing.html",
                           {"listing": listing, "comments": comments,
-                           "user": None, "all_listings": all_listings})
+                           "comments_cursor": comments_cursor,
+                           "user": None, "related": related})
 
-        # Watchlist data for current user
-        user_watchlist = Watchlist.objects.get(user=current_user)
-        watchlist_items = user_watchlist.listings.all()
+        # Whether the listing is on the user's (cached) watchlist
+        is_watched = listing.pk in watched_ids(current_user)
 
         # Bid data
         try:
-            current_bid = Bid.objects.get(listing=listing)
+            current_bid = Bid.objects.select_related("bidder", "seller") \
+                .get(listing=listing)
 
         except ObjectDoesNotExist:
             current_bid = None
 
         # Form fields
         form = BidForm()
+        proxy_form = ProxyBidForm()
         comment_form = CommentForm()
 
         return render(request, "auctions/listing.html",
                       {"user": current_user, "listing": listing,
-                       "bid": current_bid, "watchlist": watchlist_items,
-                       "form": form, "comment": comment_form,
-                       "comments": comments, "all_listings": all_listings})
+                       "bid": current_bid, "is_watched": is_watched,
+                       "form": form, "proxy_form": proxy_form,
+                       "comment": comment_form,
+                       "comments": comments,
+                       "comments_cursor": comments_cursor,
+                       "related": related})
 
     # POST
     if request.method == "POST":
 
-        user_id = request.user.id
-        current_user = User.objects.get(pk=user_id)
+        current_user = request.user
 
         if "delete-comment" in request.POST:
             comment_pk = request.POST["comment-pk"]
-            comment = Comment.objects.get(pk=comment_pk)
-            if comment.author == current_user:
-                comment.delete()
-                item = comment.item
-                return HttpResponseRedirect(reverse("listing", args=[item.pk]))
+
+            # Deleting by author in one statement; a repeated or foreign
+            # delete removes nothing and leaves the count alone
+            deleted, _ = Comment.objects.filter(
+                pk=comment_pk, item_id=item_id,
+                author_id=current_user.pk).delete()
+            if deleted:
+                Listing.objects.filter(pk=item_id).adjust_comment_count(-1)
+                return HttpResponseRedirect(reverse("listing",
+                                                    args=[item_id]))
 
         return render(request, "auctions/error_page.html",
                       {"error": "Error."})
 
 
+# Follow-up pages of a listing's comments, as JSON:
+def listing_comments(request, item_id):
+    comments, next_cursor = comment_page(item_id, request.GET.get("cursor"))
+
+    return JsonResponse({
+        "comments": [{
+            "id": comment.pk,
+            "author": comment.author.username,
+            "content": comment.content,
+            "date_published": comment.date_published.isoformat(),
+            "deletable": comment.author_id == request.user.id,
+        } for comment in comments],
+        "next_cursor": next_cursor,
+    })
+
+
+# Live updates for a listing, as server-sent events (ASGI only):
+async def listing_events(request, item_id):
+
+    # Under WSGI the stream would tie up a worker thread per client
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("Live updates need the ASGI server.",
+                            status=501)
+
+    if not await Listing.objects.filter(pk=item_id).aexists():
+        return HttpResponseNotFound("Listing not found.")
+
+    response = StreamingHttpResponse(broker.stream(item_id),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 # View for creating a new listing
 @login_required(login_url="login")
 def create_item(request):
@@ -102,19 +208,22 @@ def create_item(request):
             desc = form.cleaned_data["description"]
             st_bid = form.cleaned_data["starting_bid"]
             image = form.cleaned_data["image"]
-            category = form.cleaned_data["category"]
-            if category == "":
-                category = "Unspecified"
-
-            # get the current user to set it as the seller
-            user_id = request.user.id
-            current_user = User.objects.get(pk=user_id)
-
-            # create a new Listing instance and save the data to the database
-            new_item = Listing(seller=current_user, title=title,
-                               description=desc, starting_bid=st_bid,
-                               image=image, category=category)
-            new_item.save()
+            ends_at = form.cleaned_data["ends_at"]
+
+            # create a new Listing instance and save the data to the database,
+            # with the current user as the seller, together with its counts
+            with transaction.atomic():
+                category = Category.objects.for_name(
+                    form.cleaned_data["category"])
+                new_item = Listing(seller=request.user, title=title,
+                                   description=desc, starting_bid=st_bid,
+                                   image=image, category=category,
+                                   ends_at=ends_at)
+                new_item.save()
+                Category.objects.adjust_active_count(category.pk, 1)
+                record_listings([new_item])
+                schedule_images([new_item])
+            invalidate_related(category.pk)
 
             # redirect to the listing's page
             return HttpResponseRedirect(reverse("listing", args=[new_item.pk]))
@@ -141,57 +250,69 @@ def bidding(request):
 
         # Get listing data
         listing = Listing.objects.get(pk=item_id)
-        price = listing.starting_bid
-        seller = listing.seller
 
         # Get current user data
-        user_id = request.user.id
-        user = User.objects.get(pk=user_id)
-
-        # Form validation, and making sure a seller can't bid on own item
-        if form.is_valid() and user != listing.seller:
+        user = request.user
 
-            # Clean form data
-            offer = form.cleaned_data["offer"]
+        if form.is_valid():
 
-            # Attempt to collect existing bid data
+            # Move the listing's price forward and record the offer
             try:
-                latest_bid = Bid.objects.get(listing=listing)
-                if latest_bid.is_open is False:
-                    return render(request, "auctions/error_page.html",
-                                  {"error": "Auction is closed."})
+                place_bid(listing, user, form.cleaned_data["offer"])
 
-                latest_offer = latest_bid.offer
-                offers_count = latest_bid.offer_count
+            except BidRejected as error:
+                return render(request, "auctions/error_page.html",
+                              {"error": str(error), "listing_pk": item_id})
 
-                # Delete previous bid data if new offer is legit
-                if int(offer) > latest_offer:
-                    latest_bid.delete()
+            # The price may be a proxy's answer to this offer
+            _publish_bid(item_id)
 
-            # If no existing bid data exists:
-            except ObjectDoesNotExist:
-                latest_offer = 0
-                offers_count = 0
+            # Redirect back to the listing's link
+            return HttpResponseRedirect(reverse("listing", args=[item_id]))
 
-            # Check if offer is legit on both counts
-            if int(offer) >= price and int(offer) > latest_offer:
+    return render(request, "auctions/error_page.html",
+                  {"error": "Invalid request."})
 
-                count = offers_count + 1
-                new_bid = Bid(listing=listing, seller=seller,
-                              starting_bid=price, offer=offer,
-                              bidder=user, offer_count=count)
-                new_bid.save()
 
-                # Redirect back to the listing's link
-                return HttpResponseRedirect(reverse("listing", args=[item_id]))
+# View for setting an automatic (proxy) bid
+@login_required(login_url="login")
+def proxy_bidding(request):
+    if request.method == "POST":
 
-            return render(request, "auctions/error_page.html",
-                          {"error": "Bid is too low."})
+        form = ProxyBidForm(request.POST)
+        item_id = int(request.POST["listing"])
+        listing = Listing.objects.get(pk=item_id)
+        user = request.user
+
+        if form.is_valid():
+
+            # Store the maximum and settle it against the other proxies
+            try:
+                _, offer = place_proxy(listing, user,
+                                       form.cleaned_data["maximum"])
+
+            except BidRejected as error:
+                return render(request, "auctions/error_page.html",
+                              {"error": str(error), "listing_pk": item_id})
+
+            if offer is not None:
+                _publish_bid(item_id)
+
+            return HttpResponseRedirect(reverse("listing", args=[item_id]))
 
     return render(request, "auctions/error_page.html",
                   {"error": "Invalid request."})
 
 
+def _publish_bid(item_id):
+    # The committed price record, read in one query. A proxy's answer is a
+    # bid of its own, so pages are sent the count rather than adding one
+    offer, bidder, offer_count = Bid.objects.filter(listing_id=item_id) \
+        .values_list("offer", "bidder__username", "offer_count").get()
+    publish_on_commit(item_id, "bid", {
+        "offer": offer, "bidder": bidder, "offer_count": offer_count})
+
+
 # View for closing/opening bids
 @login_required(login_url="login")
 def bid_status(request):
@@ -206,27 +327,18 @@ def bid_status(request):
             listing = Listing.objects.get(pk=item_id)
 
             # Get current user data
-            user_id = request.user.id
-            user = User.objects.get(pk=user_id)
+            user = request.user
 
             # Checks if user has access to the listing
-            if user == listing.seller:
-
-                # Get the bid data for the listing
-                bid = Bid.objects.get(listing=listing)
-
-                # Change the is_open field's value as required
-                # As well as the corresponding active value in Listing
-                if action == "Close Auction":
-                    bid.is_open = False
-                    listing.active = False
+            if user.pk == listing.seller_id:
 
-                elif action == "Open Auction":
-                    bid.is_open = True
-                    listing.active = True
-
-                bid.save()
-                listing.save()
+                closing = action == "Close Auction"
+                if closing or action == "Open Auction":
+                    # All in one transaction, through conditional updates:
+                    # a bid or expiry racing us is neither overwritten nor
+                    # counted twice
+                    with transaction.atomic():
+                        _set_open(listing, not closing)
 
             else:
                 return render(request, "auctions/error_page.html",
@@ -239,28 +351,179 @@ def bid_status(request):
                   {"error_page": "Page not found"})
 
 
-# View for listing all categories
-def categories(request):
+def _set_open(listing, is_open):
+    # Only a listing still in the other state changes; closing copies the
+    # winner from the current bid, reopening drops the end time that may
+    # have closed it. A sale counts in the statistics only while the
+    # listing has a winner, so reopening takes it back out only then
+    listings = Listing.objects.filter(pk=listing.pk, active=not is_open)
+    if is_open:
+        reopen = {"active": True, "winner": None, "ends_at": None}
+        sold = listings.filter(winner__isnull=False).bump_version(**reopen)
+        changed = sold or listings.bump_version(**reopen)
+    else:
+        winner = Bid.objects.filter(listing=OuterRef("pk")).values("bidder")
+        changed = sold = listings.bump_version(active=False,
+                                               winner=Subquery(winner[:1]))
+    if not changed:
+        return
+
+    bids = Bid.objects.filter(listing_id=listing.pk)
+    bids.update(is_open=is_open)
+
+    # Keep the category's active count and the sales totals in step with
+    # the change, and notify the watchers of a close
+    Category.objects.adjust_active_count(listing.category_id,
+                                         1 if is_open else -1)
+    sale = bids.values_list("seller_id", "bidder_id", "offer").first()
+    if sold and sale is not None:
+        seller_id, bidder_id, offer = sale
+        record_closings([(seller_id, bidder_id, listing.category_id, offer)],
+                        sign=-1 if is_open else 1)
+    if not is_open:
+        notify_closed([listing.pk])
+
+    # Once committed, or a concurrent request could refill the cache with
+    # the listing as it was
+    transaction.on_commit(lambda: invalidate_related(listing.category_id))
+    index_listing(listing)
+    publish_on_commit(listing.pk, "status", {"open": is_open})
+
+
+# View for exporting the whole catalogue (staff only), streamed as it's read
+@staff_member_required(login_url="login")
+def export_listings(request):
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in EXPORT_TYPES:
+        return HttpResponse("Unknown export format.", status=400)
+
+    lines = encode_rows(export_rows(), fmt)
+    # Under ASGI a plain iterator would be read into memory up front
+    if isinstance(request, ASGIRequest):
+        content = _read_async(lines)
+    else:
+        content = _read(lines)
+
+    response = StreamingHttpResponse(content,
+                                     content_type=EXPORT_TYPES[fmt])
+    response["Content-Disposition"] = \
+        f'attachment; filename="listings.{fmt}"'
+    return response
 
-    listings = Listing.objects.all()
-    categories_list = []
 
-    for listing in listings:
-        categories_list.append(listing.category)
+def _read(lines):
+    while True:
+        chunk = list(itertools.islice(lines, EXPORT_LINES_PER_WRITE))
+        if not chunk:
+            return
+        yield "".join(chunk)
 
-    all_categories = set(categories_list)
+
+async def _read_async(lines):
+    chunks = _read(lines)
+    # Thread-sensitive (the default), so every step runs on the one thread
+    # that owns the open database cursor
+    next_chunk = sync_to_async(lambda: next(chunks, None))
+    while (chunk := await next_chunk()) is not None:
+        yield chunk
+
+
+# View for listing all categories
+def categories(request):
+
+    all_categories = Category.objects.order_by("name")
 
     return render(request, "auctions/category_list.html",
                   {"categories": all_categories})
 
 
 # View for each category
-def category(request, category_name):
-    group = Listing.objects.filter(category=category_name, active=True)
+def category(request, slug):
+    try:
+        current_category = Category.objects.get(slug=slug)
+
+    except ObjectDoesNotExist:
+        return render(request, "auctions/error_page.html",
+                      {"error": "Category not found."})
+
+    group, next_cursor = keyset_page(
+        listing_feed().filter(category=current_category),
+        request.GET.get("cursor"), LISTINGS_PER_PAGE)
 
     return render(request, "auctions/category.html",
                   {"group": group,
-                   "title": category_name})
+                   "category": current_category,
+                   "title": current_category.name,
+                   "next_cursor": next_cursor})
+
+
+# View for searching listings
+def search(request):
+    query = request.GET.get("q", "").strip()
+    status = request.GET.get("status", "active")
+
+    results, next_cursor = search_backend().search(
+        query,
+        min_price=_price(request.GET.get("min_price")),
+        max_price=_price(request.GET.get("max_price")),
+        active={"active": True, "closed": False}.get(status),
+        cursor=request.GET.get("cursor"))
+
+    # Keep the query and filters on the "more results" link
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params["cursor"] = next_cursor
+        next_query = params.urlencode()
+
+    return render(request, "auctions/search.html",
+                  {"results": results, "query": query, "status": status,
+                   "min_price": request.GET.get("min_price", ""),
+                   "max_price": request.GET.get("max_price", ""),
+                   "next_query": next_query})
+
+
+def _price(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# View for the leaderboards and recent activity
+def stats(request):
+    return render(request, "auctions/stats.html",
+                  {"bidders": top_bidders(), "sellers": top_sellers(),
+                   "categories": top_categories(), "days": recent_days()})
+
+
+# View for the profiling metrics, in Prometheus' text format
+def metrics(request):
+    if not settings.PROFILING:
+        return HttpResponseNotFound()
+
+    return HttpResponse(metrics_registry.render(),
+                        content_type="text/plain; version=0.0.4")
+
+
+# View for stored listing images (see auctions/images.py)
+@require_safe
+def listing_image(request, digest, rendition):
+    found = locate_image(digest, rendition)
+    if found is None:
+        return HttpResponseNotFound()
+
+    # A digest's files never change
+    etag = f'"{digest}-{rendition}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        path, content_type = found
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=IMAGE_MAX_AGE,
+                        immutable=True)
+    return response
 
 
 # View for watchlists
@@ -268,15 +531,14 @@ def category(request, category_name):
 def watchlist(request):
 
     # Get the currently logged-in user
-    user_id = request.user.id
-    current_user = User.objects.get(pk=user_id)
-
-    # get the current user's watchlist
-    user_watchlist = Watchlist.objects.get(user=current_user)
+    current_user = request.user
 
     # If it is a post request:
     if request.method == "POST":
 
+        # get the current user's watchlist
+        user_watchlist = Watchlist.objects.get(user=current_user)
+
         # Collect data from the post, including the item being added
         form = request.POST
         item_id = form["item_id"]
@@ -287,25 +549,35 @@ def watchlist(request):
             user_watchlist.listings.add(current_item)
         elif form["state"] == "Remove":
             user_watchlist.listings.remove(current_item)
+        invalidate_watched(current_user.pk)
 
         # Refresh the current Listing's page
         return HttpResponseRedirect(reverse("listing", args=[current_item.pk]))
 
-    # If it's a get request, display the Watchlist page
-    watchlist_items = user_watchlist.listings.all()
+    # If it's a get request, display a page of the Watchlist
+    watchlist_items, next_cursor = keyset_page(
+        Listing.objects.filter(watchlist_in__user=current_user)
+        .select_related("seller").with_current_bid(),
+        request.GET.get("cursor"), LISTINGS_PER_PAGE)
+
+    message = ""
+    if not watchlist_items and not request.GET.get("cursor"):
+        message = "Your watchlist is empty."
+
     return render(request, "auctions/watchlist.html",
-                  {"watchlist": watchlist_items})
+                  {"watchlist": watchlist_items, "message": message,
+                   "next_cursor": next_cursor})
 
 
 # View for creating comments
+@login_required(login_url="login")
 def create_comments(request):
     if request.method == "POST":
 
         item_id = int(request.POST["listing"])
         listing = Listing.objects.get(pk=item_id)
 
-        user_id = request.user.id
-        current_user = User.objects.get(pk=user_id)
+        current_user = request.user
 
         form = CommentForm(request.POST)
 
@@ -316,6 +588,11 @@ def create_comments(request):
                                   author=current_user)
 
             new_comment.save()
+            Listing.objects.filter(pk=item_id).adjust_comment_count(1)
+            publish_on_commit(item_id, "comment", {
+                "author": current_user.username,
+                "content": new_comment.content,
+                "date_published": new_comment.date_published.isoformat()})
 
         return HttpResponseRedirect(reverse("listing", args=[item_id]))
 
@@ -0,0 +1,44 @@
+import time
+
+from django.core.cache import cache
+
+from .models import Watchlist
+from .profiling import record_cache
+from .routers import cached_from_primary
+
+
+WATCHED_TIMEOUT = 60 * 60 * 24
+
+
+def _version_key(user_id):
+    return f"watchlist:{user_id}:version"
+
+
+def _version(user_id):
+    # Seeded from the clock so a lost version key can't revive stale sets
+    return cache.get_or_set(_version_key(user_id),
+                            lambda: int(time.time() * 1000), None)
+
+
+# Ids of every listing on the user's watchlist, as a cached set:
+def watched_ids(user):
+    key = f"watchlist:{user.pk}:{_version(user.pk)}:ids"
+    ids = cache.get(key)
+    record_cache("watchlist", ids is not None)
+
+    if ids is None:
+        ids = frozenset(
+            cached_from_primary(Watchlist.listings.through.objects)
+            .filter(watchlist__user=user)
+            .values_list("listing_id", flat=True))
+        cache.set(key, ids, WATCHED_TIMEOUT)
+
+    return ids
+
+
+# Retire the cached set after the user adds or removes a listing:
+def invalidate_watched(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), int(time.time() * 1000), None)
@@ -3,6 +3,11 @@ ASGI config for commerce project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this entry point (for example with
+``uvicorn commerce.asgi:application``) to enable the live listing event
+streams at ``listing/<id>/events/``; each connected browser is then a
+suspended coroutine instead of a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,11 +44,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auctions.profiling.ProfilingMiddleware',
+    'auctions.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'auctions.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'auctions.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,6 +80,18 @@ WSGI_APPLICATION = 'commerce.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
+#
+# COMMERCE_DB_PROFILE picks the database setup:
+#   development  the local SQLite file with SQLite's defaults (the default)
+#   sqlite       the same file tuned for concurrent requests: WAL journal
+#                (readers don't wait for the writer), a busy timeout, NORMAL
+#                syncing and memory-mapped reads
+#   postgres     PostgreSQL from the POSTGRES_* variables, with persistent,
+#                health-checked connections; set POSTGRES_POOLER=pgbouncer
+#                when connecting through PgBouncer in transaction mode
+# An entry's PRAGMAS are run on each new connection (auctions/database.py).
+
+DATABASE_PROFILE = os.environ.get('COMMERCE_DB_PROFILE', 'development')
 
 DATABASES = {
     'default': {
@@ -82,8 +100,207 @@ DATABASES = {
     }
 }
 
+if DATABASE_PROFILE == 'sqlite':
+    DATABASES['default']['PRAGMAS'] = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+
+elif DATABASE_PROFILE == 'postgres':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'commerce'),
+        'USER': os.environ.get('POSTGRES_USER', 'commerce'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Reuse each thread's connection across requests, checking it
+        # first so a dropped one is replaced rather than failing a request
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+    }
+    if os.environ.get('POSTGRES_POOLER') == 'pgbouncer':
+        # Consecutive transactions may run on different server
+        # connections, so a cursor can't be held open across them
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+elif DATABASE_PROFILE != 'development':
+    raise ImproperlyConfigured(
+        f'Unknown COMMERCE_DB_PROFILE {DATABASE_PROFILE!r}')
+
+
+# Read replicas
+# Browse traffic reads from a replica, except for users who wrote in the
+# last REPLICA_PIN_SECONDS (see auctions/routers.py). PostgreSQL replicas
+# are listed in POSTGRES_REPLICA_HOSTS; with SQLite, COMMERCE_REPLICA=1
+# adds a second file, db-replica.sqlite3, refreshed from the primary by
+# `manage.py sync_replica`. Tests read replicas through the primary.
+
+if DATABASE_PROFILE == 'postgres':
+    for number, host in enumerate(filter(None, os.environ.get(
+            'POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica{number}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'TEST': {'MIRROR': 'default'},
+        }
+
+elif os.environ.get('COMMERCE_REPLICA') == '1':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+
+REPLICA_PIN_SECONDS = 5
+
+DATABASE_ROUTERS = ['auctions.routers.ReplicaRouter']
+
 AUTH_USER_MODEL = 'auctions.User'
 
+# Signed-in users are read from the default cache rather than the user
+# table on every request (see auctions/backends.py)
+AUTHENTICATION_BACKENDS = ['auctions.backends.CachedModelBackend']
+
+
+# Sessions
+# COMMERCE_SESSIONS picks where sessions are kept:
+#   db              the database, read on every request (the default)
+#   cached_db       the database, read through the default cache; needs a
+#                   cache shared by all worker processes, or a logout in one
+#                   leaves the others' copies of the session signed in
+#   signed_cookies  a signed cookie in the browser, so no session queries at
+#                   all; but a cookie can't be revoked before it expires,
+#                   and logging out only clears the browser's copy
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSIONS = os.environ.get('COMMERCE_SESSIONS', 'db')
+
+if SESSIONS not in SESSION_ENGINES:
+    raise ImproperlyConfigured(f'Unknown COMMERCE_SESSIONS {SESSIONS!r}')
+
+SESSION_ENGINE = SESSION_ENGINES[SESSIONS]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'commerce-default',
+    },
+    # Rendered template fragments, keyed on listing id and version (or a
+    # comment's content). Related rows, such as a renamed seller or
+    # category, aren't in the key, so the templates also expire fragments
+    # after a day; MAX_ENTRIES evicts the least recently used first
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'commerce-fragments',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    # Rate limit buckets; per process, unless pointed at a shared backend
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'commerce-ratelimit',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+
+# Rate limiting
+# Token buckets for the endpoints that write, by URL name: '30/m' allows
+# bursts of 30 requests, refilled at 30 a minute. Buckets are per user, or
+# per IP address for anonymous clients (see auctions/ratelimit.py). An
+# empty RATE_LIMITS turns it off.
+
+RATE_LIMITS = {
+    'bid': '30/m',
+    'proxy_bid': '30/m',
+    'comments': '10/m',
+    'login': '10/m',
+    'register': '5/h',
+}
+
+RATE_LIMIT_CACHE = 'ratelimit'
+
+# Reverse proxies in front of the app, each appending the address it was
+# connected from to RATE_LIMIT_CLIENT_HEADER; anonymous clients are told
+# apart by the address the outermost one saw. With none, REMOTE_ADDR.
+
+RATE_LIMIT_TRUSTED_PROXIES = int(
+    os.environ.get('COMMERCE_TRUSTED_PROXIES', '0'))
+
+RATE_LIMIT_CLIENT_HEADER = 'HTTP_X_FORWARDED_FOR'
+
+
+# Async views
+# Serve the hot read views (index, listing, categories, watchlist) as
+# native async views; for ASGI deployments only (see auctions/async_views.py)
+
+ASYNC_VIEWS = os.environ.get('COMMERCE_ASYNC_VIEWS') == '1'
+
+
+# Profiling
+# Per-view timings at /metrics plus cProfile dumps of the slowest sampled
+# requests (see auctions/profiling.py). Off unless COMMERCE_PROFILING=1.
+
+PROFILING = os.environ.get('COMMERCE_PROFILING') == '1'
+
+PROFILING_SAMPLE_RATE = 0.01
+
+PROFILING_SLOWEST = 10
+
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+
+# Listing images
+# Fetched once by background workers and stored, with resized renditions,
+# under IMAGES_DIR (see auctions/images.py). IMAGE_WORKERS = 0 leaves them
+# for the process_images command.
+
+IMAGES_DIR = os.path.join(BASE_DIR, 'image_cache')
+
+IMAGE_WORKERS = int(os.environ.get('COMMERCE_IMAGE_WORKERS', '2'))
+
+IMAGE_FETCHER = 'auctions.images.HTTPFetcher'
+
+IMAGE_FETCHER_OPTIONS = {}
+
+
+# Notifications
+# Outbid and auction-closed notices are queued in an outbox table with the
+# change they report, and sent by the dispatch_notifications worker (see
+# auctions/notifications.py). Unless COMMERCE_EMAIL_BACKEND says otherwise,
+# mail is written to files under EMAIL_FILE_PATH instead of sent.
+
+NOTIFICATION_TRANSPORT = 'auctions.notifications.EmailTransport'
+
+NOTIFICATION_TRANSPORT_OPTIONS = {}
+
+EMAIL_BACKEND = os.environ.get(
+    'COMMERCE_EMAIL_BACKEND',
+    'django.core.mail.backends.filebased.EmailBackend')
+
+EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_mail')
+
+DEFAULT_FROM_EMAIL = 'auctions@localhost'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -122,4 +339,25 @@ USE_TZ = False
 
 STATIC_URL = '/static/'
 
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Static asset pipeline
+# With COMMERCE_STATIC_PIPELINE=1, collectstatic writes content-hashed,
+# precompressed copies of the assets to STATIC_ROOT, and the application
+# serves them itself with immutable cache headers (see
+# auctions/staticfiles.py), so no separate static server is needed.
+
+STATIC_PIPELINE = os.environ.get('COMMERCE_STATIC_PIPELINE') == '1'
+
+if STATIC_PIPELINE:
+    STORAGES = {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        },
+        'staticfiles': {
+            'BACKEND':
+                'auctions.staticfiles.CompressedManifestStaticFilesStorage',
+        },
+    }
+
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'